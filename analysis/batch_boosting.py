@@ -0,0 +1,1060 @@
+"""Boosting for all responses (e.g., EEG sensors) in a single batch
+
+:func:`eelbrain.boosting` estimates a TRF for each response and each
+cross-validation split as an independent coordinate descent, each of which
+evaluates every candidate step on the time series. Here, the gradients of
+all responses and splits are kept in one (run, predictor x lag) array, so
+that each boosting iteration selects and applies the best step for all runs
+that are still active in a few array operations, while runs that have
+stopped are masked:
+
+ - With the ``l2`` error, the training and validation error of every
+   candidate step follow from the lagged covariance statistics
+   (:mod:`lagged_covariance`) and the gradients ``X'y - X'X h`` of the
+   current TRF.
+ - With the ``l1`` error, the change in the training error of a step ``d``
+   is ``-d X' sign(r)`` for the residual ``r``, except at the samples where
+   the step changes the sign of the residual (``|r| < |d x|``). The
+   gradients ``X' sign(r)`` are updated at the samples whose sign changed,
+   and the error is corrected at the few samples with small residuals.
+
+The iterations replicate :func:`eelbrain.boosting` (normalization, padding,
+cross-validation splits, step size reduction, early stopping and
+``selective_stopping``), so that the TRFs agree with :func:`eelbrain.boosting`
+up to floating point precision. :func:`boosting_models` estimates several
+models that share predictors (e.g., full and null models for a model
+comparison) in one batch, computing the statistics of each shared predictor
+only once.
+
+Run this module as a script for a benchmark with simulated data.
+"""
+from math import ceil
+import time as _time
+import warnings
+
+import eelbrain
+import numpy
+import scipy.ndimage
+import scipy.signal
+
+from impulses import ImpulsePredictor, is_impulse_predictor
+from lagged_covariance import LaggedCovariance
+
+
+class BatchBoostingResult:
+    """Result of :func:`boosting`
+
+    Attributes
+    ----------
+    h : NDVar | tuple of NDVar
+        TRF for each predictor, for normalized data (as
+        :attr:`eelbrain.BoostingResult.h`).
+    h_scaled : NDVar | tuple of NDVar
+        TRF in the units of the data (as
+        :attr:`eelbrain.BoostingResult.h_scaled`).
+    h_failed : array of bool
+        For each response, whether boosting failed in all splits.
+    proportion_explained : NDVar | float | None
+        Cross-validated proportion of the variability (``l1`` or ``l2``
+        norm, according to ``error``) explained in the test partitions (only
+        with ``test=1``).
+    r : NDVar | float | None
+        Cross-validated correlation between the response and the
+        prediction in the test partitions (only with ``test=1``).
+    x : str | tuple of str
+        Name of each predictor.
+    error : str
+        Error function.
+    i_test : int | None
+        Test partition (for results in ``partition_results``).
+    partition_results : list of BatchBoostingResult | None
+        Result for each test partition (only with ``partition_results=True``).
+    n_iterations : int
+        Number of boosting iterations of the longest run.
+    t_run : float
+        Time for fitting (in seconds).
+    """
+    def __init__(self, h, h_scaled, h_failed, proportion_explained, r, x, error, tstart, tstop, n_iterations, t_run, i_test=None, partition_results=None):
+        self.h = h
+        self.h_scaled = h_scaled
+        self.h_failed = h_failed
+        self.proportion_explained = proportion_explained
+        self.r = r
+        self.x = x
+        self.error = error
+        self.tstart = tstart
+        self.tstop = tstop
+        self.n_iterations = n_iterations
+        self.t_run = t_run
+        self.i_test = i_test
+        self.partition_results = partition_results
+
+    def __repr__(self):
+        return f"<BatchBoostingResult: {self.tstart} - {self.tstop}, {self.error}, {self.n_iterations} iterations>"
+
+    def partition_result_data(self):
+        """Results from the different test partitions in a :class:`Dataset` (as :meth:`eelbrain.BoostingResult.partition_result_data`)"""
+        if self.partition_results is None:
+            raise RuntimeError("No partition results; use boosting(..., partition_results=True)")
+        xs = [self.x] if isinstance(self.x, str) else list(self.x)
+        rows = []
+        for res in self.partition_results:
+            hs = [res.h] if isinstance(self.x, str) else res.h
+            rows.append([res.i_test, res.r, res.proportion_explained, *hs])
+        return eelbrain.Dataset.from_caselist(['i_test', 'r', 'det', *xs], rows)
+
+
+class _History:
+    """Boosting steps of each run (as the linked list of steps in eelbrain)"""
+    def __init__(self, e_train, capacity=256):
+        n_runs = len(e_train)
+        self.n = numpy.ones(n_runs, int)
+        self.i_step = numpy.full((n_runs, capacity), -1)
+        self.feature = numpy.full((n_runs, capacity), -1)
+        self.delta = numpy.zeros((n_runs, capacity))
+        self.e_test = numpy.zeros((n_runs, capacity))
+        self.e_train = numpy.zeros((n_runs, capacity))
+        self.e_train[:, 0] = e_train
+
+    def push(self, runs, i_step, feature, delta, e_train):
+        capacity = self.i_step.shape[1]
+        if self.n[runs].max() >= capacity:
+            for attr in ('i_step', 'feature', 'delta', 'e_test', 'e_train'):
+                array = getattr(self, attr)
+                setattr(self, attr, numpy.concatenate([array, numpy.zeros_like(array)], 1))
+        index = self.n[runs]
+        self.i_step[runs, index] = i_step
+        self.feature[runs, index] = feature
+        self.delta[runs, index] = delta
+        self.e_train[runs, index] = e_train
+        self.n[runs] += 1
+
+    def n_undo(self, run, e_test, selective_stopping, n_lags):
+        "Number of steps to undo in ``run`` when the validation error increased"
+        top = self.n[run] - 1
+        stim = self.feature[run, top] // n_lags
+        undo = n_bad = 1
+        j = top - 1
+        while True:
+            undo += 1
+            if self.feature[run, j] // n_lags == stim:
+                if self.e_test[run, j] > self.e_test[run, j - 1]:
+                    # the same predictor caused an error increase
+                    n_bad += 1
+                    if n_bad == selective_stopping:
+                        return undo
+                else:
+                    return 0
+            j -= 1
+            if j < 0 or self.e_test[run, j] > e_test:
+                return 0
+
+
+class _L2Errors:
+    """Training and validation errors of ``l2`` runs, from covariance statistics"""
+    def __init__(self, xx_train, xy_train, yy_train, xx_validate, xy_validate, yy_validate):
+        n_splits, n_features, n_responses = xy_train.shape
+        n_runs = n_splits * n_responses
+        # Runs are (split, response) pairs
+        self.split = numpy.repeat(numpy.arange(n_splits), n_responses)
+        self.xx_train = xx_train
+        self.xx_validate = xx_validate
+        self.g_train = xy_train.transpose(0, 2, 1).reshape((n_runs, n_features)).copy()
+        self.g_validate = xy_validate.transpose(0, 2, 1).reshape((n_runs, n_features)).copy()
+        self.diagonal_train = numpy.einsum('sii->si', xx_train)
+        self.diagonal_validate = numpy.einsum('sii->si', xx_validate)
+        self.e_train = numpy.asarray(yy_train, float).reshape(n_runs).copy()
+        self.e_validate = numpy.asarray(yy_validate, float).reshape(n_runs).copy()
+
+    def options(self, runs, d):
+        "Change in the training error for a step of ``+/- d`` on each feature, and the sign of the better step"
+        gradient = self.g_train[runs]
+        cost = d[:, None] ** 2 * self.diagonal_train[self.split[runs]] - 2 * d[:, None] * numpy.abs(gradient)
+        return cost, numpy.where(gradient < 0, -1., 1.)
+
+    def step(self, runs, feature, d):
+        "Update errors and gradients for adding ``d`` to ``h[runs, feature]``"
+        s = self.split[runs]
+        self.e_train[runs] += d * d * self.diagonal_train[s, feature] - 2 * d * self.g_train[runs, feature]
+        self.e_validate[runs] += d * d * self.diagonal_validate[s, feature] - 2 * d * self.g_validate[runs, feature]
+        self.g_train[runs] -= d[:, None] * self.xx_train[s, feature]
+        self.g_validate[runs] -= d[:, None] * self.xx_validate[s, feature]
+
+
+def _split_masks(splits, n_times):
+    """Training samples and segment boundaries for each split
+
+    Returns
+    -------
+    train : array of bool (n_splits, n_times)
+        Training samples of each split.
+    start, stop : array of int (n_splits, n_times)
+        Boundaries of the (training or validation) segment that contains each
+        sample (predictors are padded outside of each segment).
+    """
+    n_splits = len(splits)
+    train = numpy.zeros((n_splits, n_times), bool)
+    start = numpy.zeros((n_splits, n_times), numpy.int32)
+    stop = numpy.zeros((n_splits, n_times), numpy.int32)
+    for i, (train_segments, validate_segments) in enumerate(splits):
+        for a, b in train_segments:
+            train[i, a: b] = True
+        for a, b in (*train_segments, *validate_segments):
+            start[i, a: b] = a
+            stop[i, a: b] = b
+    return train, start, stop
+
+
+def _lagged(x, pads, times, start, stop, lags):
+    """Lagged predictors at ``times``, padded outside of each sample's segment
+
+    Returns
+    -------
+    design : array (len(times), n_series * n_lags)
+        ``design[i, p * n_lags + j] = x[p, times[i] - lags[j]]``, or
+        ``pads[p]`` if that sample is outside ``[start[i], stop[i])``.
+    """
+    index = times[:, None] - lags
+    valid = (index >= start[:, None]) & (index < stop[:, None])
+    out = x.T[numpy.clip(index, 0, x.shape[1] - 1)]  # (n, n_lags, n_series)
+    out = numpy.where(valid[..., None], out, pads)
+    return out.transpose(0, 2, 1).reshape((len(times), -1))
+
+
+class _L1Errors:
+    """Training and validation errors of ``l1`` runs, from the residuals
+
+    Parameters
+    ----------
+    y : array (n_responses, n_times)
+        Normalized responses.
+    x : array (n_series, n_times)
+        Normalized predictors.
+    pads : array (n_series,)
+        Value of each predictor outside of segments.
+    lags : array of int
+        Lags (in samples).
+    splits : sequence of (train, validate)
+        Training and validation segments of each split.
+    split, response : array of int
+        Split and response of each run (sorted by split).
+
+    Notes
+    -----
+    Only the state of runs that are still active is kept (``rows`` maps
+    runs to rows of the state arrays).
+    """
+    # Maximum number of elements of the gathered design matrix
+    block_size = 2 ** 22
+    # Number of lags that share a bound on the lagged predictors
+    lag_block = 16
+
+    def __init__(self, y, x, pads, lags, splits, split, response):
+        n_series, n_times = x.shape
+        self.n_times = n_times
+        self.pads = pads
+        self.lags = lags
+        self.n_lags = len(lags)
+        self.n_features = n_series * self.n_lags
+        self.splits = splits
+        train, self.start, self.stop = _split_masks(splits, n_times)
+        index = numpy.arange(n_times)
+        self.near_boundary = (index - self.start < max(0, lags[-1])) | (self.stop - index <= max(0, -lags[0]))
+        # Predictors padded at both ends, so that lagged samples can be indexed without clipping
+        self.offset = max(0, lags[-1])
+        self.x = numpy.empty((n_series, n_times + self.offset + max(0, -lags[0])))
+        self.x[:] = pads[:, None]
+        self.x[:, self.offset: self.offset + n_times] = x
+        self._windows = {}  # sliding window views of x, by number of lags
+        # Largest absolute value of the lagged predictors at each sample, for
+        # blocks of lags: a step can change the sign of the residual only
+        # where |r| <= d |x|
+        abs_x = numpy.abs(self.x)
+        self.blocks = []
+        for i_lag in range(0, self.n_lags, self.lag_block):
+            block_lags = lags[i_lag: i_lag + self.lag_block]
+            x_max = scipy.ndimage.maximum_filter1d(abs_x, len(block_lags), 1, origin=-(len(block_lags) // 2))
+            x_max = numpy.maximum(x_max[:, self.offset - block_lags[-1] + index], numpy.abs(pads)[:, None])
+            self.blocks.append((i_lag, block_lags, x_max))
+        # The bound for all features, -1 outside of the training segments of each split
+        self.x_max = numpy.where(train, numpy.max([x_max for _, _, x_max in self.blocks], (0, 1)), -1)
+        # State of the active runs
+        self.rows = numpy.arange(len(split))
+        self.split = split
+        self.r = y[response]
+        self.g_train = numpy.zeros((len(split), self.n_features))
+        n_block = max(1, self.block_size // self.n_features)
+        for i_split in numpy.unique(split):
+            rows = numpy.flatnonzero(split == i_split)
+            times = numpy.flatnonzero(train[i_split])
+            for i in range(0, len(times), n_block):
+                t = times[i: i + n_block]
+                self.g_train[rows] += numpy.sign(self.r[rows][:, t]) @ self._lagged(slice(None), lags, numpy.full(len(t), i_split), t)
+        self.e_train = self._sum_abs(self.r, split, 0)
+        self.e_validate = self._sum_abs(self.r, split, 1)
+        self._options = None
+
+    def _lagged(self, series, lags, split, times):
+        """Lagged predictors at ``times``, padded outside of each sample's segment
+
+        Parameters
+        ----------
+        series : int | slice
+            Predictor(s).
+        lags : array of int
+            Consecutive lags.
+        split, times : array of int
+            Split and time of each sample.
+
+        Returns
+        -------
+        design : array (len(times), n_series * len(lags))
+            Lagged values of the predictors, with features ordered as
+            ``(predictor, lag)``.
+        """
+        if len(lags) not in self._windows:
+            # Windows of consecutive samples, reversed so that columns correspond to lags
+            self._windows[len(lags)] = numpy.lib.stride_tricks.sliding_window_view(self.x, len(lags), -1)[..., ::-1]
+        values = self._windows[len(lags)][series, times + (self.offset - lags[-1])]
+        if values.ndim == 2:
+            values = values[None]
+        # Only samples close to a segment boundary can have padded lags
+        near = numpy.flatnonzero(self.near_boundary[split, times])
+        if len(near):
+            lagged = times[near, None] - lags
+            valid = (lagged >= self.start[split[near], times[near], None]) & (lagged < self.stop[split[near], times[near], None])
+            values[:, near] = numpy.where(valid, values[:, near], numpy.reshape(self.pads[series], (-1, 1, 1)))
+        return values.transpose(1, 0, 2).reshape((len(times), -1))
+
+    def _sum_abs(self, r, split, i_set):
+        "Sum of ``|r|`` over the training (``i_set=0``) or validation (``i_set=1``) segments of each row"
+        out = numpy.zeros(len(r))
+        # Rows are sorted by split
+        bounds = [0, *numpy.flatnonzero(numpy.diff(split)) + 1, len(r)]
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            for start, stop in self.splits[split[a]][i_set]:
+                out[a: b] += numpy.abs(r[a: b, start: stop]).sum(1)
+        return out
+
+    def _update_gradient(self, rows, times, change):
+        "Update the gradients for a change in the sign of the residual at (row, time) pairs (sorted by row)"
+        n_block = max(1, self.block_size // self.n_features)
+        for i in range(0, len(rows), n_block):
+            rows_b = rows[i: i + n_block]
+            values = change[i: i + n_block, None] * self._lagged(slice(None), self.lags, self.split[rows_b], times[i: i + n_block])
+            rows_b, starts = numpy.unique(rows_b, return_index=True)
+            self.g_train[rows_b] += numpy.add.reduceat(values, starts)
+
+    def _select(self, runs):
+        "Drop the state of runs that have stopped"
+        rows = self.rows[runs]
+        if len(rows) < len(self.r):
+            self.split = self.split[rows]
+            self.r = self.r[rows]
+            self.g_train = self.g_train[rows]
+            self.rows[:] = -1
+            self.rows[runs] = numpy.arange(len(runs))
+
+    def options(self, runs, d):
+        "Change in the training error for a step of ``+/- d`` on each feature, and the sign of the better step"
+        self._select(runs)
+        # Where |r| >= |d x|, the step does not change the sign of r, and |r - d x| - |r| = -d x sign(r)
+        cost_add = -d[:, None] * self.g_train
+        cost_sub = -cost_add
+        # Samples where some step can change the sign of r
+        ratio = numpy.abs(self.r)
+        ratio /= d[:, None]
+        candidates = numpy.empty(ratio.shape, bool)
+        bounds = [0, *numpy.flatnonzero(numpy.diff(self.split)) + 1, len(ratio)]
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            numpy.less_equal(ratio[a: b], self.x_max[self.split[a]], out=candidates[a: b])
+        index = numpy.flatnonzero(candidates)
+        run, times = numpy.divmod(index, self.n_times)
+        ratio = ratio.ravel()[index]
+        r = self.r.ravel()[index]
+        # Correct the error at those samples, for each feature
+        features, add, sub = [], [], []
+        for i_series in range(len(self.x)):
+            for i_lag, block_lags, x_max in self.blocks:
+                sample = numpy.flatnonzero(ratio <= x_max[i_series, times])
+                if len(sample) == 0:
+                    continue
+                x = self._lagged(i_series, block_lags, self.split[run[sample]], times[sample])
+                entry = numpy.flatnonzero(numpy.abs(x) > ratio[sample, None])
+                i, lag = numpy.divmod(entry, len(block_lags))
+                sample = sample[i]
+                dx = d[run[sample]] * x.ravel()[entry]
+                r_i = r[sample]
+                abs_r = numpy.abs(r_i)
+                sign = numpy.sign(r_i)
+                features.append(run[sample] * self.n_features + i_series * self.n_lags + i_lag + lag)
+                add.append(numpy.abs(r_i - dx) - abs_r + dx * sign)
+                sub.append(numpy.abs(r_i + dx) - abs_r - dx * sign)
+        if features:
+            features = numpy.concatenate(features)
+            cost_add += numpy.bincount(features, numpy.concatenate(add), cost_add.size).reshape(cost_add.shape)
+            cost_sub += numpy.bincount(features, numpy.concatenate(sub), cost_sub.size).reshape(cost_sub.shape)
+        # As eelbrain, subtract only if adding increases the error more
+        sign = numpy.where(cost_add > cost_sub, -1., 1.)
+        cost = numpy.where(sign > 0, cost_add, cost_sub)
+        # Keep the candidates for the step
+        self._options = d[:, None] * sign, cost, run, times, r
+        return cost, sign
+
+    def step(self, runs, feature, d):
+        "Update residuals, errors and gradients for adding ``d`` to ``h[runs, feature]``"
+        rows = self.rows[runs]
+        options, self._options = self._options, None
+        # Steps chosen by the last call to options() only change the sign of r at its candidate samples
+        chosen = options is not None and numpy.array_equal(d, options[0][rows, feature])
+        if not chosen:
+            r_old = self.r[rows]
+        for row, i_series, lag, d_i in zip(rows, feature // self.n_lags, self.lags[feature % self.n_lags], d):
+            x = self.x[i_series, self.offset - lag: self.offset - lag + self.n_times]
+            r = self.r[row]
+            r -= d_i * x
+            # Samples whose lagged predictor is outside the segment are padded
+            for start, stop in (*self.splits[self.split[row]][0], *self.splits[self.split[row]][1]):
+                edge = slice(start, min(start + lag, stop)) if lag > 0 else slice(max(stop + lag, start), stop)
+                r[edge] += d_i * (x[edge] - self.pads[i_series])
+        if chosen:
+            _, cost, run, times, r_old = options
+            stepped = numpy.zeros(len(self.r), bool)
+            stepped[rows] = True
+            keep = numpy.flatnonzero(stepped[run])
+            run, times, sign_old = run[keep], times[keep], numpy.sign(r_old[keep])
+            sign = numpy.sign(self.r[run, times])
+            changed = numpy.flatnonzero(sign != sign_old)
+            self._update_gradient(run[changed], times[changed], (sign - sign_old)[changed])
+            self.e_train[runs] += cost[rows, feature]
+        else:
+            r = self.r[rows]
+            sign_old = numpy.sign(r_old)
+            sign = numpy.sign(r)
+            i, times = numpy.nonzero((sign != sign_old) & (self.x_max[self.split[rows]] >= 0))
+            self._update_gradient(rows[i], times, (sign - sign_old)[i, times])
+            self.e_train[runs] = self._sum_abs(r, self.split[rows], 0)
+        self.e_validate[runs] = self._sum_abs(self.r if len(rows) == len(self.r) else self.r[rows], self.split[rows], 1)
+
+
+def _boost(errors, n_runs, n_features, n_lags, delta, mindelta, selective_stopping, max_iterations):
+    """Coordinate descent for all runs of ``errors`` (:class:`_L1Errors` or :class:`_L2Errors`)
+
+    Returns
+    -------
+    h : array (n_runs, n_features)
+        TRF of each run.
+    failed : array of bool (n_runs,)
+        Runs in which the validation error never decreased.
+    n_iterations : int
+        Number of iterations of the longest run.
+    """
+    n_series = n_features // n_lags
+    mindelta = delta if mindelta is None else mindelta
+    h = numpy.zeros((n_runs, n_features))
+    deltas = numpy.full(n_runs, float(delta))
+    active = numpy.ones((n_runs, n_series), bool)
+    best_e = numpy.full(n_runs, numpy.inf)
+    best_step = numpy.full(n_runs, -1)
+    running = numpy.ones(n_runs, bool)
+    history = _History(errors.e_train)
+
+    def step(runs, feature, d):
+        "Add ``d`` to ``h[runs, feature]``"
+        h[runs, feature] += d
+        errors.step(runs, feature, d)
+
+    for i_step in range(max_iterations):
+        runs = numpy.flatnonzero(running)
+        if len(runs) == 0:
+            break
+        # Evaluate the current h
+        top = history.n[runs] - 1
+        e_test = errors.e_validate[runs]
+        history.e_test[runs, top] = e_test
+        improved = e_test < best_e[runs]
+        best_e[runs[improved]] = e_test[improved]
+        best_step[runs[improved]] = history.i_step[runs[improved], top[improved]]
+        if i_step >= 2:
+            worse = ~improved & (e_test > history.e_test[runs, top - 1])
+            if selective_stopping:
+                bad = runs[worse]
+                if selective_stopping > 1:
+                    undo = numpy.array([history.n_undo(run, e, selective_stopping, n_lags) for run, e in zip(bad, e_test[worse])], int)
+                else:
+                    undo = numpy.ones(len(bad), int)
+                bad, undo = bad[undo > 0], undo[undo > 0]
+                # Disable the predictor of the last step
+                active[bad, history.feature[bad, history.n[bad] - 1] // n_lags] = False
+                done = ~active[bad].any(1)
+                running[bad[done]] = False
+                bad, undo = bad[~done], undo[~done]
+                for i in range(undo.max(initial=0)):
+                    revert = bad[undo > i]
+                    top_i = history.n[revert] - 1
+                    step(revert, history.feature[revert, top_i], -history.delta[revert, top_i])
+                    history.n[revert] -= 1
+            else:
+                # Stop after more than 10 iterations when the validation error increased twice
+                stop = worse & (i_step > 10) & (e_test > history.e_test[runs, top - 2])
+                running[runs[stop]] = False
+            runs = runs[running[runs]]
+            if len(runs) == 0:
+                break
+        # Best step for each run: change in training error for +/- delta
+        cost, sign = errors.options(runs, deltas[runs])
+        cost[~numpy.repeat(active[runs], n_lags, 1)] = numpy.inf
+        feature = cost.argmin(1)
+        index = numpy.arange(len(runs))
+        e_new = errors.e_train[runs] + cost[index, feature]
+        d = sign[index, feature] * deltas[runs]
+        previous = history.n[runs] - 1
+        history.push(runs, i_step, feature, d, e_new)
+        top = previous + 1
+        # If no improvement can be found, reduce delta
+        no_improvement = e_new > history.e_train[runs, previous]
+        if no_improvement.any():
+            reduce = runs[no_improvement]
+            deltas[reduce] *= 0.5
+            history.delta[reduce, top[no_improvement]] = 0
+            history.feature[reduce, top[no_improvement]] = -1
+            running[reduce[deltas[reduce] < mindelta]] = False
+        # Stop if moving in circles
+        circles = ~no_improvement & (d == -history.delta[runs, previous]) & (feature == history.feature[runs, previous])
+        if circles.any():
+            history.delta[runs[circles], top[circles]] = 0
+            running[runs[circles]] = False
+        apply = ~(no_improvement | circles)
+        step(runs[apply], feature[apply], d[apply])
+    else:
+        raise RuntimeError("Boosting: maximum number of iterations exceeded")
+
+    # Revert the steps after the best iteration
+    failed = best_step == -1
+    after = (history.i_step > best_step[:, None]) & (numpy.arange(history.i_step.shape[1]) < history.n[:, None]) & ~failed[:, None]
+    run, index = numpy.nonzero(after)
+    numpy.add.at(h, (run, history.feature[run, index]), -history.delta[run, index])
+    return h, failed, i_step
+
+
+def boosting_runs(xx_train, xy_train, yy_train, xx_validate, xy_validate, yy_validate, n_lags, delta=0.005, mindelta=None, selective_stopping=0, max_iterations=999999):
+    """Boosting with ``l2`` error for several responses and splits in one batch
+
+    Parameters
+    ----------
+    xx_train : array (n_splits, n_features, n_features)
+        ``X'X`` of the training data of each split, with features ordered as
+        ``(predictor, lag)``.
+    xy_train : array (n_splits, n_features, n_responses)
+        ``X'y`` of the training data.
+    yy_train : array (n_splits, n_responses)
+        ``y'y`` of the training data.
+    xx_validate, xy_validate, yy_validate : array
+        Statistics of the validation data.
+    n_lags : int
+        Number of lags of each predictor.
+    delta : scalar
+        Step size.
+    mindelta : scalar
+        Smallest step size (default ``delta``).
+    selective_stopping : int
+        Selective stopping (see :func:`eelbrain.boosting`).
+    max_iterations : int
+        Maximum number of iterations.
+
+    Returns
+    -------
+    h : array (n_splits, n_responses, n_features)
+        TRF for each split and response.
+    failed : array of bool (n_splits, n_responses)
+        Runs in which the validation error never decreased.
+    n_iterations : int
+        Number of iterations of the longest run.
+    """
+    n_splits, n_features, n_responses = xy_train.shape
+    errors = _L2Errors(xx_train, xy_train, yy_train, xx_validate, xy_validate, yy_validate)
+    h, failed, n_iterations = _boost(errors, n_splits * n_responses, n_features, n_lags, delta, mindelta, selective_stopping, max_iterations)
+    return h.reshape((n_splits, n_responses, n_features)), failed.reshape((n_splits, n_responses)), n_iterations
+
+
+def boosting_runs_l1(y, x, pads, splits, i_start, n_lags, delta=0.005, mindelta=None, selective_stopping=0, max_iterations=999999, max_elements=2 ** 23):
+    """Boosting with ``l1`` error for several responses and splits in batches
+
+    Parameters
+    ----------
+    y : array (n_responses, n_times)
+        Normalized responses.
+    x : array (n_series, n_times)
+        Normalized predictors.
+    pads : array (n_series,)
+        Value of each predictor outside of segments.
+    splits : sequence of (train, validate)
+        Training and validation segments (``(start, stop)`` sample
+        indexes) of each split.
+    i_start : int
+        First lag (in samples).
+    n_lags : int
+        Number of lags of each predictor.
+    ...
+        As for :func:`boosting_runs`.
+    max_elements : int
+        Runs are processed in batches with at most this many residual
+        samples (limits memory use).
+
+    Returns
+    -------
+    h : array (n_splits, n_responses, n_features)
+        TRF for each split and response.
+    failed : array of bool (n_splits, n_responses)
+        Runs in which the validation error never decreased.
+    n_iterations : int
+        Number of iterations of the longest run.
+    """
+    n_responses, n_times = y.shape
+    n_features = len(x) * n_lags
+    n_runs = len(splits) * n_responses
+    lags = i_start + numpy.arange(n_lags)
+    h = numpy.empty((n_runs, n_features))
+    failed = numpy.empty(n_runs, bool)
+    n_iterations = 0
+    batch_size = max(1, max_elements // n_times)
+    for start in range(0, n_runs, batch_size):
+        runs = numpy.arange(start, min(start + batch_size, n_runs))
+        errors = _L1Errors(y, x, pads, lags, splits, runs // n_responses, runs % n_responses)
+        h[runs], failed[runs], n = _boost(errors, len(runs), n_features, n_lags, delta, mindelta, selective_stopping, max_iterations)
+        n_iterations = max(n_iterations, n)
+    return h.reshape((len(splits), n_responses, n_features)), failed.reshape((len(splits), n_responses)), n_iterations
+
+
+def _merge(segments):
+    "Merge adjacent segments (all partition boundaries in continuous data are soft)"
+    out = [list(segments[0])]
+    for start, stop in segments[1:]:
+        if out[-1][1] >= start:
+            out[-1][1] = max(out[-1][1], stop)
+        else:
+            out.append([start, stop])
+    return [tuple(segment) for segment in out]
+
+
+def _splits(n_times, partitions, test):
+    "Cross-validation splits of continuous data, as in :func:`eelbrain.boosting`"
+    if partitions is None:
+        partitions = 3 + test if test else 10
+    points = numpy.round(numpy.linspace(0, n_times, partitions + 1)).astype(int)
+    segments = numpy.stack([points[:-1], points[1:]], 1)
+    splits = []
+    for i_test in (range(partitions) if test else [None]):
+        for i_validate in range(partitions):
+            if i_test == i_validate:
+                continue
+            train = [i for i in range(partitions) if i not in (i_test, i_validate)]
+            test_segments = None if i_test is None else _merge(segments[[i_test]])
+            splits.append((i_test, _merge(segments[train]), _merge(segments[[i_validate]]), test_segments))
+    return splits
+
+
+class _Statistics:
+    """Lagged covariance statistics for segments of normalized data
+
+    Outside of each segment, normalized predictors are padded with
+    ``pads``, the normalized value of 0 (eelbrain's ``x_pads``). The padded
+    predictor is the zero-padded ``x - pads`` plus the constant ``pads``, so
+    that the statistics are those of ``x - pads`` (from
+    :class:`lagged_covariance.LaggedCovariance`) with a correction for the
+    constant.
+
+    The statistics of all ``models`` (each a list of indices into
+    ``groups``, the ``(start, stop)`` rows of each predictor) are computed from
+    one :class:`~lagged_covariance.LaggedCovariance` for each segment, so that
+    the statistics of predictors that are shared by several models are
+    computed only once.
+
+    For impulse predictors, ``x - pads`` is zero except at the impulses, and
+    the statistics are computed from the impulses (``impulses``, ``{row:
+    (samples, values)}`` of ``x - pads``) by gathering the other time series
+    at the impulse times for each lag.
+    """
+    def __init__(self, y, x, pads, i_start, n_lags, tstep, groups, models, impulses=None):
+        self.y = y
+        self.x = x - pads[:, None]
+        self.pads = numpy.repeat(pads, n_lags)
+        self.i_start = i_start
+        self.n_lags = n_lags
+        self.tstep = tstep
+        self.groups = groups
+        self.models = models
+        self.impulses = {} if impulses is None else impulses
+        # Feature indices of each model, ordered as (predictor, lag)
+        self.features = []
+        for model in models:
+            rows = numpy.concatenate([numpy.arange(*groups[i]) for i in model])
+            self.features.append((rows[:, None] * n_lags + numpy.arange(n_lags)).ravel())
+        self._segments = {}
+
+    def segment(self, start, stop):
+        "``(xx, xy, yy)`` of each model for one segment"
+        key = (start, stop)
+        if key not in self._segments:
+            n = stop - start
+            time = eelbrain.UTS(0, self.tstep, n)
+            y = eelbrain.NDVar(self.y[:, start: stop], (eelbrain.Case, time))
+            covariance = LaggedCovariance([y], self.i_start * self.tstep, (self.i_start + self.n_lags) * self.tstep, center=False)
+            for i, (row, row_stop) in enumerate(self.groups):
+                if row in self.impulses:
+                    samples, values = self.impulses[row]
+                    index = (samples >= start) & (samples < stop)
+                    x = ImpulsePredictor(time, samples[index] - start, values[index])
+                else:
+                    x = eelbrain.NDVar(self.x[row: row_stop, start: stop], (eelbrain.Case, time))
+                covariance.add_predictor(f'x{i}', [x])
+            # Sums of the lagged predictors over the segment
+            lags = self.i_start + numpy.arange(self.n_lags)
+            window_start = numpy.clip(-lags, 0, n)
+            window_stop = numpy.clip(n - lags, window_start, n)
+            cumsum = numpy.pad(self.x[:, start: stop].cumsum(1), ((0, 0), (1, 0)))
+            sums = (cumsum[:, window_stop] - cumsum[:, window_start]).ravel()
+            y_sum = self.y[:, start: stop].sum(1)
+            yy = (self.y[:, start: stop] ** 2).sum(1)
+            statistics = []
+            for model, features in zip(self.models, self.features):
+                # Blocks of shared predictors are memoized by the covariance
+                names = [f'x{i}' for i in model]
+                xx = covariance.xx(names)
+                xy = covariance.xy(names)
+                pads = self.pads[features]
+                xx += numpy.outer(sums[features], pads) + numpy.outer(pads, sums[features]) + n * numpy.outer(pads, pads)
+                xy += pads[:, None] * y_sum
+                statistics.append((xx, xy, yy))
+            self._segments[key] = statistics
+        return self._segments[key]
+
+    def __call__(self, segments):
+        "``(xx, xy, yy)`` of each model, summed over ``segments``"
+        statistics = [self.segment(*segment) for segment in segments]
+        return [[sum(items) for items in zip(*model)] for model in zip(*statistics)]
+
+
+def _check_data(y, xs):
+    "Check that the data can be fit by :func:`boosting`"
+    if y.has_case:
+        raise ValueError(f"y={y!r}: y with case dimension (trials) is not supported; concatenate trials, e.g. with eelbrain.concatenate()")
+    elif y.ndim > 2:
+        raise ValueError(f"y={y!r}: y can have at most one dimension other than time")
+    for x in xs:
+        if is_impulse_predictor(x):
+            if x.time != y.time:
+                raise ValueError(f"x={x!r}: time dimension differs from y")
+        elif x.has_case:
+            raise ValueError(f"x={x!r}: x with case dimension is not supported")
+        elif x.ndim > 2:
+            raise ValueError(f"x={x!r}: x can have at most one dimension other than time")
+        elif x.time != y.time:
+            raise ValueError(f"x={x!r}: time dimension differs from y")
+
+
+def boosting(y, x, tstart, tstop, delta=0.005, mindelta=None, error='l2', basis=0, basis_window='hamming', partitions=None, test=0, selective_stopping=0, partition_results=False):
+    """Estimate TRFs for all responses with :func:`boosting_runs` or :func:`boosting_runs_l1`
+
+    Parameters
+    ----------
+    y : NDVar
+        Continuous response (time and one optional other dimension, such as
+        sensor).
+    x : NDVar | ImpulsePredictor | sequence of NDVar | ImpulsePredictor
+        Predictor or predictors (time and one optional other dimension, such
+        as frequency). For sparse predictors like word onsets,
+        :class:`impulses.ImpulsePredictor` avoids the FFTs of the dense time
+        series (with the ``l2`` error and without ``basis``).
+    tstart : scalar
+        TRF start (in seconds).
+    tstop : scalar
+        TRF stop (in seconds).
+    ...
+        Other parameters as for :func:`eelbrain.boosting`.
+
+    Returns
+    -------
+    result : BatchBoostingResult
+        TRFs with the same layout as :func:`eelbrain.boosting` results.
+    """
+    single_x = isinstance(x, eelbrain.NDVar) or is_impulse_predictor(x)
+    xs = [x] if single_x else list(x)
+    return _boosting(y, xs, [range(len(xs))], single_x, tstart, tstop, delta, mindelta, error, basis, basis_window, partitions, test, selective_stopping, partition_results)[0]
+
+
+def boosting_models(y, x, models, tstart, tstop, delta=0.005, mindelta=None, error='l2', basis=0, basis_window='hamming', partitions=None, test=0, selective_stopping=0, partition_results=False):
+    """Estimate several models that share predictors in one batch
+
+    Each model is estimated as with :func:`boosting`. With the ``l2`` error,
+    the covariance statistics of all models are computed together, so that
+    the statistics of predictors that are shared by several models (e.g., a
+    full model and null models in which one term is shuffled) are computed
+    only once, and models with the same number of features are boosted in a
+    single batch.
+
+    Parameters
+    ----------
+    y : NDVar
+        Continuous response (time and one optional other dimension, such as
+        sensor).
+    x : dict {str: NDVar | ImpulsePredictor}
+        All predictors, by name.
+    models : dict {str: sequence of str}
+        Models to estimate, each a list of predictor names.
+    tstart : scalar
+        TRF start (in seconds).
+    tstop : scalar
+        TRF stop (in seconds).
+    ...
+        Other parameters as for :func:`eelbrain.boosting`.
+
+    Returns
+    -------
+    results : dict {str: BatchBoostingResult}
+        Result for each model.
+    """
+    names = list(x)
+    for model, predictors in models.items():
+        missing = [name for name in predictors if name not in names]
+        if missing:
+            raise ValueError(f"{model=}: predictors {missing} not in x")
+    results = _boosting(y, list(x.values()), [[names.index(name) for name in predictors] for predictors in models.values()], False, tstart, tstop, delta, mindelta, error, basis, basis_window, partitions, test, selective_stopping, partition_results)
+    return dict(zip(models, results))
+
+
+def _boosting(y, xs, models, single_x, tstart, tstop, delta, mindelta, error, basis, basis_window, partitions, test, selective_stopping, partition_results):
+    "Estimate ``models`` (each a list of indices into ``xs``) for :func:`boosting` and :func:`boosting_models`"
+    if error not in ('l1', 'l2'):
+        raise ValueError(f"error={error!r}")
+    elif partition_results and not test:
+        raise ValueError(f"partition_results={partition_results!r} without test partition")
+    _check_data(y, xs)
+    time = y.time
+    tstep = time.tstep
+    y_dims = [dim for dim in y.dims if dim.name != 'time']
+    y_data = y.get_data((*[dim.name for dim in y_dims], 'time')).reshape((-1, len(time)))
+    x_dims = [[dim for dim in x_.dims if dim.name != 'time'] for x_ in xs]
+    x_data = numpy.concatenate([(x_.ndvar() if is_impulse_predictor(x_) else x_).get_data((*[dim.name for dim in dims], 'time')).reshape((-1, len(time))) for x_, dims in zip(xs, x_dims)])
+    if basis:
+        n = int(round(basis / tstep))
+        window = scipy.signal.get_window(basis_window, n, False)
+        window /= window.sum()
+        x_data = numpy.stack([scipy.signal.convolve(x_i, window, 'same') for x_i in x_data])
+    # Normalize (as eelbrain, by the norm of the error function)
+    y_mean = y_data.mean(1)
+    y_data = y_data - y_mean[:, None]
+    x_mean = x_data.mean(1)
+    x_data = x_data - x_mean[:, None]
+    if error == 'l1':
+        y_scale = numpy.abs(y_data).mean(1)
+        x_scale = numpy.abs(x_data).mean(1)
+    else:
+        y_scale = (y_data ** 2).mean(1) ** 0.5
+        x_scale = (x_data ** 2).mean(1) ** 0.5
+    y_data /= y_scale[:, None]
+    x_data /= x_scale[:, None]
+    x_pads = -x_mean / x_scale
+    # Rows of x_data for each predictor and model
+    rows = numpy.cumsum([0, *[numpy.prod([len(dim) for dim in dims], dtype=int) for dims in x_dims]])
+    groups = list(zip(rows[:-1], rows[1:]))
+    model_rows = [numpy.concatenate([numpy.arange(*groups[i]) for i in model]) for model in models]
+    # Impulse predictors for the covariance statistics, as sparse x - x_pads
+    impulses = {}
+    if error == 'l2' and not basis:
+        for x_, row in zip(xs, rows):
+            if is_impulse_predictor(x_):
+                impulses[row] = (x_.samples, x_.values / x_scale[row])
+    # TRF extent (in samples)
+    i_start = int(round(tstart / tstep))
+    n_lags = int(ceil(tstop / tstep)) - i_start
+    splits = _splits(len(time), partitions, test)
+    t0 = _time.time()
+    fits = [None] * len(models)
+    if error == 'l1':
+        for i, rows_i in enumerate(model_rows):
+            fits[i] = boosting_runs_l1(y_data, x_data[rows_i], x_pads[rows_i], [(train, validate) for _, train, validate, _ in splits], i_start, n_lags, delta, mindelta, selective_stopping)
+    else:
+        statistics = _Statistics(y_data, x_data, x_pads, i_start, n_lags, tstep, groups, models, impulses)
+        train = [statistics(train) for _, train, _, _ in splits]
+        validate = [statistics(validate) for _, _, validate, _ in splits]
+        # Models with the same number of features are boosted in one batch of (model, split) runs
+        batches = {}
+        for i, rows_i in enumerate(model_rows):
+            batches.setdefault(len(rows_i), []).append(i)
+        for batch in batches.values():
+            items = [[train[s][i][k] for i in batch for s in range(len(splits))] for k in range(3)]
+            items += [[validate[s][i][k] for i in batch for s in range(len(splits))] for k in range(3)]
+            hs, failed, n_iterations = boosting_runs(*[numpy.stack(item) for item in items], n_lags, delta, mindelta, selective_stopping)
+            for i, hs_i, failed_i in zip(batch, numpy.split(hs, len(batch)), numpy.split(failed, len(batch))):
+                fits[i] = hs_i, failed_i, n_iterations
+    t_run = _time.time() - t0
+
+    def result(hs, failed, n_iterations, xs, x_dims, x_data, x_pads, x_scale):
+        "Cross-validated result of one model"
+        # Average across splits with the same test partition, ignoring failed runs
+        i_tests = numpy.array([-1 if i_test is None else i_test for i_test, _, _, _ in splits])
+        hs[failed] = numpy.nan
+        h_tests = []
+        for i_test in numpy.unique(i_tests):
+            with warnings.catch_warnings():
+                warnings.filterwarnings('ignore', 'Mean of empty slice', RuntimeWarning)
+                h_i = numpy.nanmean(hs[i_tests == i_test], 0)
+            h_i[numpy.isnan(h_i)] = 0
+            h_tests.append(h_i)
+        h = numpy.mean(h_tests, 0)
+        # Predict the test partitions
+        if test:
+            lags = i_start + numpy.arange(n_lags)
+            y_pred = numpy.empty_like(y_data)
+            test_times = []
+            for i_test, h_i in enumerate(h_tests):
+                test_segments = splits[list(i_tests).index(i_test)][3]
+                times = numpy.concatenate([numpy.arange(a, b) for a, b in test_segments])
+                starts = numpy.concatenate([numpy.full(b - a, a) for a, b in test_segments])
+                stops = numpy.concatenate([numpy.full(b - a, b) for a, b in test_segments])
+                y_pred[:, times] = (_lagged(x_data, x_pads, times, starts, stops, lags) @ h_i.T).T
+                test_times.append(times)
+
+        def fit_metrics(times):
+            "``(proportion_explained, r)`` for the samples ``times``"
+            residual = y_data[:, times] - y_pred[:, times]
+            if error == 'l1':
+                residual = numpy.abs(residual).sum(1)
+            else:
+                residual = (residual ** 2).sum(1)
+            # The variability of normalized data is the number of samples
+            explained = 1 - residual / len(time)
+            r = numpy.array([numpy.corrcoef(y_i, y_pred_i)[0, 1] for y_i, y_pred_i in zip(y_data[:, times], y_pred[:, times])])
+            if y_dims:
+                return eelbrain.NDVar(explained, y_dims, 'proportion_explained'), eelbrain.NDVar(r, y_dims, 'r')
+            return explained[0], r[0]
+
+        # Package
+        h_time = eelbrain.UTS(i_start * tstep, tstep, n_lags)
+        scale = y_scale[:, None] / numpy.repeat(x_scale, n_lags)
+
+        def package(h):
+            "Normalized and scaled TRFs as NDVars"
+            hs_out, hs_scaled = [], []
+            start = 0
+            for x_, dims in zip(xs, x_dims):
+                ndvar_dims = (*y_dims, *dims, h_time)
+                shape = [len(dim) for dim in ndvar_dims]
+                stop = start + numpy.prod([len(dim) for dim in dims], dtype=int) * n_lags
+                hs_out.append(eelbrain.NDVar(h[:, start: stop].reshape(shape), ndvar_dims, x_.name))
+                hs_scaled.append(eelbrain.NDVar((h * scale)[:, start: stop].reshape(shape), ndvar_dims, x_.name))
+                start = stop
+            if basis:
+                hs_out = [h_.smooth('time', basis, basis_window, 'full') for h_ in hs_out]
+                hs_scaled = [h_.smooth('time', basis, basis_window, 'full') for h_ in hs_scaled]
+            if single_x:
+                return hs_out[0], hs_scaled[0]
+            return tuple(hs_out), tuple(hs_scaled)
+
+        x_names = xs[0].name if single_x else tuple(x_.name for x_ in xs)
+        if test:
+            proportion_explained, r = fit_metrics(numpy.concatenate(test_times))
+        else:
+            proportion_explained = r = None
+        if partition_results:
+            results = []
+            for i_test, (h_i, times) in enumerate(zip(h_tests, test_times)):
+                result_i = BatchBoostingResult(*package(h_i), failed[i_tests == i_test].all(0), *fit_metrics(times), x_names, error, tstart, tstop, n_iterations, 0, i_test)
+                results.append(result_i)
+        else:
+            results = None
+        return BatchBoostingResult(*package(h), failed.all(0), proportion_explained, r, x_names, error, tstart, tstop, n_iterations, t_run, partition_results=results)
+
+
+    return [result(*fit, [xs[i] for i in model], [x_dims[i] for i in model], x_data[rows_i], x_pads[rows_i], x_scale[rows_i]) for fit, model, rows_i in zip(fits, models, model_rows)]
+
+def _simulate(n_times=12000, n_sensors=16, seed=0):
+    rng = numpy.random.default_rng(seed)
+    time = eelbrain.UTS(0, 0.010, n_times)
+    sensor = eelbrain.Sensor(rng.normal(size=(n_sensors, 3)))
+    # Slow envelope-like predictor and sparse impulses
+    envelope = numpy.abs(scipy.signal.lfilter([1], [1, -0.9], rng.normal(size=n_times)))
+    impulses = (rng.uniform(size=n_times) < 0.02) * rng.uniform(0.5, 1.5, n_times)
+    trf = rng.normal(size=(n_sensors, 2, 40)) * numpy.hanning(40)
+    y = numpy.stack([numpy.convolve(envelope, h[0])[:n_times] + numpy.convolve(impulses, h[1])[:n_times] for h in trf])
+    y += 3 * rng.normal(size=y.shape) + 1
+    xs = [eelbrain.NDVar(envelope, (time,), 'envelope'), eelbrain.NDVar(impulses, (time,), 'impulses')]
+    return eelbrain.NDVar(y, (sensor, time), 'eeg'), xs
+
+
+def _simulate_words(n_times=6000, n_bands=8, rate=2.5, seed=0):
+    # Gammatone-like bands and word onset impulses, as in estimate_word_acoustics.py
+    rng = numpy.random.default_rng(seed)
+    time = eelbrain.UTS(0, 0.010, n_times)
+    frequency = eelbrain.Scalar('frequency', numpy.arange(n_bands))
+    word = numpy.zeros(n_times)
+    word[rng.choice(n_times, int(rate * n_times * time.tstep), replace=False)] = 1
+    envelope = numpy.abs(scipy.signal.lfilter([1], [1, -0.95], rng.normal(size=(n_bands, n_times)), axis=1))
+    trf = rng.normal(size=(n_bands, 110)) * numpy.hanning(110)
+    y = envelope + numpy.stack([numpy.convolve(word, h)[:n_times] for h in trf])
+    return eelbrain.NDVar(y, (frequency, time), 'gammatone'), ImpulsePredictor(time, numpy.flatnonzero(word), word[word != 0], 'word')
+
+
+def _check_result(res_batch, res_eelbrain):
+    for h_batch, h_eelbrain in zip(res_batch.h_scaled, res_eelbrain.h_scaled):
+        assert numpy.allclose(h_batch.x, h_eelbrain.x, rtol=1e-6, atol=1e-9)
+    if res_batch.proportion_explained is not None:
+        assert numpy.allclose(res_batch.proportion_explained.x, res_eelbrain.proportion_explained.x)
+        assert numpy.allclose(res_batch.r.x, res_eelbrain.r.x)
+    if res_batch.partition_results is not None:
+        ds_batch = res_batch.partition_result_data()
+        ds_eelbrain = res_eelbrain.partition_result_data()
+        for key in ('r', 'det', *res_batch.x):
+            assert numpy.allclose(ds_batch[key].x, ds_eelbrain[key].x)
+
+
+def benchmark():
+    """Compare :func:`boosting` with :func:`eelbrain.boosting`, which fits one sensor after another, and :func:`boosting_models` with separate fits"""
+    y, xs = _simulate()
+    cases = [
+        dict(error='l2', partitions=5, test=1, partition_results=True),
+        dict(error='l2', partitions=4, selective_stopping=1),
+        dict(error='l2', partitions=4, selective_stopping=2, basis=0.05),
+        dict(error='l1', partitions=5, test=1, partition_results=True),
+        dict(error='l1', partitions=4, selective_stopping=1, basis=0.05),
+    ]
+    y_words, word = _simulate_words()
+    # Word-only acoustics model of estimate_word_acoustics.py, with the dense
+    # word onsets for eelbrain and the batch fit, and with the impulses
+    cases_words = [dict(error='l2', partitions=15, test=True, partition_results=True)]
+    for y, xs, xs_batch, tstart, tstop, cases in [(y, xs, [xs], -0.100, 0.300, cases), (y_words, [word.ndvar()], [[word.ndvar()], [word]], -0.100, 1.001, cases_words)]:
+        print(f"{len(y.x)} responses, {len(y.time)} samples, {len(xs)} predictors:")
+        for kwargs in cases:
+            desc = ', '.join(f'{key}={value}' for key, value in kwargs.items())
+            t0 = _time.perf_counter()
+            res_eelbrain = eelbrain.boosting(y, xs, tstart, tstop, **kwargs)
+            t_eelbrain = _time.perf_counter() - t0
+            for xs_ in xs_batch:
+                t0 = _time.perf_counter()
+                res_batch = boosting(y, xs_, tstart, tstop, **kwargs)
+                t_batch = _time.perf_counter() - t0
+                kind = 'impulses' if is_impulse_predictor(xs_[0]) else 'batch'
+                print(f"  {desc}: {kind} {t_batch:.2f} s, eelbrain {t_eelbrain:.2f} s")
+                _check_result(res_batch, res_eelbrain)
+    # Full model and null models with a shifted term (model_comparison.py), in one batch and separately
+    y, xs = _simulate()
+    x = {x_.name: x_ for x_ in xs}
+    models = {'full': list(x)}
+    for i in range(1, 4):
+        name = f'impulses_shift{i}'
+        x[name] = eelbrain.NDVar(numpy.roll(x['impulses'].x, i * len(y.time) // 4), x['impulses'].dims, name)
+        models[name] = ['envelope', name]
+    kwargs = dict(error='l2', basis=0.05, partitions=5, test=1, selective_stopping=1)
+    t0 = _time.perf_counter()
+    res_models = boosting_models(y, x, models, -0.100, 0.300, **kwargs)
+    t1 = _time.perf_counter()
+    res_separate = {model: boosting(y, [x[name] for name in names], -0.100, 0.300, **kwargs) for model, names in models.items()}
+    t2 = _time.perf_counter()
+    print(f"{len(models)} models: boosting_models {t1 - t0:.2f} s, separate {t2 - t1:.2f} s")
+    for model in models:
+        _check_result(res_models[model], res_separate[model])
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,190 @@
+"""Compare response patterns (e.g., ERPs and TRFs) across subjects
+
+The patterns of all subjects and types are placed in one preallocated
+(case, sensor, time) array on a common time grid, and normalized in place,
+instead of combining NDVars and normalizing them with chained NDVar operations
+that each allocate a new array.
+
+Run this module as a script for a benchmark with simulated data.
+"""
+import time as _time
+
+import eelbrain
+import numpy
+from scipy.interpolate import interp1d
+from scipy.stats import t as t_distribution
+
+
+def common_time(times):
+    """Time axis covered by all of ``times``, at the lowest of their sampling rates"""
+    tstep = max(time.tstep for time in times)
+    tmin = max(time.tmin for time in times)
+    tstop = min(time.tstop for time in times)
+    return eelbrain.UTS(tmin, tstep, int(round((tstop - tmin) / tstep)))
+
+
+def resample_to(data, source, target):
+    """Resample ``data`` with time axis ``source`` (last axis) to the time axis ``target``"""
+    if source.tstep == target.tstep:
+        start = int(round((target.tmin - source.tmin) / source.tstep))
+        return data[..., start: start + target.nsamples]
+    return interp1d(source.times, data, axis=-1, assume_sorted=True)(target.times)
+
+
+def normalize_in_place(data, axis=-1):
+    """Subtract the mean and divide by the standard deviation along ``axis``, in place
+
+    Slices with zero variance are only centered (to avoid division by 0).
+    """
+    data -= data.mean(axis, keepdims=True)
+    scale = data.std(axis, keepdims=True)
+    scale[scale == 0] = 1
+    data /= scale
+    return data
+
+
+def comparison_dataset(patterns, normalize=True):
+    """Merge response patterns from several types on a common time grid
+
+    Parameters
+    ----------
+    patterns : dict {str: dict {str: NDVar}}
+        For each type (e.g., ``'ERP'`` and ``'TRF'``), a ``{subject: pattern}``
+        dictionary, with each pattern a (sensor, time) NDVar. Only subjects
+        present for all types are included.
+    normalize : bool
+        Add a ``norm_pattern`` column in which each sensor's time course is
+        normalized to mean 0 and standard deviation 1.
+
+    Returns
+    -------
+    data : Dataset
+        Dataset with ``subject``, ``type``, ``pattern`` and ``norm_pattern``.
+    """
+    types = list(patterns)
+    subjects = [subject for subject in patterns[types[0]] if all(subject in patterns[type_] for type_ in types)]
+    all_patterns = [patterns[type_][subject] for type_ in types for subject in subjects]
+    time = common_time([x.time for x in all_patterns])
+    sensor = all_patterns[0].sensor
+    for x in all_patterns[1:]:
+        if x.sensor != sensor:
+            sensor = sensor.intersect(x.sensor)
+    sensor_names = list(sensor.names)
+    # Fill preallocated arrays, normalizing each pattern as it is added
+    x = numpy.empty((len(all_patterns), len(sensor), len(time)))
+    norm = numpy.empty_like(x) if normalize else None
+    for i, pattern in enumerate(all_patterns):
+        if pattern.sensor != sensor:
+            pattern = pattern.sub(sensor=sensor_names)
+        x[i] = resample_to(pattern.get_data(('sensor', 'time')), pattern.time, time)
+        if normalize:
+            norm[i] = x[i]
+            normalize_in_place(norm[i])
+    dims = ('case', sensor, time)
+    data = eelbrain.Dataset({
+        'subject': eelbrain.Factor(subjects * len(types), random=True),
+        'type': eelbrain.Factor(types, repeat=len(subjects)),
+        'pattern': eelbrain.NDVar(x, dims, 'pattern'),
+    })
+    if normalize:
+        data['norm_pattern'] = eelbrain.NDVar(norm, dims, 'norm_pattern')
+    return data
+
+
+def time_slice(time, tstart, tstop):
+    """Slice of the samples of ``time`` in ``[tstart, tstop)`` (as for ``NDVar.sub(time=(tstart, tstop))``)"""
+    start = int(numpy.ceil((tstart - time.tmin) / time.tstep - 1e-6))
+    stop = int(numpy.ceil((tstop - time.tmin) / time.tstep - 1e-6))
+    return slice(max(start, 0), min(stop, time.nsamples))
+
+
+def window_ttests(data, y, x, windows, match='subject'):
+    """Related samples t-tests on the average in time windows, for all sensors at once
+
+    Parameters
+    ----------
+    data : Dataset
+        Dataset, as returned by :func:`comparison_dataset`.
+    y : str
+        Dependent variable (a (case, sensor, time) NDVar in ``data``).
+    x : str
+        Factor with exactly two cells (as in :class:`eelbrain.testnd.TTestRelated`,
+        the difference is the first cell minus the second cell).
+    windows : sequence of (tstart, tstop)
+        Time windows (in seconds; ``tstop`` exclusive).
+    match : str
+        Variable identifying related measurements.
+
+    Returns
+    -------
+    res : Dataset
+        Table with one case per window and sensor, with columns ``window``,
+        ``sensor``, ``difference``, ``t`` and ``p`` (two-tailed).
+    """
+    c1, c0 = data[x].cells
+    ds0 = data.sub(data[x] == c0)
+    ds1 = data.sub(data[x] == c1)
+    index = [ds1[match].index(subject)[0] for subject in ds0[match]]
+    y0 = ds0[y].get_data(('case', 'sensor', 'time'))
+    y1 = ds1[y].get_data(('case', 'sensor', 'time'))[index]
+    time = ds0[y].time
+    # Average in each window: (case, sensor, window)
+    slices = [time_slice(time, tstart, tstop) for tstart, tstop in windows]
+    difference = numpy.stack([(y1[..., s] - y0[..., s]).mean(-1) for s in slices], -1)
+    n = len(difference)
+    mean = difference.mean(0)
+    t = mean / (difference.std(0, ddof=1) / numpy.sqrt(n))
+    p = 2 * t_distribution.sf(numpy.abs(t), n - 1)
+    sensor = ds0[y].sensor
+    labels = [f'{tstart * 1000:g}-{tstop * 1000:g} ms' for tstart, tstop in windows]
+    return eelbrain.Dataset({
+        'window': eelbrain.Factor(labels, repeat=len(sensor)),
+        'sensor': eelbrain.Factor(list(sensor.names) * len(windows)),
+        'difference': eelbrain.Var(mean.T.ravel()),
+        't': eelbrain.Var(t.T.ravel()),
+        'p': eelbrain.Var(p.T.ravel()),
+    })
+
+
+def _simulate_patterns(n_subjects, n_sensors=64, seed=0):
+    rng = numpy.random.default_rng(seed)
+    sensor = eelbrain.Sensor(rng.normal(size=(n_sensors, 3)), [str(i) for i in range(1, n_sensors + 1)])
+    time = eelbrain.UTS(-0.100, 0.010, 110)
+    subjects = [f'S{i:03}' for i in range(n_subjects)]
+    return {
+        type_: {subject: eelbrain.NDVar(rng.normal(size=(n_sensors, len(time))), (sensor, time)) for subject in subjects}
+        for type_ in ['ERP', 'TRF']
+    }
+
+
+def _chained_normalization(patterns):
+    # The approach used previously in figures/Comparison-ERP-TRF.py
+    datasets = []
+    for type_, type_patterns in patterns.items():
+        data = eelbrain.Dataset.from_caselist(['subject', 'pattern'], list(type_patterns.items()))
+        data[:, 'type'] = type_
+        datasets.append(data)
+    data = eelbrain.combine(datasets, dim_intersection=True)
+    pattern_normalized = data['pattern'] - data['pattern'].mean('time')
+    normalize_by = pattern_normalized.std('time')
+    normalize_by[normalize_by == 0] = 1
+    pattern_normalized /= normalize_by
+    data['norm_pattern'] = pattern_normalized
+    return data
+
+
+def benchmark(n_subjects=(33, 100, 300)):
+    """Compare :func:`comparison_dataset` with chained NDVar operations"""
+    for n in n_subjects:
+        patterns = _simulate_patterns(n)
+        t0 = _time.perf_counter()
+        reference = _chained_normalization(patterns)
+        t1 = _time.perf_counter()
+        data = comparison_dataset(patterns)
+        t2 = _time.perf_counter()
+        assert numpy.allclose(reference['norm_pattern'].x, data['norm_pattern'].x)
+        print(f"{n:4} subjects: chained {t1 - t0:.3f} s, comparison_dataset {t2 - t1:.3f} s")
+
+
+if __name__ == '__main__':
+    benchmark()
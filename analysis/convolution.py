@@ -0,0 +1,204 @@
+"""Convolve many predictors with many kernels at once
+
+:func:`eelbrain.convolve` convolves one predictor with one kernel at a time.
+:func:`batch_convolve` computes the responses to a list of predictors (e.g.,
+one per stimulus) for kernels with several output channels (e.g., a
+``(sensor, frequency, time)`` mTRF): for long kernels, all predictors are
+split into blocks that are transformed in a single FFT, multiplied with the
+kernel spectra, and combined by overlap-add; short kernels are applied
+directly in the time domain. Predictor FFTs can be computed once
+(:class:`PredictorFFT`) and reused for several kernels.
+
+Run this module as a script for a benchmark with simulated data.
+"""
+import time as _time
+
+import eelbrain
+import numpy
+from scipy.fft import irfft, next_fast_len, rfft
+
+
+# Kernels with up to this many samples are applied in the time domain
+DIRECT_MAX_LAGS = 16
+
+
+def _other_dims(x):
+    return [dim for dim in x.dims if dim.name != 'time']
+
+
+def _data(x, names):
+    "(n_series, n_times) array"
+    return x.get_data((*names, 'time')).reshape((-1, len(x.time))).astype(float, copy=False)
+
+
+class PredictorFFT:
+    """Block-wise FFT of predictors, for convolution with kernels of up to ``n_lags`` samples
+
+    Parameters
+    ----------
+    xs : sequence of NDVar
+        Predictors (time and the same other dimensions, e.g., frequency).
+    n_lags : int
+        Maximum kernel length (in samples).
+    block_size : int
+        Length of the blocks (default based on ``n_lags``).
+    """
+    def __init__(self, xs, n_lags, block_size=None):
+        self.xs = list(xs)
+        self.dims = _other_dims(self.xs[0])
+        for x in self.xs[1:]:
+            if _other_dims(x) != self.dims:
+                raise ValueError(f"{x}: dimensions differ from the first predictor")
+        if block_size is None:
+            n_fft = next_fast_len(max(8 * n_lags, 512))
+            block_size = n_fft - n_lags + 1
+        else:
+            n_fft = next_fast_len(block_size + n_lags - 1)
+        self.n_lags = n_lags
+        self.block_size = block_size
+        self.n_fft = n_fft
+        # Blocks of all predictors, in order
+        blocks = []
+        self.n_blocks = []
+        names = [dim.name for dim in self.dims]
+        for x in self.xs:
+            data = _data(x, names)
+            n_blocks = -(-data.shape[1] // block_size)
+            padded = numpy.zeros((data.shape[0], n_blocks * block_size))
+            padded[:, :data.shape[1]] = data
+            blocks.append(padded.reshape((data.shape[0], n_blocks, block_size)).swapaxes(0, 1))
+            self.n_blocks.append(n_blocks)
+        # (frequency, block, shared), so that kernels are applied as one matrix product per frequency
+        self.fft = numpy.ascontiguousarray(rfft(numpy.concatenate(blocks), n_fft).transpose(2, 0, 1))
+
+
+def batch_convolve(h, x, method='auto', name=None):
+    """Convolve each predictor in ``x`` with the kernel ``h``
+
+    Parameters
+    ----------
+    h : NDVar
+        Kernel, with a time dimension (lags), the non-time dimensions of the
+        predictors (e.g., frequency), and optionally additional dimensions
+        (e.g., sensor).
+    x : sequence of NDVar | PredictorFFT
+        Predictors, or predictor FFTs from a previous call.
+    method : 'auto' | 'fft' | 'direct'
+        Overlap-add FFT convolution, or direct convolution in the time domain
+        (default: direct for kernels with up to :data:`DIRECT_MAX_LAGS`
+        samples, and when ``x`` is not a :class:`PredictorFFT`).
+    name : str
+        Name for the responses.
+
+    Returns
+    -------
+    responses : list of NDVar
+        For each predictor, the response with the additional dimensions of
+        ``h`` and the predictor's time dimension (as with
+        :func:`eelbrain.convolve`).
+    """
+    h_time = h.get_dim('time')
+    n_lags = len(h_time)
+    if isinstance(x, PredictorFFT):
+        x_fft = x
+        if n_lags > x_fft.n_lags:
+            raise ValueError(f"{h=}: kernel longer than the n_lags={x_fft.n_lags} of the predictor FFT")
+        xs = x_fft.xs
+    else:
+        x_fft = None
+        xs = list(x)
+    shared_dims = _other_dims(xs[0])
+    shared_names = [dim.name for dim in shared_dims]
+    if h.get_dims(shared_names) != tuple(shared_dims):
+        raise ValueError(f"{h=}: dimensions do not match predictor dimensions {shared_dims}")
+    for x_ in xs:
+        if x_.time.tstep != h_time.tstep:
+            raise ValueError(f"{x_}: incompatible time axis (unequal tstep; x: {x_.time.tstep}, h: {h_time.tstep})")
+    h_dims = [dim for dim in _other_dims(h) if dim.name not in shared_names]
+    h_names = [dim.name for dim in h_dims]
+    h_shape = [len(dim) for dim in h_dims]
+    n_h = int(numpy.prod(h_shape))
+    h_data = h.get_data((*h_names, *shared_names, 'time')).reshape((n_h, -1, n_lags))
+    # Kernel sample k corresponds to lag k + i_start
+    i_start = int(round(h_time.tmin / h_time.tstep))
+    if method == 'auto':
+        method = 'fft' if x_fft is not None or n_lags > DIRECT_MAX_LAGS else 'direct'
+
+    if method == 'direct':
+        full = []
+        for x_ in xs:
+            x_data = _data(x_, shared_names)
+            n_times = x_data.shape[1]
+            y = numpy.zeros((n_h, n_times + n_lags - 1))
+            for k in range(n_lags):
+                y[:, k: k + n_times] += h_data[:, :, k] @ x_data
+            full.append(y)
+    elif method == 'fft':
+        if x_fft is None:
+            x_fft = PredictorFFT(xs, n_lags)
+        # (frequency, shared, h)
+        h_fft = rfft(h_data, x_fft.n_fft).transpose(2, 1, 0)
+        # Sum over shared dimensions: (frequency, block, h) -> (block, h, time)
+        y_blocks = irfft(x_fft.fft @ h_fft, x_fft.n_fft, axis=0).transpose(1, 2, 0)
+        # Overlap-add
+        full = []
+        block_size = x_fft.block_size
+        start = 0
+        for x_, n_blocks in zip(xs, x_fft.n_blocks):
+            y = numpy.zeros((n_h, n_blocks * block_size + x_fft.n_fft))
+            for i in range(n_blocks):
+                y[:, i * block_size: i * block_size + x_fft.n_fft] += y_blocks[start + i]
+            start += n_blocks
+            full.append(y[:, :len(x_.time) + n_lags - 1])
+    else:
+        raise ValueError(f"{method=}")
+
+    # Select the samples corresponding to the predictor's time axis: y[t] = full[t - i_start]
+    responses = []
+    for x_, y in zip(xs, full):
+        n_times = len(x_.time)
+        out = numpy.zeros((n_h, n_times))
+        src_start = max(0, -i_start)
+        dst_start = max(0, i_start)
+        n = min(n_times - dst_start, y.shape[1] - src_start)
+        if n > 0:
+            out[:, dst_start: dst_start + n] = y[:, src_start: src_start + n]
+        dims = (*h_dims, x_.time)
+        responses.append(eelbrain.NDVar(out.reshape((*h_shape, n_times)), dims, name or x_.name))
+    return responses
+
+
+def _simulate(n_sensors, n_lags, n_predictors=12, n_bands=8, seed=0):
+    rng = numpy.random.default_rng(seed)
+    frequency = eelbrain.Scalar('frequency', numpy.arange(n_bands))
+    xs = [eelbrain.NDVar(rng.normal(size=(n_bands, n)), (frequency, eelbrain.UTS(-0.100, 0.010, n))) for n in rng.integers(5500, 7000, n_predictors)]
+    dims = (frequency, eelbrain.UTS(-0.100, 0.010, n_lags))
+    if n_sensors:
+        dims = (eelbrain.Sensor(rng.normal(size=(n_sensors, 3))), *dims)
+    h = eelbrain.NDVar(rng.normal(size=[len(dim) for dim in dims]), dims)
+    return h, xs
+
+
+def benchmark():
+    """Compare :func:`batch_convolve` with :func:`eelbrain.convolve` for each predictor"""
+    for n_sensors, n_lags in [(0, 110), (64, 110), (64, 10), (64, 30)]:
+        h, xs = _simulate(n_sensors, n_lags)
+        t0 = _time.perf_counter()
+        reference = [eelbrain.convolve(h, x) for x in xs]
+        times = {'eelbrain.convolve': _time.perf_counter() - t0}
+        for method in ['direct', 'fft']:
+            t0 = _time.perf_counter()
+            responses = batch_convolve(h, xs, method)
+            times[method] = _time.perf_counter() - t0
+            for y, y_ref in zip(responses, reference):
+                assert numpy.allclose(y.x, y_ref.get_data(y.dimnames))
+        x_fft = PredictorFFT(xs, n_lags)
+        t0 = _time.perf_counter()
+        batch_convolve(h, x_fft)
+        times['fft (reused)'] = _time.perf_counter() - t0
+        desc = ', '.join(f'{key} {seconds:.3f} s' for key, seconds in times.items())
+        print(f"{n_sensors:2} sensors x 8 bands x {n_lags:3} lags: {desc}")
+
+
+if __name__ == '__main__':
+    benchmark()
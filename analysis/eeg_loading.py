@@ -0,0 +1,314 @@
+"""Band-pass filtered and decimated EEG epochs, computed block by block
+
+The analysis scripts filter the raw EEG at its full sampling rate (e.g.,
+``raw.filter(0.5, 20)`` at 500 Hz), and then keep every 5th sample when
+loading epochs (``decim=5``). Here, the same zero-phase FIR band-pass is
+applied in two stages:
+
+ - The low-pass filter, which also serves as anti-aliasing filter, is applied
+   with polyphase decimation (:class:`envelope.Decimator`), which only
+   computes the output samples that are kept.
+ - The high-pass filter is applied at the decimated sampling rate, where its
+   kernel is ``decim`` times shorter.
+
+Each epoch is read from the raw file in blocks, together with the context
+needed by the filters, so that the recording is never held in memory at the
+full sampling rate. :func:`filter_bank_epochs` loads several bands from a
+single pass through the raw data. Bad channels are interpolated with
+:func:`interpolate_bad_channels`, which caches the interpolation matrix for each
+montage and set of bad channels.
+
+Run this module as a script for a benchmark with a simulated recording.
+"""
+from pathlib import Path
+import tempfile
+import time as _time
+import tracemalloc
+
+import eelbrain
+import mne
+import numpy
+
+from envelope import Decimator
+from fir_cache import convolve_valid, fir_kernel
+from trials import Trials
+
+
+# Interpolation matrices by (digitization, sensor positions, bad channels)
+_interpolation_matrices = {}
+
+
+def interpolation_matrix(info):
+    """Spherical spline interpolation matrix for the bad EEG channels
+
+    The matrix is the one used by :meth:`mne.io.Raw.interpolate_bads` (with
+    ``origin='auto'``), obtained by interpolating a unit impulse on each good
+    channel. It is computed once for each montage and set of bad channels,
+    and then cached.
+
+    Parameters
+    ----------
+    info : mne.Info
+        Measurement info with montage and bad channels.
+
+    Returns
+    -------
+    good : array of int
+        Indices of the good EEG channels in ``info``.
+    bad : array of int
+        Indices of the bad EEG channels in ``info``.
+    matrix : array (n_bad, n_good)
+        Interpolation matrix.
+    """
+    picks = mne.pick_types(info, eeg=True, exclude=[])
+    positions = numpy.array([info['chs'][i]['loc'][:3] for i in picks])
+    is_bad = numpy.isin([info['ch_names'][i] for i in picks], info['bads'])
+    digitization = numpy.array([point['r'] for point in info['dig'] or ()])
+    key = (digitization.tobytes(), positions.tobytes(), is_bad.tobytes())
+    if key not in _interpolation_matrices:
+        # The interpolation is linear, so interpolating a unit impulse on each good channel yields the columns of the matrix
+        probe = numpy.zeros((len(picks), numpy.sum(~is_bad)))
+        probe[~is_bad] = numpy.eye(probe.shape[1])
+        raw = mne.io.RawArray(probe, mne.pick_info(info, picks), verbose=False)
+        raw.interpolate_bads(origin='auto', verbose=False)
+        matrix = raw.get_data()[is_bad]
+        _interpolation_matrices[key] = (picks[~is_bad], picks[is_bad], matrix)
+    return _interpolation_matrices[key]
+
+
+def interpolate_bad_channels(data, info, block_size=10000):
+    """Interpolate bad EEG channels in place
+
+    Parameters
+    ----------
+    data : array (n_channels, n_times)
+        Data, with channels as in ``info``; modified in place.
+    info : mne.Info
+        Measurement info with montage and bad channels.
+    block_size : int
+        Number of samples that are interpolated at once.
+    """
+    good, bad, matrix = interpolation_matrix(info)
+    if len(bad) == 0:
+        return
+    for start in range(0, data.shape[1], block_size):
+        block = data[:, start: start + block_size]
+        block[bad] = matrix @ block[good]
+
+
+def filtered_epochs(events, tmin, tmax, l_freq, h_freq, decim=5, block_duration=10., interpolate_bads=True, adjacency='auto', name=None):
+    """Load band-pass filtered epochs at a reduced sampling rate
+
+    Parameters
+    ----------
+    events : Dataset
+        Events, with the raw data in ``events.info['raw']`` (as returned by
+        :func:`eelbrain.load.fiff.events`). The raw data do not need to be
+        preloaded.
+    tmin : scalar
+        Start of the epochs, relative to the events (in seconds).
+    tmax : sequence of scalar
+        Last sample of each epoch, relative to the event (in seconds; as for
+        :func:`eelbrain.load.fiff.variable_length_epochs`).
+    l_freq : scalar | None
+        High-pass frequency (as for :meth:`mne.io.Raw.filter`).
+    h_freq : scalar | None
+        Low-pass frequency; the filter needs to remove frequencies above the
+        Nyquist frequency of the decimated data.
+    decim : int
+        Decimation factor.
+    block_duration : scalar
+        Duration of the blocks that are read from the raw file (in seconds).
+    interpolate_bads : bool
+        Interpolate bad channels (after filtering and decimation, which
+        commute with the interpolation).
+    adjacency : str
+        Sensor adjacency (see :func:`eelbrain.load.fiff.epochs_ndvar`).
+    name : str
+        Name of the NDVars.
+
+    Returns
+    -------
+    epochs : Trials  (sensor, time)
+        Filtered data for each epoch, with the same samples as
+        :func:`eelbrain.load.fiff.variable_length_epochs` with ``decim``. The
+        epochs are stored in one buffer; ``epochs[i]`` is an NDVar view of
+        epoch ``i``, and ``epochs.concatenated()`` a view of all epochs
+        concatenated.
+
+    See Also
+    --------
+    filter_bank_epochs : several bands from a single pass through the data
+    """
+    bands = filter_bank_epochs(events, tmin, tmax, [(l_freq, h_freq)], decim, block_duration, interpolate_bads, adjacency, name)
+    return bands[l_freq, h_freq]
+
+
+def filter_bank_epochs(events, tmin, tmax, bands, decim=5, block_duration=10., interpolate_bads=True, adjacency='auto', name=None):
+    """Load epochs in several frequency bands with a single pass through the raw data
+
+    The raw data are read and decimated once, with the low-pass filter of the
+    band with the highest low-pass frequency (see :func:`filtered_epochs`).
+    The remaining filters of each band (high-pass, and lower low-pass) are
+    applied at the decimated sampling rate.
+
+    Parameters
+    ----------
+    events : Dataset
+        Events, with the raw data in ``events.info['raw']``.
+    tmin : scalar
+        Start of the epochs, relative to the events (in seconds).
+    tmax : sequence of scalar
+        Last sample of each epoch, relative to the event (in seconds).
+    bands : sequence of (scalar | None, scalar | None)
+        ``(l_freq, h_freq)`` of each band. With ``decim > 1``, all bands need
+        a low-pass frequency below the Nyquist frequency of the decimated data.
+    ...
+        Other parameters as for :func:`filtered_epochs`.
+
+    Returns
+    -------
+    epochs : dict {(l_freq, h_freq): Trials}
+        Filtered epochs for each band.
+    """
+    raw = events.info['raw']
+    sfreq = raw.info['sfreq']
+    out_sfreq = sfreq / decim
+    # All bands share the low-pass filter of the band with the highest low-pass frequency for decimation
+    h_freqs = [h_freq for l_freq, h_freq in bands]
+    h_max = None if None in h_freqs else max(h_freqs)
+    if h_max:
+        # Transition band of mne's default FIR design
+        h_stop = h_max + min(max(0.25 * h_max, 2.), sfreq / 2 - h_max)
+        if h_stop > out_sfreq / 2:
+            raise ValueError(f"h_freq={h_max}: the low-pass filter does not remove frequencies above the Nyquist frequency after decimation by {decim}")
+        lowpass = fir_kernel(sfreq, None, h_max)
+    elif decim > 1:
+        raise ValueError(f"bands={bands}: decimation by {decim} requires a low-pass filter (h_freq) for all bands")
+    else:
+        lowpass = numpy.ones(1)
+    n_lowpass = Decimator(decim, lowpass).half_length
+    # The remaining filters of each band are applied at the decimated rate
+    filters = {(l_freq, h_freq): (l_freq, None if h_freq == h_max else h_freq) for l_freq, h_freq in bands}
+    n_kernels = {key: len(fir_kernel(out_sfreq, *band)) // 2 if any(band) else 0 for key, band in filters.items()}
+    n_kernel = max(n_kernels.values())
+    picks = mne.pick_types(raw.info, eeg=True, exclude=[] if interpolate_bads else 'bads')
+    # First sample and number of samples (after decimation) of each epoch
+    i_start = events['i_start'].x - raw.first_samp + int(round(tmin * sfreq))
+    n_times = (numpy.round(numpy.asarray(tmax) * sfreq).astype(int) - int(round(tmin * sfreq))) // decim + 1
+    block_size = int(round(block_duration * sfreq))
+    # Decimator output samples at the start of each epoch that are affected by the zeros before the data
+    skip = -(-n_lowpass // decim)
+    info = mne.create_info([raw.ch_names[i] for i in picks], out_sfreq, 'eeg')
+    info.set_montage(raw.get_montage())
+    # Sensor dimension and info of the NDVars
+    template = eelbrain.load.fiff.epochs_ndvar(mne.EpochsArray(numpy.zeros((1, len(picks), 1)), info, tmin=tmin, verbose=False), name, adjacency=adjacency)
+    info['bads'] = [ch for ch in raw.info['bads'] if ch in info['ch_names']]
+    # One buffer per band, into which the epochs are written
+    data = {key: Trials((template.sensor,), template.time.tmin, template.time.tstep, n_times, name, template.info) for key in filters}
+    for i, (start, n) in enumerate(zip(i_start, n_times)):
+        # Read the epoch with the context for all filters, aligned to the decimated samples of the epoch
+        read_start = start - (n_kernel + skip) * decim
+        read_stop = start + (n - 1 + n_kernel) * decim + n_lowpass + 1
+        decimator = Decimator(decim, lowpass)
+        blocks = []
+        for block_start in range(read_start, read_stop, block_size):
+            block_stop = min(block_start + block_size, read_stop)
+            # Zeros outside of the recording
+            block = numpy.zeros((len(picks), block_stop - block_start))
+            valid_start, valid_stop = max(block_start, 0), min(block_stop, raw.n_times)
+            if valid_stop > valid_start:
+                block[:, valid_start - block_start: valid_stop - block_start] = raw.get_data(picks, valid_start, valid_stop)
+            blocks.append(decimator.process(block))
+        blocks.append(decimator.finish())
+        x = numpy.concatenate(blocks, 1)[:, skip:]
+        for key, band in filters.items():
+            n_context = n_kernel - n_kernels[key]
+            data[key].trial_data(i)[...] = convolve_valid(x[:, n_context: n_context + n + 2 * n_kernels[key]], out_sfreq, *band)
+    if interpolate_bads and info['bads']:
+        for trials in data.values():
+            interpolate_bad_channels(trials.data, info)
+    return data
+
+
+def _simulate_raw(path, n_channels=64, duration=300, sfreq=500, n_trials=6, seed=0):
+    rng = numpy.random.default_rng(seed)
+    montage = mne.channels.make_standard_montage('standard_1005')
+    ch_names = montage.ch_names[:n_channels]
+    n = int(duration * sfreq)
+    # Brown noise with line noise, similar in spectrum to EEG
+    data = numpy.cumsum(rng.normal(size=(n_channels, n)), 1) * 1e-7
+    data -= data.mean(1, keepdims=True)
+    data += 1e-6 * numpy.sin(2 * numpy.pi * 60 * numpy.arange(n) / sfreq)
+    trigger = numpy.zeros((1, n))
+    onsets = numpy.linspace(5 * sfreq, n - 50 * sfreq, n_trials).astype(int) + rng.integers(0, 5, n_trials)
+    trigger[0, onsets] = numpy.arange(1, n_trials + 1)
+    info = mne.create_info([*ch_names, 'STI 014'], sfreq, ['eeg'] * n_channels + ['stim'])
+    raw = mne.io.RawArray(numpy.concatenate([data, trigger]), info, verbose=False)
+    raw.set_montage(montage)
+    raw.info['bads'] = ch_names[:2]
+    raw.save(path, verbose=False)
+    return [40 - i for i in range(n_trials)]
+
+
+def _full_rate(path, durations, l_freq, h_freq):
+    # The approach used in the analysis scripts
+    raw = mne.io.read_raw(path, preload=True, verbose=False)
+    raw.filter(l_freq, h_freq, n_jobs=1, verbose=False)
+    raw.interpolate_bads(verbose=False)
+    events = eelbrain.load.fiff.events(raw)
+    return eelbrain.load.fiff.variable_length_epochs(events, -0.100, durations, decim=5, adjacency='auto')
+
+
+def benchmark(bands=((0.5, 20), (1, 8))):
+    """Compare :func:`filtered_epochs` with filtering the preloaded raw data, and :func:`filter_bank_epochs` with loading each band separately"""
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = Path(tempdir) / 'simulated-raw.fif'
+        durations = _simulate_raw(path)
+        load_events = lambda: eelbrain.load.fiff.events(mne.io.read_raw(path, verbose=False))
+        for l_freq, h_freq in bands:
+            results = {}
+            for label, function in [('full-rate', lambda: _full_rate(path, durations, l_freq, h_freq)), ('fused', lambda: filtered_epochs(load_events(), -0.100, durations, l_freq, h_freq))]:
+                results[label] = _measure(f"{l_freq}-{h_freq} Hz, {label}", function)
+            errors = []
+            for fused, full in zip(results['fused'], results['full-rate']):
+                assert fused.time == full.time and list(fused.sensor.names) == list(full.sensor.names)
+                errors.append(((fused.x - full.x) ** 2).mean() / (full.x ** 2).mean())
+            print(f"  relative squared difference: at most {max(errors):.2e}")
+        bank_bands = [*bands, (1, 20)]
+        separate = _measure(f"{len(bank_bands)} bands, separately", lambda: {band: filtered_epochs(load_events(), -0.100, durations, *band) for band in bank_bands})
+        bank = _measure(f"{len(bank_bands)} bands, filter bank", lambda: filter_bank_epochs(load_events(), -0.100, durations, bank_bands))
+        for band in bank_bands:
+            errors = []
+            for x_bank, x_separate in zip(bank[band], separate[band]):
+                assert x_bank.time == x_separate.time
+                errors.append(((x_bank.x - x_separate.x) ** 2).mean() / (x_separate.x ** 2).mean())
+            print(f"  {band[0]}-{band[1]} Hz, relative squared difference: at most {max(errors):.2e}")
+        # Interpolating the same bad channels for several subjects
+        raw = mne.io.read_raw(path, preload=True, verbose=False).pick('eeg')
+        n_subjects = 10
+        _interpolation_matrices.clear()
+        results = {}
+        for label, function in [('mne', lambda data: mne.io.RawArray(data, raw.info, verbose=False).interpolate_bads(verbose=False).get_data()), ('cached', lambda data: interpolate_bad_channels(data, raw.info) or data)]:
+            t0 = _time.perf_counter()
+            for _ in range(n_subjects):
+                results[label] = function(raw.get_data())
+            print(f"bad channel interpolation, {label:6}: {(_time.perf_counter() - t0) / n_subjects:5.3f} s per subject")
+        numpy.testing.assert_allclose(results['cached'], results['mne'], rtol=1e-10, atol=0)
+
+
+def _measure(desc, function):
+    t0 = _time.perf_counter()
+    result = function()
+    seconds = _time.perf_counter() - t0
+    # Memory in a separate run, since tracing slows down the Python code
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    print(f"{desc:28}: {seconds:5.2f} s, peak memory {peak:6.1f} MB")
+    return result
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,273 @@
+"""Envelope predictors computed block by block from wav files
+
+Computing the envelope of a whole stimulus at the audio sampling rate and then
+resampling it (as in ``wav.envelope()`` followed by :func:`eelbrain.resample`)
+holds several full-rate copies of the stimulus in memory. Here, the wav file
+is read in blocks, and each block is passed through the envelope and a
+polyphase decimation filter (which only computes the output samples that are
+kept), so that memory use depends on the block size, not on the stimulus
+duration.
+
+Run this module as a script for a benchmark with a simulated stimulus.
+"""
+from pathlib import Path
+import tempfile
+import time as _time
+import tracemalloc
+import wave
+
+import eelbrain
+import numpy
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.fft import next_fast_len
+from scipy.signal import firwin, hilbert, oaconvolve, resample_poly
+
+
+def read_wav_blocks(path, block_duration):
+    """Read a mono wav file in blocks
+
+    Parameters
+    ----------
+    path : path-like
+        Wav file.
+    block_duration : scalar
+        Duration of the blocks (in seconds).
+
+    Returns
+    -------
+    samplingrate : int
+        Sampling rate of the wav file.
+    n_samples : int
+        Number of samples in the file.
+    blocks : iterator of array
+        Data in blocks of ``block_duration`` (the last block may be shorter).
+    """
+    file = wave.open(str(path), 'rb')
+    if file.getnchannels() != 1:
+        file.close()
+        raise ValueError(f"{path}: {file.getnchannels()} channels; only mono files are supported")
+
+    block_size = int(round(block_duration * file.getframerate()))
+
+    def blocks():
+        with file:
+            dtype = f'<i{file.getsampwidth()}'
+            while data := file.readframes(block_size):
+                yield numpy.frombuffer(data, dtype).astype(float)
+    return file.getframerate(), file.getnframes(), blocks()
+
+
+def hilbert_envelope_blocks(blocks, margin):
+    """Hilbert envelope, computed on overlapping blocks
+
+    Each block is transformed together with ``margin`` samples of context on
+    either side; the envelope of the whole signal is approximated to within
+    the decay of the Hilbert transform kernel over ``margin`` samples.
+    """
+    buffer = numpy.empty(0)
+    buffer_start = 0  # index of buffer[0] in the whole signal
+    emitted = 0  # number of samples emitted
+    for block in blocks:
+        buffer = numpy.concatenate([buffer, block])
+        stop = buffer_start + len(buffer) - margin
+        if stop <= emitted:
+            continue
+        envelope = numpy.abs(hilbert(buffer, next_fast_len(len(buffer))))
+        yield envelope[emitted - buffer_start: stop - buffer_start]
+        emitted = stop
+        # Keep the context needed for the next block
+        drop = max(0, emitted - margin - buffer_start)
+        buffer = buffer[drop:]
+        buffer_start += drop
+    if len(buffer):
+        envelope = numpy.abs(hilbert(buffer, next_fast_len(len(buffer))))
+        yield envelope[emitted - buffer_start:]
+
+
+class Decimator:
+    """Incremental polyphase FIR decimation by an integer factor
+
+    Equivalent to ``scipy.signal.resample_poly(x, 1, factor, axis=-1)``
+    applied to the whole signal, but the signal is passed in blocks (along
+    the last axis) with :meth:`process`, followed by :meth:`finish`.
+
+    Parameters
+    ----------
+    factor : int
+        Decimation factor.
+    kernel : array
+        Zero-phase FIR filter (symmetric, with an odd number of taps) to use
+        instead of the anti-aliasing filter of ``resample_poly``. Only the
+        output samples that are kept are computed.
+    """
+    def __init__(self, factor, kernel=None):
+        self.factor = factor
+        if kernel is None:
+            self.half_length = 10 * factor
+            # Same anti-aliasing filter as scipy.signal.resample_poly
+            kernel = firwin(2 * self.half_length + 1, 1 / factor, window=('kaiser', 5.0))
+        else:
+            self.half_length = len(kernel) // 2
+        self.kernel = kernel
+        self._buffer = None  # initialized with zeros before the start of the signal
+        self._buffer_start = -self.half_length  # signal index of _buffer[..., 0]
+        self._next = 0  # index of the next output sample
+        self._n_samples = 0
+
+    def _emit(self):
+        # Output sample k uses input samples [k * factor - half_length, k * factor + half_length]
+        n_taps = len(self.kernel)
+        first = self._next * self.factor - self.half_length - self._buffer_start
+        n_out = (self._buffer.shape[-1] - first - n_taps) // self.factor + 1
+        if n_out <= 0:
+            return self._buffer[..., :0]
+        if n_taps // self.factor < 32:
+            # Few taps per output sample: direct dot products
+            windows = sliding_window_view(self._buffer[..., first:], n_taps, -1)[..., ::self.factor, :][..., :n_out, :]
+            out = windows @ self.kernel
+        else:
+            # Polyphase decomposition: out[k] = sum_j kernel[j] x[k * factor + 2 * half_length - j], with j = q * factor + r
+            out = 0
+            shape = (1,) * (self._buffer.ndim - 1) + (-1,)
+            for r in range(self.factor):
+                start = first + (2 * self.half_length - r) % self.factor
+                offset = (2 * self.half_length - r) // self.factor
+                phase = oaconvolve(self._buffer[..., start::self.factor], self.kernel[r::self.factor].reshape(shape), axes=-1)
+                out = out + phase[..., offset: offset + n_out]
+        self._next += n_out
+        drop = self._next * self.factor - self.half_length - self._buffer_start
+        self._buffer = self._buffer[..., drop:]
+        self._buffer_start += drop
+        return out
+
+    def process(self, block):
+        "Add a block of input samples and return the output samples that are complete"
+        if self._buffer is None:
+            self._buffer = numpy.zeros((*block.shape[:-1], self.half_length))
+        self._buffer = numpy.concatenate([self._buffer, block], -1)
+        self._n_samples += block.shape[-1]
+        return self._emit()
+
+    def finish(self):
+        "Return the remaining output samples (assuming zeros after the end of the signal)"
+        if self._buffer is None:
+            return numpy.empty(0)
+        n_out = -(-self._n_samples // self.factor)
+        n_emitted = self._next
+        self._buffer = numpy.concatenate([self._buffer, numpy.zeros((*self._buffer.shape[:-1], self.half_length))], -1)
+        return self._emit()[..., :n_out - n_emitted]
+
+
+def envelope_predictor(path, samplingrate=100, method='hilbert', block_duration=10., margin=1., pad=1., name=None):
+    """Log envelope of a wav file at ``samplingrate``, computed block by block
+
+    Parameters
+    ----------
+    path : path-like
+        Mono wav file.
+    samplingrate : int
+        Sampling rate of the envelope (the wav sampling rate needs to be an
+        integer multiple).
+    method : 'hilbert' | 'rectify'
+        Hilbert envelope, or rectified signal (which does not need context
+        around each block, and is faster).
+    block_duration : scalar
+        Duration of the blocks that are read from the file (in seconds).
+    margin : scalar
+        Context around each block for the Hilbert transform (in seconds).
+    pad : scalar
+        Silence appended at the end (in seconds).
+    name : str
+        Name of the predictor (default is the file name).
+
+    Returns
+    -------
+    envelope : NDVar
+        ``log(envelope + 1)``, with the envelope clipped at 0 after
+        decimation.
+    """
+    path = Path(path)
+    wav_samplingrate, n_samples, blocks = read_wav_blocks(path, block_duration)
+    factor = wav_samplingrate // samplingrate
+    if factor * samplingrate != wav_samplingrate:
+        blocks.close()
+        raise ValueError(f"{samplingrate=}: needs to divide the sampling rate of {path} ({wav_samplingrate} Hz)")
+    if method == 'hilbert':
+        blocks = hilbert_envelope_blocks(blocks, int(round(margin * wav_samplingrate)))
+    elif method == 'rectify':
+        blocks = map(numpy.abs, blocks)
+    else:
+        raise ValueError(f"{method=}")
+    decimator = Decimator(factor)
+    out = [decimator.process(block) for block in blocks]
+    out.append(decimator.finish())
+    # Same number of samples as eelbrain.resample()
+    n_out = int(round(n_samples / factor))
+    x = numpy.zeros(n_out + int(round(pad * samplingrate)))
+    x[:n_out] = numpy.concatenate(out)[:n_out]
+    numpy.clip(x, 0, None, out=x)
+    numpy.log1p(x, out=x)
+    time = eelbrain.UTS(0, 1 / samplingrate, len(x))
+    return eelbrain.NDVar(x, (time,), name or path.name, {'filename': str(path), 'samplingrate': samplingrate})
+
+
+def _full_rate_envelope(path, samplingrate=100, pad=1.):
+    # The approach used previously in figures/TRF.py
+    wav = eelbrain.load.wav(path)
+    envelope = wav.envelope()
+    envelope = eelbrain.resample(envelope, samplingrate).clip(0)
+    silence = eelbrain.NDVar.zeros(eelbrain.UTS(0, 1 / samplingrate, int(round(pad * samplingrate))))
+    envelope = eelbrain.concatenate([envelope, silence])
+    return (envelope + 1).log()
+
+
+def _whole_signal_envelope(path, samplingrate=100):
+    # The same computation as envelope_predictor(), applied to the whole signal at once
+    wav = eelbrain.load.wav(path)
+    envelope = numpy.abs(hilbert(wav.x.astype(float)))
+    envelope = resample_poly(envelope, 1, wav.info['samplingrate'] // samplingrate)
+    return numpy.log1p(numpy.clip(envelope, 0, None))
+
+
+def _simulate_wav(path, duration=60, samplingrate=44100, seed=0):
+    # Noise, amplitude modulated by a slow random envelope (similar to speech)
+    rng = numpy.random.default_rng(seed)
+    n = int(duration * samplingrate)
+    modulation = numpy.repeat(rng.gamma(1, size=n // 4410 + 1), 4410)[:n]
+    x = rng.normal(0, 3000, n) * modulation
+    with wave.open(str(path), 'wb') as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(samplingrate)
+        file.writeframes(numpy.clip(x, -32768, 32767).astype('<i2').tobytes())
+
+
+def benchmark(durations=(60, 300)):
+    """Compare :func:`envelope_predictor` with the full-rate envelope"""
+    with tempfile.TemporaryDirectory() as tempdir:
+        for duration in durations:
+            path = Path(tempdir) / f'{duration}.wav'
+            _simulate_wav(path, duration)
+            results = {}
+            for label, function in [('full-rate', _full_rate_envelope), ('hilbert', envelope_predictor), ('rectify', lambda path: envelope_predictor(path, method='rectify'))]:
+                tracemalloc.start()
+                t0 = _time.perf_counter()
+                results[label] = function(path)
+                seconds = _time.perf_counter() - t0
+                peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                tracemalloc.stop()
+                print(f"{duration:4} s stimulus, {label:9}: {seconds:5.2f} s ({duration / seconds:5.0f}x real time), peak memory {peak:6.1f} MB")
+            # Block-wise vs. whole-signal Hilbert transform
+            whole = _whole_signal_envelope(path)
+            r = numpy.corrcoef(whole, results['hilbert'].x[:len(whole)])[0, 1]
+            print(f"  hilbert: correlation with the whole-signal computation r = {r:.6f}")
+            # Polyphase vs. FFT resampling, in the frequency band used for the TRFs
+            reference = eelbrain.filter_data(results['full-rate'], 1, 8)
+            for label in ['hilbert', 'rectify']:
+                assert results[label].time == reference.time
+                r = numpy.corrcoef(eelbrain.filter_data(results[label], 1, 8).x, reference.x)[0, 1]
+                print(f"  {label}: correlation with the full-rate envelope (1-8 Hz) r = {r:.5f}")
+
+
+if __name__ == '__main__':
+    benchmark()
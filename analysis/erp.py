@@ -0,0 +1,123 @@
+"""Helpers for extracting event-related potentials (ERPs) from continuous EEG segments
+
+Instead of cutting out every epoch as a separate NDVar, epochs are addressed
+by the sample index of their first sample, and the data of all epochs in a
+segment are gathered with a single indexing operation.
+"""
+import eelbrain
+import numpy
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def epoch_fits(time, onsets, tstart, tstop):
+    """Boolean index of the events whose epoch fits into a data segment"""
+    onsets = numpy.asarray(onsets, float)
+    return (onsets + tstart >= 0) & (onsets + tstop <= time.tstop)
+
+
+def epoch_start_indices(time, onsets, tstart, tstop):
+    """Find the first sample of each epoch that fits into a data segment
+
+    Parameters
+    ----------
+    time : UTS
+        Time axis of the continuous data segment.
+    onsets : array_like
+        Event onset times (in seconds, relative to the segment's time axis).
+    tstart : scalar
+        Epoch start relative to the event onset (in seconds).
+    tstop : scalar
+        Epoch stop relative to the event onset (in seconds, exclusive).
+
+    Returns
+    -------
+    starts : array of int
+        Index of the first sample of each epoch. Events whose epoch would
+        start before 0 or end after the end of the segment are dropped.
+    """
+    onsets = numpy.asarray(onsets, float)
+    onsets = onsets[epoch_fits(time, onsets, tstart, tstop)]
+    start_float = (onsets + tstart - time.tmin) / time.tstep
+    # Same rounding as NDVar.sub(time=(start, stop)): the first sample at or after the start time
+    return numpy.ceil(start_float - 1e-6).astype(int)
+
+
+def gather_epochs(data, starts, n_times):
+    """Extract all epochs from a (sensor, time) array with a single indexing operation
+
+    Returns
+    -------
+    epochs : array, (sensor, epoch, time)
+    """
+    windows = sliding_window_view(data, n_times, axis=-1)
+    return windows[:, starts]
+
+
+class ERPAccumulator:
+    """Average epochs in several conditions in a single pass, without storing the epochs
+
+    For each condition, the accumulator keeps the running sum, the sum of
+    squares and the number of epochs, from which the average and its standard
+    error are computed at the end.
+
+    Parameters
+    ----------
+    conditions : sequence of str
+        Condition names.
+    tstart : scalar
+        Epoch start relative to the event onset (in seconds).
+    tstop : scalar
+        Epoch stop relative to the event onset (in seconds, exclusive).
+    baseline : bool
+        Subtract from each epoch its average over time.
+    """
+    def __init__(self, conditions, tstart, tstop, baseline=True):
+        self.conditions = list(conditions)
+        self.tstart = tstart
+        self.tstop = tstop
+        self.baseline = baseline
+        self.n = numpy.zeros(len(self.conditions), int)
+        self.sum = self.sum_squares = 0
+        self.sensor = self.time = self.info = None
+
+    def add(self, eeg, onsets, masks):
+        """Add the epochs from one continuous EEG segment
+
+        Parameters
+        ----------
+        eeg : NDVar  (sensor, time)
+            Continuous EEG data segment.
+        onsets : array_like
+            Event onset times (in seconds, relative to ``eeg``'s time axis).
+        masks : array_like of bool, (condition, event)
+            For each condition, which of the events belong to it.
+        """
+        if self.time is None:
+            n_times = int(round((self.tstop - self.tstart) / eeg.time.tstep))
+            self.time = eelbrain.UTS(self.tstart, eeg.time.tstep, n_times)
+            self.sensor = eeg.sensor
+            self.info = eeg.info
+        fits = epoch_fits(eeg.time, onsets, self.tstart, self.tstop)
+        starts = epoch_start_indices(eeg.time, onsets, self.tstart, self.tstop)
+        weights = numpy.asarray(masks, float)[:, fits]
+        epochs = gather_epochs(eeg.get_data(('sensor', 'time')), starts, len(self.time))
+        if self.baseline:
+            epochs = epochs - epochs.mean(-1, keepdims=True)
+        # Sums for all conditions: (condition, event) x (sensor, event, time) -> (condition, sensor, time)
+        self.sum += numpy.einsum('ce,set->cst', weights, epochs)
+        self.sum_squares += numpy.einsum('ce,set->cst', weights, epochs ** 2)
+        self.n += weights.sum(1).astype(int)
+
+    def dataset(self):
+        """Dataset with one case per condition (columns ``condition``, ``n``, ``erp`` and ``sem``)"""
+        n = self.n[:, None, None]
+        erp = self.sum / n
+        variance = (self.sum_squares - n * erp ** 2) / (n - 1)
+        sem = numpy.sqrt(variance.clip(0) / n)
+        dims = ('case', self.sensor, self.time)
+        return eelbrain.Dataset({
+            'condition': eelbrain.Factor(self.conditions),
+            'n': eelbrain.Var(self.n),
+            'erp': eelbrain.NDVar(erp, dims, 'erp', self.info),
+            'sem': eelbrain.NDVar(sem, dims, 'sem', self.info),
+        })
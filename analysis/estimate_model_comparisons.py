@@ -0,0 +1,76 @@
+"""This script compares models with shuffled-predictor null models (analogous to ``+@`` and ``@`` comparisons in the pipeline) and saves the results
+
+Full and null models are estimated with boosting in a single batch, and share the lagged covariance statistics of all predictors that are not shuffled (see ``model_comparison.py``). Boosting parameters are those of the pipeline's ``alice.show_model_test``, except for the ``l2`` error function.
+"""
+from pathlib import Path
+import re
+
+import eelbrain
+import mne
+
+from eeg_loading import filtered_epochs
+from fir_cache import filter_data
+from impulses import impulse_predictor
+from model_comparison import ModelComparison
+from stimuli import load_stimulus_index, predictor_time
+
+
+STIMULI = [str(i) for i in range(1, 13)]
+DATA_ROOT = Path("~").expanduser() / 'Data' / 'Alice'
+PREDICTOR_DIR = DATA_ROOT / 'predictors'
+EEG_DIR = DATA_ROOT / 'eeg'
+SUBJECTS = [path.name for path in EEG_DIR.iterdir() if re.match(r'S\d*', path.name)]
+COMPARISON_DIR = DATA_ROOT / 'model-comparisons'
+COMPARISON_DIR.mkdir(exist_ok=True)
+N_SHUFFLES = 3
+
+# Load stimuli
+# ------------
+def load_predictor(name, key):
+    xs = [eelbrain.load.unpickle(PREDICTOR_DIR / f'{stimulus}~{key}.pickle') for stimulus in STIMULI]
+    xs = [x.bin(0.01, dim='time', label='start') for x in xs]
+    xs = [eelbrain.pad(x, tstart=-0.100, tstop=x.time.tstop + 1, name=name) for x in xs]
+    return [filter_data(x, 0.5, 20) for x in xs]
+
+
+predictors = {
+    'envelope': load_predictor('envelope', 'gammatone-1'),
+    'onset': load_predictor('onset', 'gammatone-on-1'),
+    'gammatone': load_predictor('gammatone', 'gammatone-8'),
+    'gammatone_on': load_predictor('gammatone_on', 'gammatone-on-8'),
+}
+# Word predictors are impulses at word onsets (sparse; smoothed into dense time series by the boosting basis)
+word_tables = [eelbrain.load.unpickle(PREDICTOR_DIR / f'{stimulus}~word.pickle') for stimulus in STIMULI]
+predictors['word'] = [impulse_predictor(x.time, data=data, name='word') for x, data in zip(predictors['envelope'], word_tables)]
+predictors['lexical'] = [impulse_predictor(x.time, value='lexical', data=data, name='lexical') for x, data in zip(predictors['envelope'], word_tables)]
+stimulus_index = load_stimulus_index(DATA_ROOT)
+durations = [predictor_time(stimulus_index[stimulus]).tmax for stimulus in STIMULI]
+
+# Comparisons
+# -----------
+# (full model, shuffled term)
+comparisons = {
+    'envelope +@ onset': (['envelope', 'onset'], 'onset'),
+    'acoustic @ gammatone_on': (['gammatone', 'gammatone_on'], 'gammatone_on'),
+    'word +@ lexical': (['word', 'lexical'], 'lexical'),
+}
+
+for subject in SUBJECTS:
+    path = COMPARISON_DIR / f'{subject}.pickle'
+    if path.exists():
+        continue
+    raw = mne.io.read_raw(EEG_DIR / subject / f'{subject}_alice-raw.fif')
+    events = eelbrain.load.fiff.events(raw)
+    trial_indexes = [STIMULI.index(stimulus) for stimulus in events['event']]
+    trial_durations = [durations[i] for i in trial_indexes]
+    eeg = filtered_epochs(events, -0.100, trial_durations, 0.5, 20)
+    # One segment per trial; null models shift the term within each trial, and concatenated predictors are shared by all comparisons
+    engine = ModelComparison(eeg, {name: [xs[i] for i in trial_indexes] for name, xs in predictors.items()}, -0.100, 1.000)
+    rows = []
+    for comparison, (model, term) in comparisons.items():
+        print(f"Estimating: {subject} ~ {comparison}")
+        full, null = engine.test_term(model, term, N_SHUFFLES)
+        # Improvement of the full model over the average null model
+        rows.append([comparison, full, null.mean('case'), full - null.mean('case')])
+    data = eelbrain.Dataset.from_caselist(['comparison', 'full', 'null', 'difference'], rows)
+    eelbrain.save.pickle(data, path)
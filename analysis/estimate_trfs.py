@@ -5,6 +5,13 @@ import re
 import eelbrain
 import mne
 
+from eeg_loading import filtered_epochs
+from fir_cache import filter_data
+from prefetch import Prefetcher
+from spatial_components import component_boosting, component_filter, component_suffix
+from stimuli import load_stimulus_index, predictor_time
+from trials import PredictorCache
+
 
 STIMULI = [str(i) for i in range(1, 13)]
 DATA_ROOT = Path("~").expanduser() / 'Data' / 'Alice'
@@ -14,6 +21,9 @@ SUBJECTS = [path.name for path in EEG_DIR.iterdir() if re.match(r'S\d*', path.na
 # Define a target directory for TRF estimates and make sure the directory is created
 TRF_DIR = DATA_ROOT / 'TRFs'
 TRF_DIR.mkdir(exist_ok=True)
+# Optionally, fit TRFs to the top spatial components of the EEG instead of to each sensor, and project them back to sensor space; set to ('pca', 10) or ('dss', 10) for k=10 principal or DSS components (see spatial_components.py)
+SPATIAL_COMPONENTS = None
+SUFFIX = component_suffix(SPATIAL_COMPONENTS)
 
 # Load stimuli
 # ------------
@@ -25,31 +35,31 @@ gammatone = [x.bin(0.01, dim='time', label='start') for x in gammatone]
 # Pad onset with 100 ms and offset with 1 second; make sure to give the predictor a unique name as that will make it easier to identify the TRF later
 gammatone = [eelbrain.pad(x, tstart=-0.100, tstop=x.time.tstop + 1, name='gammatone') for x in gammatone]
 # Filter the predictor with the same parameters as we will filter the EEG data
-gammatone = [eelbrain.filter_data(x, 0.5, 20) for x in gammatone]
+gammatone = [filter_data(x, 0.5, 20) for x in gammatone]
 
 # Load the broad-band envelope and process it in the same way
 envelope = [eelbrain.load.unpickle(PREDICTOR_DIR / f'{stimulus}~gammatone-1.pickle') for stimulus in STIMULI]
 envelope = [x.bin(0.01, dim='time', label='start') for x in envelope]
 envelope = [eelbrain.pad(x, tstart=-0.100, tstop=x.time.tstop + 1, name='envelope') for x in envelope]
-envelope = [eelbrain.filter_data(x, 0.5, 20) for x in envelope]
+envelope = [filter_data(x, 0.5, 20) for x in envelope]
 onset_envelope = [eelbrain.load.unpickle(PREDICTOR_DIR / f'{stimulus}~gammatone-on-1.pickle') for stimulus in STIMULI]
 onset_envelope = [x.bin(0.01, dim='time', label='start') for x in onset_envelope]
 onset_envelope = [eelbrain.pad(x, tstart=-0.100, tstop=x.time.tstop + 1, name='onset') for x in onset_envelope]
-onset_envelope = [eelbrain.filter_data(x, 0.5, 20) for x in onset_envelope]
+onset_envelope = [filter_data(x, 0.5, 20) for x in onset_envelope]
 # Load onset spectrograms and make sure the time dimension is equal to the gammatone spectrograms
 gammatone_onsets = [eelbrain.load.unpickle(PREDICTOR_DIR / f'{stimulus}~gammatone-on-8.pickle') for stimulus in STIMULI]
 gammatone_onsets = [x.bin(0.01, dim='time', label='start') for x in gammatone_onsets]
 gammatone_onsets = [eelbrain.set_time(x, gt.time, name='gammatone_on') for x, gt in zip(gammatone_onsets, gammatone)]
-gammatone_onsets = [eelbrain.filter_data(x, 0.5, 20) for x in gammatone_onsets]
+gammatone_onsets = [filter_data(x, 0.5, 20) for x in gammatone_onsets]
 # Load linear and powerlaw scaled spectrograms
 gammatone_lin = [eelbrain.load.unpickle(PREDICTOR_DIR / f'{stimulus}~gammatone-lin-8.pickle') for stimulus in STIMULI]
 gammatone_lin = [x.bin(0.01, dim='time', label='start') for x in gammatone_lin]
 gammatone_lin = [eelbrain.set_time(x, gt.time, name='gammatone_on') for x, gt in zip(gammatone_lin, gammatone)]
-gammatone_lin = [eelbrain.filter_data(x, 0.5, 20) for x in gammatone_lin]
+gammatone_lin = [filter_data(x, 0.5, 20) for x in gammatone_lin]
 gammatone_pow = [eelbrain.load.unpickle(PREDICTOR_DIR / f'{stimulus}~gammatone-pow-8.pickle') for stimulus in STIMULI]
 gammatone_pow = [x.bin(0.01, dim='time', label='start') for x in gammatone_pow]
 gammatone_pow = [eelbrain.set_time(x, gt.time, name='gammatone_on') for x, gt in zip(gammatone_pow, gammatone)]
-gammatone_pow = [eelbrain.filter_data(x, 0.5, 20) for x in gammatone_pow]
+gammatone_pow = [filter_data(x, 0.5, 20) for x in gammatone_pow]
 # Load word tables and convert tables into continuous time-series with matching time dimension
 word_tables = [eelbrain.load.unpickle(PREDICTOR_DIR / f'{stimulus}~word.pickle') for stimulus in STIMULI]
 word_onsets = [eelbrain.event_impulse_predictor(gt.time, data=data, name='word') for gt, data in zip(gammatone, word_tables)]
@@ -57,8 +67,9 @@ word_onsets = [eelbrain.event_impulse_predictor(gt.time, data=data, name='word')
 word_lexical = [eelbrain.event_impulse_predictor(gt.time, value='lexical', data=data, name='lexical') for gt, data in zip(gammatone, word_tables)]
 word_nlexical = [eelbrain.event_impulse_predictor(gt.time, value='nlexical', data=data, name='non_lexical') for gt, data in zip(gammatone, word_tables)]
 
-# Extract the duration of the stimuli, so we can later match the EEG to the stimuli
-durations = [gt.time.tmax for stimulus, gt in zip(STIMULI, gammatone)]
+# Extract the duration of the stimuli (including padding) from the stimulus index, so we can later match the EEG to the stimuli
+stimulus_index = load_stimulus_index(DATA_ROOT)
+durations = [predictor_time(stimulus_index[stimulus]).tmax for stimulus in STIMULI]
 
 # Models
 # ------
@@ -82,41 +93,49 @@ models = {
 
 # Estimate TRFs
 # -------------
-# Loop through subjects to estimate TRFs
-for subject in SUBJECTS:
-    subject_trf_dir = TRF_DIR / subject
-    subject_trf_dir.mkdir(exist_ok=True)
-    # Generate all TRF paths so we can check whether any new TRFs need to be estimated
-    trf_paths = {model: subject_trf_dir / f'{subject} {model}.pickle' for model in models}
-    # Skip this subject if all files already exist
-    if all(path.exists() for path in trf_paths.values()):
-        continue
+# Concatenated predictors for each pattern of trials
+predictor_cache = PredictorCache()
+# Generate all TRF paths so we can check whether any new TRFs need to be estimated
+trf_paths = {subject: {model: TRF_DIR / subject / f'{subject} {model}{SUFFIX}.pickle' for model in models} for subject in SUBJECTS}
+# Skip subjects for which all files already exist
+subjects = [subject for subject in SUBJECTS if not all(path.exists() for path in trf_paths[subject].values())]
+
+
+def load_eeg(subject):
     # Load the EEG data
-    raw = mne.io.read_raw(EEG_DIR / subject / f'{subject}_alice-raw.fif', preload=True)
-    # Band-pass filter the raw data between 0.5 and 20 Hz
-    raw.filter(0.5, 20, n_jobs=1)
-    # Interpolate bad channels
-    raw.interpolate_bads()
+    raw = mne.io.read_raw(EEG_DIR / subject / f'{subject}_alice-raw.fif')
     # Extract the events marking the stimulus presentation from the EEG file
     events = eelbrain.load.fiff.events(raw)
     # Not all subjects have all trials; determine which stimuli are present
     trial_indexes = [STIMULI.index(stimulus) for stimulus in events['event']]
-    # Extract the EEG data segments corresponding to the stimuli
+    # Extract the EEG data segments corresponding to the stimuli, band-pass filtered between 0.5 and 20 Hz and decimated to 100 Hz (bad channels are interpolated)
     trial_durations = [durations[i] for i in trial_indexes]
-    eeg = eelbrain.load.fiff.variable_length_epochs(events, -0.100, trial_durations, decim=5, connectivity='auto')
-    # Since trials are of unequal length, we will concatenate them for the TRF estimation.
-    eeg_concatenated = eelbrain.concatenate(eeg)
+    eeg = filtered_epochs(events, -0.100, trial_durations, 0.5, 20)
+    return trial_indexes, eeg
+
+
+# Loop through subjects to estimate TRFs; the EEG data of the next subject are loaded in the background while TRFs are estimated for the current subject
+prefetcher = Prefetcher(load_eeg, subjects)
+for subject, (trial_indexes, eeg) in prefetcher:
+    (TRF_DIR / subject).mkdir(exist_ok=True)
+    # Since trials are of unequal length, we will concatenate them for the TRF estimation (the trials are already stored in one contiguous buffer).
+    eeg_concatenated = eeg.concatenated()
     for model, predictors in models.items():
-        path = trf_paths[model]
+        path = trf_paths[subject][model]
         # Skip if this file already exists
         if path.exists():
             continue
         print(f"Estimating: {subject} ~ {model}")
-        # Select and concetenate the predictors corresponding to the EEG trials
-        predictors_concatenated = []
-        for predictor in predictors:
-            predictors_concatenated.append(eelbrain.concatenate([predictor[i] for i in trial_indexes]))
+        # Select and concatenate the predictors corresponding to the EEG trials (concatenated predictors are shared between models, and between subjects with the same trials)
+        predictors_concatenated = [predictor_cache.concatenate(predictor, trial_indexes) for predictor in predictors]
         # Fit the mTRF
-        trf = eelbrain.boosting(eeg_concatenated, predictors_concatenated, -0.100, 1.000, error='l1', basis=0.050, partitions=5, test=1, selective_stopping=True)
+        if SPATIAL_COMPONENTS:
+            # DSS components depend on the predictors, so they are computed for each model
+            spatial_filter = component_filter(eeg_concatenated, *SPATIAL_COMPONENTS, predictors_concatenated, -0.100, 1.000)
+            trf = component_boosting(eeg_concatenated, predictors_concatenated, -0.100, 1.000, spatial_filter, error='l1', basis=0.050, partitions=5, test=1, selective_stopping=True)
+        else:
+            trf = eelbrain.boosting(eeg_concatenated, predictors_concatenated, -0.100, 1.000, error='l1', basis=0.050, partitions=5, test=1, selective_stopping=True)
         # Save the TRF for later analysis
         eelbrain.save.pickle(trf, path)
+# Report how much of the time spent loading EEG data was hidden behind TRF estimation
+print(prefetcher.report())
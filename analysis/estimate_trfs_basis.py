@@ -5,6 +5,12 @@ import re
 import eelbrain
 import mne
 
+from eeg_loading import filtered_epochs
+from fir_cache import filter_data
+from spatial_components import component_boosting, component_filter, component_suffix
+from stimuli import load_stimulus_index, predictor_time
+from trials import PredictorCache
+
 
 STIMULI = [str(i) for i in range(1, 13)]
 DATA_ROOT = Path("~").expanduser() / 'Data' / 'Alice'
@@ -14,6 +20,9 @@ SUBJECTS = [path.name for path in EEG_DIR.iterdir() if re.match(r'S\d*', path.na
 # Define a target directory for TRF estimates and make sure the directory is created
 TRF_DIR = DATA_ROOT / 'TRFs'
 TRF_DIR.mkdir(exist_ok=True)
+# Optionally, fit TRFs to the top spatial components of the EEG instead of to each sensor, and project them back to sensor space; set to ('pca', 10) or ('dss', 10) for k=10 principal or DSS components (see spatial_components.py)
+SPATIAL_COMPONENTS = None
+SUFFIX = component_suffix(SPATIAL_COMPONENTS)
 
 # Load stimuli
 # ------------
@@ -25,10 +34,11 @@ gammatone = [x.bin(0.01, dim='time', label='start') for x in gammatone]
 # Pad onset with 100 ms and offset with 1 second; make sure to give the predictor a unique name as that will make it easier to identify the TRF later
 gammatone = [eelbrain.pad(x, tstart=-0.100, tstop=x.time.tstop + 1, name='gammatone') for x in gammatone]
 # Filter the predictor with the same parameters as we will filter the EEG data
-gammatone = [eelbrain.filter_data(x, 0.5, 20) for x in gammatone]
+gammatone = [filter_data(x, 0.5, 20) for x in gammatone]
 
-# Extract the duration of the stimuli, so we can later match the EEG to the stimuli
-durations = [gt.time.tmax for stimulus, gt in zip(STIMULI, gammatone)]
+# Extract the duration of the stimuli (including padding) from the stimulus index, so we can later match the EEG to the stimuli
+stimulus_index = load_stimulus_index(DATA_ROOT)
+durations = [predictor_time(stimulus_index[stimulus]).tmax for stimulus in STIMULI]
 
 # Models
 # ------
@@ -38,34 +48,33 @@ basis_values = [0, 0.050, 0.100]
 
 # Estimate TRFs
 # -------------
+# Concatenated predictors for each pattern of trials
+predictor_cache = PredictorCache()
 # Loop through subjects to estimate TRFs
 for subject in SUBJECTS:
     subject_trf_dir = TRF_DIR / subject
     subject_trf_dir.mkdir(exist_ok=True)
     # Generate all TRF paths so we can check whether any new TRFs need to be estimated
-    trf_paths = {basis: subject_trf_dir / f'{subject} {model} basis-{basis*1000:.0f}.pickle' for basis in basis_values}
+    trf_paths = {basis: subject_trf_dir / f'{subject} {model} basis-{basis*1000:.0f}{SUFFIX}.pickle' for basis in basis_values}
     # Skip this subject if all files already exist
     if all(path.exists() for path in trf_paths.values()):
         continue
     # Load the EEG data
-    raw = mne.io.read_raw(EEG_DIR / subject / f'{subject}_alice-raw.fif', preload=True)
-    # Band-pass filter the raw data between 0.5 and 20 Hz
-    raw.filter(0.5, 20, n_jobs=1)
-    # Interpolate bad channels
-    raw.interpolate_bads()
+    raw = mne.io.read_raw(EEG_DIR / subject / f'{subject}_alice-raw.fif')
     # Extract the events marking the stimulus presentation from the EEG file
     events = eelbrain.load.fiff.events(raw)
     # Not all subjects have all trials; determine which stimuli are present
     trial_indexes = [STIMULI.index(stimulus) for stimulus in events['event']]
-    # Extract the EEG data segments corresponding to the stimuli
+    # Extract the EEG data segments corresponding to the stimuli, band-pass filtered between 0.5 and 20 Hz and decimated to 100 Hz (bad channels are interpolated)
     trial_durations = [durations[i] for i in trial_indexes]
-    eeg = eelbrain.load.fiff.variable_length_epochs(events, -0.100, trial_durations, decim=5, connectivity='auto')
-    # Since trials are of unequal length, we will concatenate them for the TRF estimation.
-    eeg_concatenated = eelbrain.concatenate(eeg)
-    # Select and concetenate the predictors corresponding to the EEG trials
-    predictors_concatenated = []
-    for predictor in predictors:
-        predictors_concatenated.append(eelbrain.concatenate([predictor[i] for i in trial_indexes]))
+    eeg = filtered_epochs(events, -0.100, trial_durations, 0.5, 20)
+    # Since trials are of unequal length, we will concatenate them for the TRF estimation (the trials are already stored in one contiguous buffer).
+    eeg_concatenated = eeg.concatenated()
+    # Select and concatenate the predictors corresponding to the EEG trials (concatenated predictors are shared between models, and between subjects with the same trials)
+    predictors_concatenated = [predictor_cache.concatenate(predictor, trial_indexes) for predictor in predictors]
+    # Spatial filter for the component TRFs (shared by all basis values)
+    if SPATIAL_COMPONENTS:
+        spatial_filter = component_filter(eeg_concatenated, *SPATIAL_COMPONENTS, predictors_concatenated, -0.100, 1.000)
 
     for basis, path in trf_paths.items():
         # Skip if this file already exists
@@ -73,5 +82,8 @@ for subject in SUBJECTS:
             continue
         print(f"Estimating: {subject} ~ {basis}")
         # Fit the mTRF
-        trf = eelbrain.boosting(eeg_concatenated, predictors_concatenated, -0.100, 1.000, error='l1', basis=basis, partitions=5, test=1, selective_stopping=True)
+        if SPATIAL_COMPONENTS:
+            trf = component_boosting(eeg_concatenated, predictors_concatenated, -0.100, 1.000, spatial_filter, error='l1', basis=basis, partitions=5, test=1, selective_stopping=True)
+        else:
+            trf = eelbrain.boosting(eeg_concatenated, predictors_concatenated, -0.100, 1.000, error='l1', basis=basis, partitions=5, test=1, selective_stopping=True)
         eelbrain.save.pickle(trf, path)
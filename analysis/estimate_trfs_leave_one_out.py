@@ -0,0 +1,86 @@
+"""This script evaluates TRFs on held-out stimuli: for each subject and each stimulus, a TRF is estimated from the remaining stimuli and used to predict the response to the held-out stimulus"""
+from pathlib import Path
+import re
+
+import eelbrain
+import mne
+
+from convolution import PredictorFFT, batch_convolve
+from eeg_loading import filtered_epochs
+from evaluation import FitStatistics
+from fir_cache import filter_data
+from stimuli import load_stimulus_index, predictor_time
+
+
+STIMULI = [str(i) for i in range(1, 13)]
+DATA_ROOT = Path("~").expanduser() / 'Data' / 'Alice'
+PREDICTOR_DIR = DATA_ROOT / 'predictors'
+EEG_DIR = DATA_ROOT / 'eeg'
+SUBJECTS = [path.name for path in EEG_DIR.iterdir() if re.match(r'S\d*', path.name)]
+# Define a target directory for the evaluation results and make sure the directory is created
+EVALUATION_DIR = DATA_ROOT / 'TRFs-leave-one-out'
+EVALUATION_DIR.mkdir(exist_ok=True)
+TSTART, TSTOP = -0.100, 1.000
+
+# Load stimuli
+# ------------
+envelope = [eelbrain.load.unpickle(PREDICTOR_DIR / f'{stimulus}~gammatone-1.pickle') for stimulus in STIMULI]
+envelope = [x.bin(0.01, dim='time', label='start') for x in envelope]
+envelope = [eelbrain.pad(x, tstart=-0.100, tstop=x.time.tstop + 1, name='envelope') for x in envelope]
+envelope = [filter_data(x, 0.5, 20) for x in envelope]
+onset_envelope = [eelbrain.load.unpickle(PREDICTOR_DIR / f'{stimulus}~gammatone-on-1.pickle') for stimulus in STIMULI]
+onset_envelope = [x.bin(0.01, dim='time', label='start') for x in onset_envelope]
+onset_envelope = [eelbrain.pad(x, tstart=-0.100, tstop=x.time.tstop + 1, name='onset') for x in onset_envelope]
+onset_envelope = [filter_data(x, 0.5, 20) for x in onset_envelope]
+
+stimulus_index = load_stimulus_index(DATA_ROOT)
+durations = [predictor_time(stimulus_index[stimulus]).tmax for stimulus in STIMULI]
+
+# Models
+# ------
+models = {
+    'envelope': [envelope],
+    'envelope+onset': [envelope, onset_envelope],
+}
+# Predictor FFTs for predicting responses to single stimuli, shared by all subjects and models
+n_lags = int(round((TSTOP - TSTART) / 0.01))
+predictor_ffts = {}
+for model_predictors in models.values():
+    for predictor in model_predictors:
+        if predictor[0].name not in predictor_ffts:
+            predictor_ffts[predictor[0].name] = [PredictorFFT([x], n_lags) for x in predictor]
+
+# Estimate and evaluate TRFs
+# --------------------------
+for subject in SUBJECTS:
+    path = EVALUATION_DIR / f'{subject}.pickle'
+    if path.exists():
+        continue
+    raw = mne.io.read_raw(EEG_DIR / subject / f'{subject}_alice-raw.fif')
+    events = eelbrain.load.fiff.events(raw)
+    trial_indexes = [STIMULI.index(stimulus) for stimulus in events['event']]
+    trial_durations = [durations[i] for i in trial_indexes]
+    eeg = filtered_epochs(events, -0.100, trial_durations, 0.5, 20)
+    rows = []
+    for model, model_predictors in models.items():
+        statistics = FitStatistics([eeg[0].sensor], len(trial_indexes))
+        for test_trial, test_stimulus in enumerate(trial_indexes):
+            print(f"Estimating: {subject} ~ {model}, held-out stimulus {STIMULI[test_stimulus]}")
+            train_trials = [i for i in range(len(trial_indexes)) if i != test_trial]
+            eeg_train = eelbrain.concatenate([eeg[i] for i in train_trials])
+            x_train = [eelbrain.concatenate([predictor[trial_indexes[i]] for i in train_trials]) for predictor in model_predictors]
+            trf = eelbrain.boosting(eeg_train, x_train, TSTART, TSTOP, error='l1', basis=0.050, partitions=5, selective_stopping=True)
+            # Predict the response to the held-out stimulus
+            hs = [trf.h_scaled] if len(model_predictors) == 1 else trf.h_scaled
+            prediction = 0
+            for h, predictor in zip(hs, model_predictors):
+                y, = batch_convolve(h, predictor_ffts[predictor[0].name][test_stimulus])
+                prediction = prediction + y
+            statistics.add(test_trial, eeg[test_trial], prediction)
+        stimuli = [STIMULI[i] for i in trial_indexes]
+        for stimulus, l1, l2, r in zip(stimuli, statistics.proportion_explained('l1', 'each'), statistics.proportion_explained('l2', 'each'), statistics.correlation('each')):
+            rows.append([subject, model, stimulus, l1, l2, r])
+        # Pooled across all held-out stimuli
+        rows.append([subject, model, 'all', statistics.proportion_explained('l1'), statistics.proportion_explained('l2'), statistics.correlation()])
+    data = eelbrain.Dataset.from_caselist(['subject', 'model', 'stimulus', 'l1', 'l2', 'r'], rows)
+    eelbrain.save.pickle(data, path)
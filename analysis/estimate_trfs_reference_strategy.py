@@ -4,7 +4,11 @@ import re
 
 import eelbrain
 import mne
-import numpy
+
+from eeg_loading import filtered_epochs
+from referencing import reference_variants
+from stimuli import load_stimulus_index, predictor_time
+from trials import PredictorCache
 
 
 STIMULI = [str(i) for i in range(1, 13)]
@@ -23,8 +27,17 @@ envelope = [eelbrain.load.unpickle(PREDICTOR_DIR / f'{stimulus}~gammatone-1.pick
 envelope = [x.bin(0.01, dim='time', label='start') for x in envelope]
 envelope = [eelbrain.pad(x, tstart=-0.100, tstop=x.time.tstop + 1, name='envelope') for x in envelope]
 
-# Extract the duration of the stimuli, so we can later match the EEG to the stimuli
-durations = [stimulus.time.tmax for stimulus in envelope]
+# Extract the duration of the stimuli (including padding) from the stimulus index, so we can later match the EEG to the stimuli
+stimulus_index = load_stimulus_index(DATA_ROOT)
+durations = [predictor_time(stimulus_index[stimulus]).tmax for stimulus in STIMULI]
+
+# References
+# ----------
+# New reference schemes can be added here: 'average', or a list of sensors whose average is used as reference
+REFERENCES = {
+    'cz': ['33'],
+    'average': 'average',
+}
 
 # Models
 # ------
@@ -36,56 +49,42 @@ models = {
 
 # Estimate TRFs
 # -------------
+# Concatenated predictors for each pattern of trials
+predictor_cache = PredictorCache()
 # Loop through subjects to estimate TRFs
 for subject in SUBJECTS:
     subject_trf_dir = TRF_DIR / subject
     subject_trf_dir.mkdir(exist_ok=True)
+    # Generate all TRF paths so we can check whether any new TRFs need to be estimated
+    trf_paths = {(model, reference): subject_trf_dir / f'{subject} {model}_{reference}.pickle' for reference in REFERENCES for model in models}
+    # Skip this subject if all files already exist
+    if all(path.exists() for path in trf_paths.values()):
+        continue
+    # Load the EEG data
+    raw = mne.io.read_raw(EEG_DIR / subject / f'{subject}_alice-raw.fif')
+    # Extract the events marking the stimulus presentation from the EEG file
+    events = eelbrain.load.fiff.events(raw)
+    # Not all subjects have all trials; determine which stimuli are present
+    trial_indexes = [STIMULI.index(stimulus) for stimulus in events['event']]
+    # Extract the EEG data segments corresponding to the stimuli, band-pass filtered between 0.5 and 20 Hz and decimated to 100 Hz (bad channels are interpolated)
+    trial_durations = [durations[i] for i in trial_indexes]
+    eeg = filtered_epochs(events, -0.100, trial_durations, 0.5, 20)
+    # Since trials are of unequal length, we will concatenate them for the TRF estimation (the trials are already stored in one contiguous buffer).
+    eeg_concatenated = eeg.concatenated()
+    # Do referencing: since re-referencing is linear, all reference variants can be derived from the same preprocessed data
+    # With the Cz reference, the Cz-channel contains zeros (which cannot be used for TRF estimation); this channel is excluded from the TRF estimation
+    eeg_references = reference_variants(eeg_concatenated, REFERENCES, exclude_reference=True)
 
-    for reference in ['cz', 'average']:
-        # Generate all TRF paths so we can check whether any new TRFs need to be estimated
-        trf_paths = {model: subject_trf_dir / f'{subject} {model}_{reference}.pickle' for model in models}
-        # Skip this subject if all files already exist
-        if all(path.exists() for path in trf_paths.values()):
-            continue
-        # Load the EEG data
-        raw = mne.io.read_raw(EEG_DIR / subject / f'{subject}_alice-raw.fif', preload=True)
-        # Band-pass filter the raw data between 0.5 and 20 Hz
-        raw.filter(0.5, 20)
-        # Interpolate bad channels
-        raw.interpolate_bads()
-        # Do referencing
-        if reference == 'cz': 
-            raw.set_eeg_reference(['33'])
-        else: 
-            raw.set_eeg_reference('average')
-        # Extract the events marking the stimulus presentation from the EEG file
-        events = eelbrain.load.fiff.events(raw)
-        # Not all subjects have all trials; determine which stimuli are present
-        trial_indexes = [STIMULI.index(stimulus) for stimulus in events['event']]
-        # Extract the EEG data segments corresponding to the stimuli
-        trial_durations = [durations[i] for i in trial_indexes]
-        eeg = eelbrain.load.fiff.variable_length_epochs(events, -0.100, trial_durations, decim=5, connectivity='auto')
-        # Since trials are of unequal length, we will concatenate them for the TRF estimation.
-        eeg_concatenated = eelbrain.concatenate(eeg)
-
-        if reference == 'cz': 
-            # As the Cz-channel was used for reference, the channel contains zeros (which cannot be used for TRF estimation)
-            # Therefore, this channel is replaced with random noise to preserve the 64-sensor dimension.
-            n_times = len(eeg_concatenated.time)
-            rng = numpy.random.default_rng()
-            eeg_concatenated['33'] = rng.standard_normal(n_times) * eeg_concatenated.std()
-
-        for model, predictors in models.items():
-            path = trf_paths[model]
+    for model, predictors in models.items():
+        # Select and concatenate the predictors corresponding to the EEG trials (once for all references; concatenated predictors are shared between models, and between subjects with the same trials)
+        predictors_concatenated = [predictor_cache.concatenate(predictor, trial_indexes) for predictor in predictors]
+        for reference, eeg_referenced in eeg_references.items():
+            path = trf_paths[model, reference]
             # Skip if this file already exists
             if path.exists():
                 continue
             print(f"Estimating: {subject} ~ {model} ({reference})")
-            # Select and concetenate the predictors corresponding to the EEG trials
-            predictors_concatenated = []
-            for predictor in predictors:
-                predictors_concatenated.append(eelbrain.concatenate([predictor[i] for i in trial_indexes]))
             # Fit the mTRF
-            trf = eelbrain.boosting(eeg_concatenated, predictors_concatenated, -0.100, 1.000, error='l1', basis=0.050, partitions=5, test=1, selective_stopping=True)
+            trf = eelbrain.boosting(eeg_referenced, predictors_concatenated, -0.100, 1.000, error='l1', basis=0.050, partitions=5, test=1, selective_stopping=True)
             # Save the TRF for later analysis
             eelbrain.save.pickle(trf, path)
@@ -5,6 +5,9 @@ from pathlib import Path
 
 import eelbrain
 
+from batch_boosting import boosting
+import impulses
+
 
 # Data locations
 DATA_ROOT = Path("~").expanduser() / 'Data' / 'Alice'
@@ -21,10 +24,10 @@ for trial in range(1, 13):
     gammatone = eelbrain.load.unpickle(PREDICTOR_DIR / f'{trial}~gammatone-8.pickle')
     gammatone = gammatone.bin(0.01)
     events = eelbrain.load.unpickle(PREDICTOR_DIR / f'{trial}~word.pickle')
-    # turn categorial predictors into time-series matching the spectrogram
-    word = eelbrain.event_impulse_predictor(gammatone, time='time', value=1, data=events, name='word')
-    lexical = eelbrain.event_impulse_predictor(gammatone, time='time', value='lexical', data=events, name='lexical')
-    non_lexical = eelbrain.event_impulse_predictor(gammatone, time='time', value='nlexical', data=events, name='non_lexical')
+    # turn categorial predictors into sparse impulse time-series matching the spectrogram
+    word = impulses.impulse_predictor(gammatone, time='time', value=1, data=events, name='word')
+    lexical = impulses.impulse_predictor(gammatone, time='time', value='lexical', data=events, name='lexical')
+    non_lexical = impulses.impulse_predictor(gammatone, time='time', value='nlexical', data=events, name='non_lexical')
     # store ndvars in lists
     gammatone_trials.append(gammatone)
     word_trials.append(word)
@@ -32,12 +35,14 @@ for trial in range(1, 13):
     non_lexical_trials.append(non_lexical)
 # concatenate trials
 gammatone = eelbrain.concatenate(gammatone_trials)
-word = eelbrain.concatenate(word_trials)
-lexical = eelbrain.concatenate(lexical_trials)
-non_lexical = eelbrain.concatenate(non_lexical_trials)
+word = impulses.concatenate(word_trials)
+lexical = impulses.concatenate(lexical_trials)
+non_lexical = impulses.concatenate(non_lexical_trials)
 
-trf_word = eelbrain.boosting(gammatone, word, -0.100, 1.001, partitions=15, partition_results=True, test=True)
+# Batch boosting fits all frequency bands at once (same TRFs as eelbrain.boosting),
+# with the covariance statistics of the word predictors gathered at the word onsets
+trf_word = boosting(gammatone, word, -0.100, 1.001, partitions=15, partition_results=True, test=True)
 eelbrain.save.pickle(trf_word, TRF_DIR / 'gammatone~word.pickle')
 
-trf_lexical = eelbrain.boosting(gammatone, [word, lexical, non_lexical], -0.100, 1.001, partitions=15, partition_results=True, test=True)
+trf_lexical = boosting(gammatone, [word, lexical, non_lexical], -0.100, 1.001, partitions=15, partition_results=True, test=True)
 eelbrain.save.pickle(trf_lexical, TRF_DIR / 'gammatone~word+lexical.pickle')
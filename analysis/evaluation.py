@@ -0,0 +1,204 @@
+"""Evaluate predictions for held-out data
+
+The fit statistics for each segment (e.g., one held-out stimulus) are
+accumulated as sums and dot products, which need no temporary arrays, and
+absolute values, which are computed block by block in a preallocated buffer;
+no arrays of the size of the data are allocated. From the accumulated sums,
+the proportion of the response explained (l1 and l2) and the correlation
+between the response and the prediction are derived for each channel, for
+single segments or pooled across segments.
+
+Run this module as a script for a benchmark with simulated data.
+"""
+import time as _time
+import tracemalloc
+
+import eelbrain
+import numpy
+
+
+# Number of time samples processed at once
+BLOCK_SIZE = 4096
+# Statistics accumulated for each segment and channel
+STATISTICS = ('n', 'y', 'y_pred', 'yy', 'pp', 'yp', 'l1_total', 'l1_residual')
+_N, _Y, _P, _YY, _PP, _YP, _L1_TOTAL, _L1_RESIDUAL = range(len(STATISTICS))
+
+
+def _channel_data(x, dims):
+    "(n_channels, n_times) array"
+    return x.get_data((*dims, 'time')).reshape((-1, len(x.time)))
+
+
+class FitStatistics:
+    """Sums of fit statistics per segment and channel
+
+    Parameters
+    ----------
+    dims : sequence of Dimension
+        Channel dimensions (e.g., ``(sensor,)``).
+    n_segments : int
+        Number of segments.
+    block_size : int
+        Number of time samples processed at once.
+    """
+    def __init__(self, dims, n_segments, block_size=BLOCK_SIZE):
+        self.dims = tuple(dims)
+        self.n_channels = int(numpy.prod([len(dim) for dim in self.dims]))
+        self.x = numpy.zeros((n_segments, len(STATISTICS), self.n_channels))
+        self.block_size = block_size
+        self._buffer = numpy.empty((self.n_channels, block_size))
+
+    def add(self, segment, y, y_pred):
+        """Add the statistics for a response and its prediction
+
+        Parameters
+        ----------
+        segment : int
+            Index of the segment (statistics are added to previous data for
+            the same segment).
+        y : NDVar
+            Actual response (channel dimensions and time).
+        y_pred : NDVar
+            Predicted response (same dimensions as ``y``).
+        """
+        names = [dim.name for dim in self.dims]
+        y = _channel_data(y, names)
+        y_pred = _channel_data(y_pred, names)
+        if y.shape != y_pred.shape:
+            raise ValueError(f"y with shape {y.shape}, y_pred with shape {y_pred.shape}")
+        stats = self.x[segment]
+        stats[_N] += y.shape[1]
+        # Sums and dot products do not need temporary arrays
+        stats[_Y] += y.sum(1)
+        stats[_P] += y_pred.sum(1)
+        stats[_YY] += numpy.einsum('ij,ij->i', y, y)
+        stats[_PP] += numpy.einsum('ij,ij->i', y_pred, y_pred)
+        stats[_YP] += numpy.einsum('ij,ij->i', y, y_pred)
+        # Absolute values are computed block by block in the preallocated buffer
+        for start in range(0, y.shape[1], self.block_size):
+            y_i = y[:, start: start + self.block_size]
+            buffer = self._buffer[:, :y_i.shape[1]]
+            numpy.abs(y_i, out=buffer)
+            stats[_L1_TOTAL] += buffer.sum(1)
+            numpy.subtract(y_i, y_pred[:, start: start + self.block_size], out=buffer)
+            numpy.abs(buffer, out=buffer)
+            stats[_L1_RESIDUAL] += buffer.sum(1)
+
+    def _sums(self, segments):
+        if segments is None:
+            return self.x.sum(0)
+        elif isinstance(segments, int):
+            return self.x[segments]
+        return self.x[segments].sum(0)
+
+    def _ndvar(self, x, name):
+        if x.ndim == 2:
+            dims = ('case', *self.dims)
+        else:
+            dims = self.dims
+        return eelbrain.NDVar(x.reshape((*x.shape[:-1], *[len(dim) for dim in self.dims])), dims, name)
+
+    def _apply(self, function, segments, name):
+        if segments == 'each':
+            return self._ndvar(numpy.stack([function(stats) for stats in self.x]), name)
+        return self._ndvar(function(self._sums(segments)), name)
+
+    def proportion_explained(self, error='l1', segments=None):
+        """Proportion of the response explained by the prediction
+
+        Parameters
+        ----------
+        error : 'l1' | 'l2'
+            Error measure (``1 - sum(|y - y_pred|) / sum(|y|)``, or the same
+            with squares).
+        segments : None | int | sequence of int | 'each'
+            Pool all segments (default), use one segment or pool a subset,
+            or compute separately for each segment (with ``case`` dimension).
+        """
+        if error == 'l1':
+            def function(stats):
+                return 1 - stats[_L1_RESIDUAL] / stats[_L1_TOTAL]
+        elif error == 'l2':
+            def function(stats):
+                return 1 - (stats[_YY] - 2 * stats[_YP] + stats[_PP]) / stats[_YY]
+        else:
+            raise ValueError(f"{error=}")
+        return self._apply(function, segments, 'proportion_explained')
+
+    def correlation(self, segments=None):
+        """Pearson correlation between response and prediction (see :meth:`proportion_explained`)"""
+        def function(stats):
+            n = stats[_N]
+            cov = stats[_YP] - stats[_Y] * stats[_P] / n
+            var_y = stats[_YY] - stats[_Y] ** 2 / n
+            var_p = stats[_PP] - stats[_P] ** 2 / n
+            return cov / numpy.sqrt(var_y * var_p)
+        return self._apply(function, segments, 'r')
+
+
+def evaluate(y, y_pred, block_size=BLOCK_SIZE):
+    """Fit statistics for held-out segments
+
+    Parameters
+    ----------
+    y : NDVar | sequence of NDVar
+        Response in each segment (channel dimensions and time).
+    y_pred : NDVar | sequence of NDVar
+        Predicted response in each segment.
+    block_size : int
+        Number of time samples processed at once.
+
+    Returns
+    -------
+    statistics : FitStatistics
+        Statistics, with one segment for each item in ``y``.
+    """
+    if isinstance(y, eelbrain.NDVar):
+        y, y_pred = [y], [y_pred]
+    dims = [dim for dim in y[0].dims if dim.name != 'time']
+    statistics = FitStatistics(dims, len(y), block_size)
+    for i, (y_i, y_pred_i) in enumerate(zip(y, y_pred)):
+        statistics.add(i, y_i, y_pred_i)
+    return statistics
+
+
+def _chained_evaluation(y, y_pred):
+    # The approach used previously in figures/TRF.py, extended to l2 and correlation
+    ss_total = y.abs().sum('time')
+    ss_residual = (y - y_pred).abs().sum('time')
+    l1 = 1 - (ss_residual / ss_total)
+    l2 = 1 - ((y - y_pred) ** 2).sum('time') / (y ** 2).sum('time')
+    y_centered = y - y.mean('time')
+    y_pred_centered = y_pred - y_pred.mean('time')
+    r = (y_centered * y_pred_centered).sum('time') / ((y_centered ** 2).sum('time') * (y_pred_centered ** 2).sum('time')) ** 0.5
+    return l1, l2, r
+
+
+def benchmark(n_segments=12, n_sensors=64, n_times=6000, seed=0):
+    """Compare :func:`evaluate` with chained NDVar operations"""
+    rng = numpy.random.default_rng(seed)
+    sensor = eelbrain.Sensor(rng.normal(size=(n_sensors, 3)))
+    time = eelbrain.UTS(0, 0.01, n_times)
+    ys = [eelbrain.NDVar(rng.normal(size=(n_sensors, n_times)), (sensor, time)) for _ in range(n_segments)]
+    y_preds = [y * 0.5 + eelbrain.NDVar(rng.normal(size=(n_sensors, n_times)), (sensor, time)) for y in ys]
+    tracemalloc.start()
+    t0 = _time.perf_counter()
+    reference = [_chained_evaluation(y, y_pred) for y, y_pred in zip(ys, y_preds)]
+    t1 = _time.perf_counter()
+    peak_chained = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.reset_peak()
+    t2 = _time.perf_counter()
+    statistics = evaluate(ys, y_preds)
+    results = [statistics.proportion_explained('l1', 'each'), statistics.proportion_explained('l2', 'each'), statistics.correlation('each')]
+    t3 = _time.perf_counter()
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    for i, result in enumerate(results):
+        assert numpy.allclose(result.x, [x[i].x for x in reference])
+    print(f"{n_segments} segments x {n_sensors} sensors x {n_times} samples (l1, l2 and correlation):")
+    print(f"  chained NDVar operations: {t1 - t0:.3f} s, peak memory {peak_chained:.1f} MB")
+    print(f"  evaluate: {t3 - t2:.3f} s, peak memory {peak:.1f} MB")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,230 @@
+"""FIR filter kernels and their FFTs, cached across subjects and predictors
+
+The analysis scripts apply the same band-pass filter to the EEG of every
+subject and to every predictor of every stimulus. :func:`mne.filter.filter_data`
+designs the FIR kernel and computes its FFT anew for each call. Here, kernels
+are cached by their design parameters, and their FFTs by FFT length:
+
+ - :func:`fir_kernel`: the zero-phase FIR kernel of :func:`mne.filter.filter_data`.
+ - :func:`filter_data`: drop-in replacement for :func:`eelbrain.filter_data`
+   (FIR filter with mne's default parameters), filtering all rows of the data
+   at once.
+ - :func:`convolve_valid`: convolution with a cached kernel, for filters that
+   need no edge padding.
+ - :func:`cache_info`: hits and misses, to show the reuse.
+
+Run this module as a script for a benchmark with simulated data.
+"""
+import time as _time
+
+import eelbrain
+import mne
+import numpy
+from scipy.fft import irfft, next_fast_len, rfft
+
+
+# Kernels by (l_freq, h_freq, sfreq, filter_length, l_trans_bandwidth, h_trans_bandwidth, fir_window, fir_design)
+_kernels = {}
+# Kernel FFTs by (kernel key, n_fft)
+_transforms = {}
+_counts = {'kernel': [0, 0], 'fft': [0, 0]}  # [hits, misses]
+
+
+def fir_kernel(sfreq, l_freq, h_freq, filter_length='auto', l_trans_bandwidth='auto', h_trans_bandwidth='auto', fir_window='hamming', fir_design='firwin'):
+    """Zero-phase FIR kernel (as designed by :func:`mne.filter.create_filter`)
+
+    Parameters
+    ----------
+    sfreq : scalar
+        Sampling frequency.
+    l_freq : scalar | None
+        High-pass frequency.
+    h_freq : scalar | None
+        Low-pass frequency.
+    ...
+        FIR design parameters for :func:`mne.filter.create_filter`.
+
+    Returns
+    -------
+    kernel : array
+        The kernel (do not modify, it is shared by all callers).
+    """
+    key = (l_freq, h_freq, sfreq, filter_length, l_trans_bandwidth, h_trans_bandwidth, fir_window, fir_design)
+    return _kernel(key)[1]
+
+
+def _kernel(key):
+    # Returns (key, kernel), with the key normalized so that kernels with the same design share FFTs
+    l_freq, h_freq, sfreq, filter_length, l_trans_bandwidth, h_trans_bandwidth, fir_window, fir_design = key
+    if l_freq is not None and l_freq <= 0:
+        l_freq = None
+    if h_freq is not None and h_freq >= sfreq / 2:
+        h_freq = None
+    key = (l_freq, h_freq, float(sfreq), filter_length, l_trans_bandwidth, h_trans_bandwidth, fir_window, fir_design)
+    if key in _kernels:
+        _counts['kernel'][0] += 1
+    else:
+        _counts['kernel'][1] += 1
+        if l_freq is None and h_freq is None:
+            kernel = numpy.ones(1)
+        else:
+            kernel = mne.filter.create_filter(None, sfreq, l_freq, h_freq, filter_length, l_trans_bandwidth, h_trans_bandwidth, fir_window=fir_window, fir_design=fir_design, verbose=False)
+        kernel.flags.writeable = False
+        _kernels[key] = kernel
+    return key, _kernels[key]
+
+
+def _kernel_fft(key, kernel, n_fft):
+    fft_key = (key, n_fft)
+    if fft_key in _transforms:
+        _counts['fft'][0] += 1
+    else:
+        _counts['fft'][1] += 1
+        transform = rfft(kernel, n_fft)
+        transform.flags.writeable = False
+        _transforms[fft_key] = transform
+    return _transforms[fft_key]
+
+
+def _n_fft(n_x, n_h):
+    # FFT length that minimizes the cost of overlap-add filtering (as in mne.filter)
+    min_fft = 2 * n_h - 1
+    if n_x < min_fft:
+        return next_fast_len(min_fft)
+    n = 2 ** numpy.arange(numpy.ceil(numpy.log2(min_fft)), numpy.ceil(numpy.log2(n_x)) + 1, dtype=int)
+    cost = numpy.ceil(n_x / (n - n_h + 1)) * n * (numpy.log2(n) + 1) + 4e-5 * n * n_x
+    return int(n[numpy.argmin(cost)])
+
+
+def _overlap_add(x, key, kernel):
+    # Full convolution of the rows of x with the kernel
+    n_h = len(kernel)
+    n_fft = _n_fft(x.shape[-1], n_h)
+    transform = _kernel_fft(key, kernel, n_fft)
+    n_segment = n_fft - n_h + 1
+    n_segments = -(-x.shape[-1] // n_segment)
+    rows = x.reshape((-1, x.shape[-1]))
+    out = numpy.zeros((len(rows), (n_segments + 1) * n_segment + n_h - 1))
+    # Process several rows at once only while they fit in the CPU cache
+    n_rows = max(1, 2 ** 16 // (n_segments * n_fft))
+    for start in range(0, len(rows), n_rows):
+        stop = min(start + n_rows, len(rows))
+        segments = numpy.zeros((stop - start, n_segments * n_segment))
+        segments[:, :x.shape[-1]] = rows[start: stop]
+        segments = irfft(rfft(segments.reshape((stop - start, n_segments, n_segment)), n_fft) * transform, n_fft)
+        for i in range(n_segments):
+            out[start: stop, i * n_segment: i * n_segment + n_fft] += segments[:, i]
+    return out[:, :x.shape[-1] + n_h - 1].reshape((*x.shape[:-1], -1))
+
+
+def convolve_valid(x, sfreq, l_freq, h_freq, **design):
+    """Filter the rows of ``x``, keeping only samples with complete context
+
+    Parameters
+    ----------
+    x : array (..., n_times)
+        Data, including ``len(kernel) // 2`` samples of context on each side.
+    sfreq : scalar
+        Sampling frequency.
+    l_freq : scalar | None
+        High-pass frequency.
+    h_freq : scalar | None
+        Low-pass frequency.
+    ...
+        FIR design parameters (see :func:`fir_kernel`).
+
+    Returns
+    -------
+    filtered : array (..., n_times - len(kernel) + 1)
+        Filtered data.
+    """
+    key, kernel = _kernel((l_freq, h_freq, sfreq, *_design(**design)))
+    if len(kernel) == 1:
+        return x * kernel[0]
+    return _overlap_add(x, key, kernel)[..., len(kernel) - 1: x.shape[-1]]
+
+
+def _design(filter_length='auto', l_trans_bandwidth='auto', h_trans_bandwidth='auto', fir_window='hamming', fir_design='firwin'):
+    return filter_length, l_trans_bandwidth, h_trans_bandwidth, fir_window, fir_design
+
+
+def filter_data(ndvar, l_freq, h_freq, name=None, **design):
+    """Zero-phase FIR filter, equivalent to :func:`eelbrain.filter_data`
+
+    Parameters
+    ----------
+    ndvar : NDVar
+        Data with a time dimension.
+    l_freq : scalar | None
+        High-pass frequency.
+    h_freq : scalar | None
+        Low-pass frequency.
+    name : str
+        Name of the output (default is the name of ``ndvar``).
+    ...
+        FIR design parameters (see :func:`fir_kernel`).
+
+    Returns
+    -------
+    filtered : NDVar
+        Filtered data.
+    """
+    axis = ndvar.get_axis('time')
+    x = numpy.moveaxis(ndvar.x, axis, -1).astype(float)
+    key, kernel = _kernel((l_freq, h_freq, 1. / ndvar.time.tstep, *_design(**design)))
+    if len(kernel) == 1:
+        x = x * kernel[0]
+    else:
+        # Reflect the edges of the signal (mne's "reflect_limited" padding)
+        n_times = x.shape[-1]
+        n_edge = min(len(kernel), n_times) - 1
+        x = numpy.concatenate([2 * x[..., :1] - x[..., n_edge:0:-1], x, 2 * x[..., -1:] - x[..., -2:-n_edge - 2:-1]], -1)
+        n_shift = n_edge + (len(kernel) - 1) // 2
+        x = _overlap_add(x, key, kernel)[..., n_shift: n_shift + n_times]
+    x = numpy.moveaxis(x, -1, axis)
+    return eelbrain.NDVar(x, ndvar.dims, name or ndvar.name, ndvar.info)
+
+
+def cache_info():
+    """Reuse of cached kernels and FFTs
+
+    Returns
+    -------
+    info : dict
+        ``{'kernel': (hits, misses), 'fft': (hits, misses)}``.
+    """
+    return {key: tuple(counts) for key, counts in _counts.items()}
+
+
+def cache_clear():
+    "Clear the cached kernels and FFTs, and reset the counters"
+    _kernels.clear()
+    _transforms.clear()
+    for counts in _counts.values():
+        counts[:] = [0, 0]
+
+
+def benchmark(n_stimuli=12, n_predictors=7, n_bands=8, duration=60, n_subjects=4, n_sensors=64):
+    """Compare with :func:`eelbrain.filter_data` for predictors and EEG"""
+    rng = numpy.random.default_rng(0)
+    time = eelbrain.UTS(-0.100, 0.010, duration * 100)
+    frequency = eelbrain.Scalar('frequency', numpy.arange(n_bands))
+    predictors = [eelbrain.NDVar(rng.normal(size=(n_bands, len(time))), (frequency, time), 'x') for _ in range(n_stimuli * n_predictors)]
+    sensor = eelbrain.Sensor(rng.normal(size=(n_sensors, 3)))
+    eeg = [eelbrain.NDVar(rng.normal(size=(n_sensors, len(time) * 5)), (sensor, eelbrain.UTS(0, 0.002, len(time) * 5)), 'eeg') for _ in range(n_subjects)]
+    cache_clear()
+    for desc, data, l_freq, h_freq in [('predictors', predictors, 0.5, 20), ('EEG', eeg, 0.5, 20)]:
+        t0 = _time.perf_counter()
+        reference = [eelbrain.filter_data(x, l_freq, h_freq) for x in data]
+        t1 = _time.perf_counter()
+        cached = [filter_data(x, l_freq, h_freq) for x in data]
+        t2 = _time.perf_counter()
+        for x_cached, x_reference in zip(cached, reference):
+            numpy.testing.assert_allclose(x_cached.x, x_reference.x, rtol=0, atol=1e-10 * numpy.abs(x_reference.x).max())
+        print(f"{len(data)} {desc}: eelbrain.filter_data {t1 - t0:.2f} s, cached {t2 - t1:.2f} s")
+    for key, (hits, misses) in cache_info().items():
+        print(f"  {key}: {hits} hits, {misses} misses")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,180 @@
+"""Sparse impulse predictors
+
+Predictors like word onsets (:func:`eelbrain.event_impulse_predictor`) are
+zero except at a few time points. :class:`ImpulsePredictor` stores only the
+sample indices and values of the impulses. The lagged covariance statistics
+(:class:`lagged_covariance.LaggedCovariance`) of impulse predictors are
+computed by gathering the response (or the other predictor) at the impulse
+times for each lag, instead of from FFTs of dense time series.
+
+Run this module as a script for a benchmark with simulated data.
+"""
+import time as _time
+import tracemalloc
+
+import eelbrain
+import numpy
+
+
+class ImpulsePredictor:
+    """Time series that is zero except for impulses at a few time points
+
+    Parameters
+    ----------
+    time : UTS
+        Time axis.
+    samples : array of int
+        Sample index of each impulse.
+    values : array of float
+        Magnitude of each impulse.
+    name : str
+        Name of the predictor.
+    """
+    def __init__(self, time, samples, values, name=None):
+        samples = numpy.asarray(samples, int)
+        values = numpy.asarray(values, float)
+        if samples.shape != values.shape:
+            raise ValueError(f"{samples.shape=}, {values.shape=}")
+        order = numpy.argsort(samples, kind='stable')
+        self.time = time
+        self.samples = samples[order]
+        self.values = values[order]
+        self.name = name
+
+    def __repr__(self):
+        return f"<ImpulsePredictor {self.name!r}: {len(self.samples)} impulses, {self.time}>"
+
+    @property
+    def dims(self):
+        return (self.time,)
+
+    def ndvar(self):
+        "Dense time series"
+        x = numpy.zeros(len(self.time))
+        x[self.samples] = self.values
+        return eelbrain.NDVar(x, (self.time,), self.name)
+
+    def roll(self, shift):
+        "Circularly shift the impulses by ``shift`` samples"
+        return ImpulsePredictor(self.time, (self.samples + shift) % len(self.time), self.values, self.name)
+
+
+def is_impulse_predictor(x):
+    """Whether ``x`` is a sparse impulse predictor
+
+    Impulse predictors are recognized by their ``samples`` and ``values``
+    attributes (rather than by class), so that predictors created by a module
+    that is imported under another name (e.g., when it is run as a script)
+    are recognized as well.
+    """
+    return hasattr(x, 'samples') and hasattr(x, 'values')
+
+
+def impulse_predictor(shape, time='time', value=1, latency=0, name=None, data=None):
+    """Sparse equivalent of :func:`eelbrain.event_impulse_predictor`
+
+    Parameters
+    ----------
+    shape : NDVar | UTS
+        Time axis of the output (or an NDVar with that time axis).
+    time : str | sequence of scalar
+        Time points at which impulses occur.
+    value : scalar | str | sequence of scalar
+        Magnitude of each impulse (default 1).
+    latency : scalar | str | sequence of scalar
+        Latency of each impulse relative to ``time`` (default 0).
+    name : str
+        Name of the predictor.
+    data : Dataset
+        If specified, ``time``, ``value`` and ``latency`` can be names of
+        variables in ``data``.
+
+    Returns
+    -------
+    predictor : ImpulsePredictor
+        Impulse predictor. As with :func:`eelbrain.event_impulse_predictor`,
+        impulses outside the time axis are dropped, and if several impulses
+        fall on the same sample, the last one is used.
+    """
+    uts = shape if isinstance(shape, eelbrain.UTS) else shape.get_dim('time')
+
+    def as_array(x):
+        if isinstance(x, str):
+            x = data.eval(x)
+        return numpy.asarray(getattr(x, 'x', x), float)
+
+    times = as_array(time)
+    values = numpy.broadcast_to(as_array(value), times.shape)
+    times = times + numpy.broadcast_to(as_array(latency), times.shape)
+    samples = numpy.round((times - uts.tmin) / uts.tstep).astype(int)
+    index = (samples >= 0) & (samples < len(uts))
+    samples, values = samples[index], values[index]
+    # Later impulses replace earlier ones on the same sample
+    _, last = numpy.unique(samples[::-1], return_index=True)
+    last = len(samples) - 1 - last
+    return ImpulsePredictor(uts, samples[last], values[last], name)
+
+
+def concatenate(predictors, tmin=0, name=None):
+    """Concatenate impulse predictors in time (as :func:`eelbrain.concatenate`)
+
+    Parameters
+    ----------
+    predictors : sequence of ImpulsePredictor
+        Impulse predictors with the same sampling rate.
+    tmin : scalar
+        Time of the first sample of the concatenated predictor.
+    name : str
+        Name of the concatenated predictor (default is the name of the first
+        predictor).
+    """
+    tstep = predictors[0].time.tstep
+    if any(x.time.tstep != tstep for x in predictors):
+        raise ValueError(f"predictors={predictors!r}: incompatible tstep")
+    offsets = numpy.cumsum([0, *[len(x.time) for x in predictors]])
+    samples = numpy.concatenate([x.samples + offset for x, offset in zip(predictors, offsets)])
+    values = numpy.concatenate([x.values for x in predictors])
+    if name is None:
+        name = predictors[0].name
+    return ImpulsePredictor(eelbrain.UTS(tmin, tstep, offsets[-1]), samples, values, name)
+
+
+def _simulate(n_segments=12, n_sensors=64, rate=2.5, seed=0):
+    rng = numpy.random.default_rng(seed)
+    sensor = eelbrain.Sensor(rng.normal(size=(n_sensors, 3)))
+    trf = rng.normal(size=(n_sensors, 110))
+    ys, impulses = [], []
+    for n in rng.integers(5500, 7000, n_segments):
+        time = eelbrain.UTS(-0.100, 0.010, n)
+        x = impulse_predictor(time, rng.uniform(0, time.tmax, int(rate * n * time.tstep)), name='word')
+        y = numpy.stack([numpy.convolve(x.ndvar().x, h)[:n] for h in trf]) + rng.normal(size=(n_sensors, n))
+        ys.append(eelbrain.NDVar(y, (sensor, time)))
+        impulses.append(x)
+    return ys, impulses
+
+
+def benchmark():
+    """Compare cross-validated ridge TRFs for impulse predictors and for the equivalent dense time series"""
+    from ridge import ridge
+
+    ys, impulses = _simulate()
+    n_times = sum(len(y.time) for y in ys)
+    n_impulses = sum(len(x.samples) for x in impulses)
+    print(f"{len(ys)} segments, {n_impulses} impulses in {n_times} samples ({1 - n_impulses / n_times:.1%} zeros), {len(ys[0].sensor)} sensors x 110 lags:")
+    dense = [x.ndvar() for x in impulses]
+    alphas = [1e-1, 1e0, 1e1, 1e2]
+    results = {}
+    for desc, xs in [('dense', dense), ('impulses', impulses)]:
+        tracemalloc.start()
+        t0 = _time.perf_counter()
+        results[desc] = ridge(ys, xs, -0.100, 1.000, alphas, n_folds=4)
+        t1 = _time.perf_counter()
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+        print(f"  {desc}: {t1 - t0:.2f} s, peak memory {peak:.0f} MB")
+    assert numpy.allclose(results['dense'].h_scaled.x, results['impulses'].h_scaled.x)
+    assert numpy.allclose(results['dense'].scores, results['impulses'].scores)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,439 @@
+"""Covariance statistics of time-lagged predictors, computed per data segment
+
+For a linear TRF model ``y[t] = sum_k h[k] x[t - k]``, the least-squares
+solution and the model fit depend on the data only through the covariance of
+the lagged predictors (``X'X``), their covariance with the response
+(``X'y``), and ``y'y``. These statistics are computed here segment by segment
+(e.g., one segment per stimulus), with each segment zero-padded at its edges:
+
+ - ``X'X`` is a block-Toeplitz matrix, computed from FFT-based
+   cross-correlations, with an exact correction for samples near the
+   segment edges.
+ - ``X'y`` is the cross-correlation of each predictor with the response.
+ - For sparse impulse predictors (:class:`impulses.ImpulsePredictor`), both
+   are computed by gathering the other time series at the impulse times for
+   each lag.
+
+Statistics for several segments are sums of the per-segment statistics, so
+that training statistics for any subset of segments are cheap to compute:
+for cross-validation with folds at segment boundaries, the training statistics
+of each fold are the total minus the statistics of the test segments
+(:meth:`LaggedCovariance.folds`). Statistics are computed separately for
+each pair of predictors and memoized, so that models sharing predictors share
+the computations.
+"""
+import eelbrain
+import numpy
+from scipy.fft import irfft, next_fast_len, rfft
+
+from impulses import is_impulse_predictor
+
+
+def lag_range(tstart, tstop, tstep):
+    """First lag and number of lags (in samples) for a TRF from ``tstart`` to ``tstop`` (exclusive)"""
+    k_min = int(round(tstart / tstep))
+    n_lags = int(round((tstop - tstart) / tstep))
+    return k_min, n_lags
+
+
+def lagged_design(x, k_min, n_lags, times):
+    """Explicit lagged design matrix for a set of time points
+
+    Parameters
+    ----------
+    x : array (n_predictors, n_times)
+        Predictor time series (zero outside ``[0, n_times)``).
+    k_min : int
+        First lag (in samples).
+    n_lags : int
+        Number of lags.
+    times : array of int
+        Time points (rows of the design matrix).
+
+    Returns
+    -------
+    design : array (len(times), n_predictors, n_lags)
+        ``design[i, p, j] = x[p, times[i] - (k_min + j)]``.
+    """
+    index = numpy.asarray(times)[:, None] - (k_min + numpy.arange(n_lags))
+    valid = (index >= 0) & (index < x.shape[1])
+    design = x[:, numpy.where(valid, index, 0)] * valid
+    return design.transpose(1, 0, 2)
+
+
+def _edge_times(n_times, k_min, n_lags):
+    "Time points outside [0, n_times) at which a lagged predictor can be non-zero"
+    k_max = k_min + n_lags - 1
+    return numpy.concatenate([numpy.arange(k_min, 0), numpy.arange(n_times, n_times + k_max)])
+
+
+def segment_folds(n_segments, n_folds=None):
+    """Split segments into cross-validation folds at segment boundaries
+
+    Parameters
+    ----------
+    n_segments : int
+        Number of segments.
+    n_folds : int
+        Number of folds (default is one fold per segment, i.e.,
+        leave-one-segment-out). Segments are assigned to folds with
+        ``[i::n_folds]`` slices.
+
+    Returns
+    -------
+    folds : list of list of int
+        Test segments for each fold.
+    """
+    if n_folds is None:
+        n_folds = n_segments
+    elif not 2 <= n_folds <= n_segments:
+        raise ValueError(f"{n_folds=} for {n_segments} segments")
+    segments = list(range(n_segments))
+    return [segments[i::n_folds] for i in range(n_folds)]
+
+
+class Fold:
+    """Training and test statistics for one cross-validation fold"""
+    def __init__(self, test, xx_train, xy_train, xx_test, xy_test, yy_test):
+        self.test = test
+        self.xx_train = xx_train
+        self.xy_train = xy_train
+        self.xx_test = xx_test
+        self.xy_test = xy_test
+        self.yy_test = yy_test
+
+    def ss_residual(self, h):
+        """Residual sum of squares in the test segments for the TRF ``h`` (n_features, n_responses)"""
+        return self.yy_test - 2 * (h * self.xy_test).sum(0) + (h * (self.xx_test @ h)).sum(0)
+
+
+class SegmentPredictor:
+    """One predictor in one segment, with its FFT (computed once for all pairs)"""
+    def __init__(self, x, n_fft):
+        self.x = x
+        self.n_series = len(x)
+        self.n_fft = n_fft
+        self._fft = None
+
+    @property
+    def fft(self):
+        if self._fft is None:
+            self._fft = rfft(self.x, self.n_fft)
+        return self._fft
+
+
+class SegmentImpulses:
+    """One impulse predictor in one segment, minus ``mean`` (for centering)"""
+    def __init__(self, samples, values, n_times, mean):
+        self.samples = samples
+        self.values = values
+        self.n_series = len(values)
+        self.n_times = n_times
+        self.mean = mean
+
+    def dense(self):
+        "(n_series, n_times) array"
+        x = numpy.zeros((self.n_series, self.n_times))
+        x[:, self.samples] = self.values
+        return x - self.mean[:, None]
+
+
+def gram_block(a, b, k_min, n_lags, n_fft):
+    """``X_a' X_b`` for one segment
+
+    Parameters
+    ----------
+    a, b : SegmentPredictor
+        Predictors with data of shape (n_predictors, n_times).
+
+    Returns
+    -------
+    block : array (n_a, n_lags, n_b, n_lags)
+    """
+    n_times = a.x.shape[1]
+    # Cross-correlation r[p, q, d] = sum_s a[p, s] b[q, s + d]
+    r = irfft(a.fft.conj()[:, None] * b.fft[None], n_fft)
+    lags = numpy.arange(n_lags)
+    d = (lags[:, None] - lags[None, :]) % n_fft
+    block = r[:, :, d].transpose(0, 2, 1, 3)
+    # Remove the contribution of time points outside the segment
+    times = _edge_times(n_times, k_min, n_lags)
+    if len(times):
+        edge_a = lagged_design(a.x, k_min, n_lags, times)
+        edge_b = edge_a if b is a else lagged_design(b.x, k_min, n_lags, times)
+        block -= numpy.einsum('tpj,tqi->pjqi', edge_a, edge_b)
+    return block
+
+
+def cross_block(a, y, k_min, n_lags, n_fft):
+    """``X_a' y`` for one segment
+
+    Parameters
+    ----------
+    a : SegmentPredictor
+        Predictors with data of shape (n_predictors, n_times).
+    y : SegmentPredictor
+        Response with data of shape (n_responses, n_times).
+
+    Returns
+    -------
+    block : array (n_a, n_lags, n_responses)
+    """
+    # r[p, c, d] = sum_s a[p, s] y[c, s + d]; the response is zero outside the segment, so no edge correction is needed
+    r = irfft(a.fft.conj()[:, None] * y.fft[None], n_fft)
+    lags = (k_min + numpy.arange(n_lags)) % n_fft
+    return r[:, :, lags].transpose(0, 2, 1)
+
+
+def _gather(z, index):
+    "``z[:, index]`` with zeros outside the segment, as array (*index.shape, n_z)"
+    invalid = (index < 0) | (index >= z.shape[1])
+    # Gather rows of the transposed array, so that the values for each index are copied together
+    out = z.T[numpy.clip(index, 0, z.shape[1] - 1)]
+    out[invalid] = 0
+    return out
+
+
+def _prefix_sums(z, ks):
+    "``z[:, :k].sum(1)`` for each ``k`` in ``ks``, summing only over the samples at the closer edge"
+    n_times = z.shape[1]
+    out = numpy.empty((len(z), *ks.shape))
+    head = ks <= n_times // 2
+    n_head = ks[head].max(initial=0)
+    head_sums = numpy.pad(z[:, :n_head].cumsum(1), ((0, 0), (1, 0)))
+    out[:, head] = head_sums[:, ks[head]]
+    n_tail = n_times - ks[~head].min(initial=n_times)
+    tail_sums = numpy.pad(z[:, n_times - n_tail:][:, ::-1].cumsum(1), ((0, 0), (1, 0)))
+    out[:, ~head] = z.sum(1)[:, None] - tail_sums[:, n_times - ks[~head]]
+    return out
+
+
+def impulse_block(a, z, k_min, n_lags, offsets):
+    """``X_a' Z`` for an impulse predictor and lagged time series, for one segment
+
+    Parameters
+    ----------
+    a : SegmentImpulses
+        Impulse predictor.
+    z : array (n_z, n_times)
+        Time series (e.g., the response, or another predictor).
+    offsets : array of int
+        Lags of ``z`` (in samples).
+
+    Returns
+    -------
+    block : array (n_a, n_lags, n_z, len(offsets))
+        ``block[p, j, q, i] = sum_t a[p, t - k_min - j] z[q, t - offsets[i]]``,
+        summed over the time points ``t`` of the segment.
+    """
+    n_times = z.shape[1]
+    offsets = numpy.asarray(offsets)
+    shifts = k_min + numpy.arange(n_lags)
+    # z is gathered at the impulse samples plus delta = shift - offset, which only takes a few distinct values
+    deltas, delta_index = numpy.unique(shifts[:, None] - offsets, return_inverse=True)
+    # (n_a, n_deltas, n_z) -> (n_a, n_lags, n_z, n_offsets)
+    sums = numpy.tensordot(a.values, _gather(z, a.samples[:, None] + deltas), (1, 0))
+    block = sums[:, delta_index.reshape((n_lags, len(offsets)))].transpose(0, 1, 3, 2)
+    # Remove impulses whose lagged time point falls outside the segment (only impulses near the edges)
+    events, lags = numpy.nonzero((a.samples[:, None] + shifts < 0) | (a.samples[:, None] + shifts >= n_times))
+    if len(events):
+        edge = _gather(z, a.samples[events, None] + shifts[lags, None] - offsets)
+        numpy.add.at(block, (slice(None), lags), -a.values[:, events, None, None] * edge.transpose(0, 2, 1)[None])
+    # Subtract the mean: a constant within the segment, whose lagged products with z are sums of z over windows
+    if a.mean.any():
+        start = numpy.clip(numpy.maximum(0, shifts)[:, None] - offsets, 0, n_times)
+        stop = numpy.clip(numpy.minimum(n_times, n_times + shifts)[:, None] - offsets, start, n_times)
+        window_sums = _prefix_sums(z, stop) - _prefix_sums(z, start)
+        block -= a.mean[:, None, None, None] * window_sums.transpose(1, 0, 2)
+    return block
+
+
+class LaggedCovariance:
+    """Memoized lagged covariance statistics for a response and several predictors
+
+    Parameters
+    ----------
+    y : sequence of NDVar
+        Response for each segment (time and one optional other dimension,
+        such as sensor).
+    tstart : scalar
+        TRF start (in seconds).
+    tstop : scalar
+        TRF stop (in seconds, exclusive).
+    center : bool
+        Subtract from the response, and from each predictor, its mean across
+        all segments.
+
+    Notes
+    -----
+    Add predictors with :meth:`add_predictor`, then access statistics for any
+    combination of predictors and segments with :meth:`xx`, :meth:`xy` and
+    :meth:`yy`.
+    """
+    def __init__(self, y, tstart, tstop, center=True):
+        self.time = y[0].time
+        self.k_min, self.n_lags = lag_range(tstart, tstop, self.time.tstep)
+        self.center = center
+        self.y_dims = [dim for dim in y[0].dims if dim.name != 'time']
+        data = [self._data(segment) for segment in y]
+        self.n_times = [segment.shape[1] for segment in data]
+        if center:
+            mean = sum(segment.sum(1) for segment in data) / sum(self.n_times)
+            data = [segment - mean[:, None] for segment in data]
+        self.n_fft = [next_fast_len(n + abs(self.k_min) + self.n_lags) for n in self.n_times]
+        self._y = [SegmentPredictor(segment, n_fft) for segment, n_fft in zip(data, self.n_fft)]
+        self.predictors = {}
+        self._x = {}
+        self._blocks = {}
+
+    @property
+    def n_segments(self):
+        return len(self.n_times)
+
+    def _data(self, x):
+        "(n_series, n_times) array"
+        dims = [dim.name for dim in x.dims if dim.name != 'time']
+        if len(dims) > 1:
+            raise ValueError(f"{x}: only one dimension besides time is supported")
+        return x.get_data((*dims, 'time')).reshape((-1, len(x.time)))
+
+    def add_predictor(self, name, x):
+        """Add a predictor
+
+        Parameters
+        ----------
+        name : str
+            Name to refer to the predictor.
+        x : sequence of NDVar | sequence of ImpulsePredictor
+            Predictor for each segment (time and one optional other
+            dimension, such as frequency), or impulse predictor for each
+            segment.
+        """
+        if len(x) != self.n_segments:
+            raise ValueError(f"{name}: {len(x)} segments, response has {self.n_segments}")
+        if is_impulse_predictor(x[0]):
+            self._add_impulses(name, x)
+            return
+        data = [self._data(segment) for segment in x]
+        for segment, n_times in zip(data, self.n_times):
+            if segment.shape[1] != n_times:
+                raise ValueError(f"{name}: segment with {segment.shape[1]} samples does not match the response ({n_times} samples)")
+        if self.center:
+            mean = sum(segment.sum(1) for segment in data) / sum(self.n_times)
+            data = [segment - mean[:, None] for segment in data]
+        self._set_predictor(name, x, [SegmentPredictor(segment, n_fft) for segment, n_fft in zip(data, self.n_fft)])
+
+    def _add_impulses(self, name, x):
+        for segment, n_times in zip(x, self.n_times):
+            if len(segment.time) != n_times:
+                raise ValueError(f"{name}: segment with {len(segment.time)} samples does not match the response ({n_times} samples)")
+        mean = numpy.zeros(1)
+        if self.center:
+            mean[0] = sum(segment.values.sum() for segment in x) / sum(self.n_times)
+        self._set_predictor(name, x, [SegmentImpulses(segment.samples, segment.values[None], n_times, mean) for segment, n_times in zip(x, self.n_times)])
+
+    def _set_predictor(self, name, x, segments):
+        self.predictors[name] = list(x)
+        self._x[name] = segments
+        # Remove memoized statistics of a previous predictor with the same name
+        for key in [key for key in self._blocks if name in key[1:3]]:
+            del self._blocks[key]
+
+    def n_features(self, name):
+        "Number of time series in a predictor"
+        return self._x[name][0].n_series
+
+    def _block(self, kind, a, b, segment):
+        key = (kind, a, b, segment)
+        if key not in self._blocks:
+            x_a = self._x[a][segment]
+            if kind == 'xx':
+                x_b = self._x[b][segment]
+                lags = self.k_min + numpy.arange(self.n_lags)
+                if isinstance(x_a, SegmentImpulses):
+                    z = x_b.dense() if isinstance(x_b, SegmentImpulses) else x_b.x
+                    block = impulse_block(x_a, z, self.k_min, self.n_lags, lags)
+                elif isinstance(x_b, SegmentImpulses):
+                    block = impulse_block(x_b, x_a.x, self.k_min, self.n_lags, lags).transpose(2, 3, 0, 1)
+                else:
+                    block = gram_block(x_a, x_b, self.k_min, self.n_lags, self.n_fft[segment])
+            elif isinstance(x_a, SegmentImpulses):
+                block = impulse_block(x_a, self._y[segment].x, self.k_min, self.n_lags, [0])[..., 0]
+            else:
+                block = cross_block(x_a, self._y[segment], self.k_min, self.n_lags, self.n_fft[segment])
+            self._blocks[key] = block
+        return self._blocks[key]
+
+    def _segments(self, segments):
+        return range(self.n_segments) if segments is None else segments
+
+    def xx(self, names, segments=None):
+        """``X'X`` for the predictors ``names``, summed over ``segments``
+
+        Returns
+        -------
+        xx : array (n_features, n_features)
+            With features ordered as ``(predictor, lag)``.
+        """
+        sizes = [self.n_features(name) * self.n_lags for name in names]
+        out = numpy.zeros((sum(sizes), sum(sizes)))
+        starts = numpy.cumsum([0, *sizes])
+        for i, a in enumerate(names):
+            for j, b in enumerate(names[i:], i):
+                block = 0
+                for segment in self._segments(segments):
+                    block = block + self._block('xx', a, b, segment)
+                block = numpy.reshape(block, (sizes[i], sizes[j]))
+                out[starts[i]: starts[i + 1], starts[j]: starts[j + 1]] = block
+                if j != i:
+                    out[starts[j]: starts[j + 1], starts[i]: starts[i + 1]] = block.T
+        return out
+
+    def xy(self, names, segments=None):
+        """``X'y`` for the predictors ``names``, summed over ``segments``
+
+        Returns
+        -------
+        xy : array (n_features, n_responses)
+        """
+        blocks = []
+        for name in names:
+            block = sum(self._block('xy', name, None, segment) for segment in self._segments(segments))
+            blocks.append(block.reshape((-1, block.shape[-1])))
+        return numpy.concatenate(blocks)
+
+    def yy(self, segments=None):
+        """``y'y`` (sum of squares of each response) for ``segments``"""
+        return sum((self._y[segment].x ** 2).sum(1) for segment in self._segments(segments))
+
+    def folds(self, names, folds=None):
+        """Training and test statistics for cross-validation folds
+
+        Parameters
+        ----------
+        names : sequence of str
+            Predictors.
+        folds : list of list of int
+            Test segments for each fold (default leave-one-segment-out; see
+            :func:`segment_folds`).
+
+        Yields
+        ------
+        fold : Fold
+            Statistics for each fold; training statistics are the total minus
+            the test segments' statistics.
+        """
+        if folds is None:
+            folds = segment_folds(self.n_segments)
+        xx = self.xx(names)
+        xy = self.xy(names)
+        for test in folds:
+            xx_test = self.xx(names, test)
+            xy_test = self.xy(names, test)
+            yield Fold(test, xx - xx_test, xy - xy_test, xx_test, xy_test, self.yy(test))
+
+    def response_ndvar(self, x, name=None):
+        """NDVar for data with one value per response (e.g., per sensor)"""
+        if not self.y_dims:
+            return x[0]
+        return eelbrain.NDVar(x, self.y_dims, name)
@@ -18,6 +18,10 @@ import re
 
 import eelbrain
 import mne
+import numpy
+
+from eeg_loading import filtered_epochs
+from erp import ERPAccumulator
 # -
 
 STIMULI = [str(i) for i in range(1, 13)]
@@ -31,6 +35,8 @@ EPOCH_DIR.mkdir(exist_ok=True)
 
 TSTART = -0.1
 TSTOP = 1
+# Number of quantiles for splitting words by surprisal
+N_QUANTILES = 4
 
 # +
 # Load stimuli
@@ -39,51 +45,47 @@ TSTOP = 1
 word_tables = [eelbrain.load.unpickle(PREDICTOR_DIR / f'{stimulus}~word.pickle') for stimulus in STIMULI]
 durations = [word_table['time'][-1] + TSTOP for word_table in word_tables]
 word_onsets = [word_table['time'] for word_table in word_tables]
+
+# Conditions: for each stimulus, a boolean mask indicating which words belong to each condition
+conditions = {
+    'word': [numpy.ones(word_table.n_cases, bool) for word_table in word_tables],
+    'lexical': [word_table['lexical'].x for word_table in word_tables],
+    'non_lexical': [word_table['nlexical'].x for word_table in word_tables],
+}
+# Split words into quantiles of surprisal; use the same boundaries for all stimuli
+for key in ['NGRAM', 'RNN']:
+    values = numpy.concatenate([word_table[key].x for word_table in word_tables])
+    edges = numpy.nanquantile(values, numpy.linspace(0, 1, N_QUANTILES + 1)[1:-1])
+    bins = [numpy.digitize(word_table[key].x, edges) for word_table in word_tables]
+    for quantile in range(N_QUANTILES):
+        conditions[f'{key}-{quantile + 1}'] = [(x == quantile) & ~numpy.isnan(word_table[key].x) for x, word_table in zip(bins, word_tables)]
+condition_masks = [numpy.array([masks[i] for masks in conditions.values()]) for i in range(len(STIMULI))]
 # -
 
 # Loop through subjects to get the epoched data
 for subject in SUBJECTS:
     subject_epoch_dir = EPOCH_DIR / subject
     subject_epoch_dir.mkdir(exist_ok=True)
-    # Generate epoch path so we can check whether it already exists
-    erp_path = subject_epoch_dir / f'{subject}_erp_word.pickle'
+    # Generate ERP path so we can check whether it already exists
+    erp_path = subject_epoch_dir / f'{subject}_erps.pickle'
     # Skip this subject if the file already exists
     if erp_path.exists():
         continue
     
     # Load the EEG data
-    raw = mne.io.read_raw(EEG_DIR / subject / f'{subject}_alice-raw.fif', preload=True)
-    # Band-pass filter the raw data between 0.5 and 20 Hz
-    raw.filter(0.5, 20)
-    # Interpolate bad channels
-    raw.interpolate_bads()
+    raw = mne.io.read_raw(EEG_DIR / subject / f'{subject}_alice-raw.fif')
     # Extract the events marking the stimulus presentation from the EEG file
     events = eelbrain.load.fiff.events(raw)
     # Not all subjects have all trials; determine which stimuli are present
     trial_indexes = [STIMULI.index(stimulus) for stimulus in events['event']]
-    # Extract the EEG data segments corresponding to the stimuli
+    # Extract the EEG data segments corresponding to the stimuli, band-pass filtered between 0.5 and 20 Hz and decimated to 100 Hz (bad channels are interpolated)
     trial_durations = [durations[i] for i in trial_indexes]
-    eeg = eelbrain.load.fiff.variable_length_epochs(events, -0.100, trial_durations, decim=5, connectivity='auto')
-    current_word_onsets = [word_onsets[i] for i in trial_indexes]
-
-    # Make epoched data
-    epochs = []
-    for eeg_segment, matched_word_onsets in zip(eeg, current_word_onsets):
-        for onset_time in matched_word_onsets:
-            # Note: tstart is negative!
-            if onset_time + TSTART < 0:
-                continue 
-            elif onset_time + TSTOP > eeg_segment.time.tstop:
-                continue
-            
-            epoch = eeg_segment.sub(time=(onset_time + TSTART, onset_time + TSTOP))
-            # Update the epoch's time to be relative to word onset
-            epoch = eelbrain.set_tmin(epoch, tmin=TSTART)
-            epochs.append(epoch)
+    eeg = filtered_epochs(events, -0.100, trial_durations, 0.5, 20)
 
-    # Take average
-    epochs = eelbrain.combine(epochs)
-    erp = epochs.mean('case')
-    # Baseline correction: subtract from each sensor its average over time
-    baseline_corrected_ERP = erp - erp.mean('time')
-    eelbrain.save.pickle(baseline_corrected_ERP, erp_path)
+    # Accumulate the epochs for all conditions in a single pass through the EEG segments
+    accumulator = ERPAccumulator(conditions, TSTART, TSTOP)
+    for eeg_segment, i in zip(eeg, trial_indexes):
+        accumulator.add(eeg_segment, word_onsets[i], condition_masks[i])
+    # Dataset with the ERP and its standard error for each condition; each epoch is baseline corrected by subtracting from each sensor its average over time
+    erps = accumulator.dataset()
+    eelbrain.save.pickle(erps, erp_path)
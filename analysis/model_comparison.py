@@ -0,0 +1,136 @@
+"""Compare TRF models with shuffled-predictor null models
+
+A model comparison like ``envelope +@ onset`` compares a full model with
+null models in which one term is shuffled (here, circularly shifted within
+each segment, as the ``$shift`` null models of the pipeline). The full and
+null models are estimated with boosting in one batch
+(:func:`batch_boosting.boosting_models`): the lagged covariance statistics of
+the predictors that are shared by the full and null models are computed only
+once, and only the statistics involving the shuffled term are computed for
+each null model.
+"""
+import eelbrain
+import numpy
+
+from batch_boosting import boosting_models
+import impulses
+from impulses import is_impulse_predictor
+
+
+def shift_segments(x, fraction):
+    """Circularly shift each segment by a fraction of its length
+
+    Parameters
+    ----------
+    x : sequence of NDVar | sequence of ImpulsePredictor
+        Predictor time series for each segment.
+    fraction : scalar
+        Shift, as fraction of each segment's duration.
+    """
+    out = []
+    for segment in x:
+        shift = int(round(fraction * len(segment.time)))
+        if is_impulse_predictor(segment):
+            out.append(segment.roll(shift))
+            continue
+        axis = segment.get_axis('time')
+        out.append(eelbrain.NDVar(numpy.roll(segment.x, shift, axis), segment.dims, segment.name, segment.info))
+    return out
+
+
+def _concatenate(x, name):
+    "Concatenate the segments of a predictor (as for boosting with concatenated trials)"
+    if is_impulse_predictor(x[0]):
+        return impulses.concatenate(x, name=name)
+    return eelbrain.concatenate(x, name=name)
+
+
+class ModelComparison:
+    """Estimate and cross-validate several models with shared statistics
+
+    Models are estimated with :func:`batch_boosting.boosting_models` on the
+    concatenated segments. Boosting parameters default to those of
+    ``PARAMETERS`` in ``pipeline/alice.py``, so that the comparisons measure
+    the same models as ``alice.show_model_test`` (``metric='det'``), except
+    that the error function is ``l2``, for which the statistics can be shared
+    between models.
+
+    Parameters
+    ----------
+    y : sequence of NDVar
+        Response for each segment (e.g., :class:`trials.Trials`).
+    predictors : dict {str: sequence of NDVar | ImpulsePredictor}
+        Predictors for each segment, by name.
+    tstart : scalar
+        TRF start (in seconds).
+    tstop : scalar
+        TRF stop (in seconds).
+    ...
+        Other parameters for :func:`batch_boosting.boosting_models`.
+    """
+    def __init__(self, y, predictors, tstart=-0.100, tstop=1.000, basis=0.050, partitions=5, selective_stopping=1, **kwargs):
+        self.y = eelbrain.concatenate(list(y))
+        self.predictors = {name: list(x) for name, x in predictors.items()}
+        self.tstart = tstart
+        self.tstop = tstop
+        self.kwargs = dict(basis=basis, partitions=partitions, selective_stopping=selective_stopping, **kwargs)
+        # Concatenated predictors, shared between comparisons
+        self._concatenated = {}
+
+    def _predictor(self, name):
+        if name not in self._concatenated:
+            self._concatenated[name] = _concatenate(self.predictors[name], name)
+        return self._concatenated[name]
+
+    def evaluate(self, models):
+        """Cross-validated proportion of the response explained by each model
+
+        Parameters
+        ----------
+        models : dict {str: sequence of str}
+            Models to evaluate, each a list of predictor names.
+
+        Returns
+        -------
+        proportion_explained : dict {str: NDVar}
+            Proportion of the response explained by each model in the test
+            partitions (as ``det`` in the pipeline).
+        """
+        names = dict.fromkeys(name for predictors in models.values() for name in predictors)
+        x = {name: self._predictor(name) for name in names}
+        results = boosting_models(self.y, x, models, self.tstart, self.tstop, test=True, **self.kwargs)
+        return {name: result.proportion_explained for name, result in results.items()}
+
+    def test_term(self, model, term, n_shuffles=3):
+        """Compare a model with null models in which ``term`` is shuffled
+
+        Parameters
+        ----------
+        model : sequence of str
+            Predictors in the full model (including ``term``).
+        term : str
+            Predictor to shuffle. Shuffled versions are added to the
+            predictors as ``{term}_shift{i}``.
+        n_shuffles : int
+            Number of null models (with shifts of ``i / (n_shuffles + 1)`` of
+            each segment's duration).
+
+        Returns
+        -------
+        full : NDVar
+            Proportion explained by the full model.
+        null : NDVar
+            Proportion explained by each null model (with ``case`` dimension).
+        """
+        model = list(model)
+        if term not in model:
+            raise ValueError(f"{term=} is not in {model=}")
+        models = {'full': model}
+        for i in range(1, n_shuffles + 1):
+            name = f'{term}_shift{i}'
+            if name not in self.predictors:
+                self.predictors[name] = shift_segments(self.predictors[term], i / (n_shuffles + 1))
+            models[name] = [name if x == term else x for x in model]
+        res = self.evaluate(models)
+        full = res.pop('full')
+        return full, eelbrain.combine(list(res.values()))
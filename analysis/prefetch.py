@@ -0,0 +1,140 @@
+"""Load the data for the next subject in the background
+
+The analysis scripts load and preprocess the EEG of each subject, and then
+spend most of the time estimating TRFs, while nothing prepares the next
+subject. :class:`Prefetcher` loads the data of the next subject(s) in a
+background thread while the current subject is processed.
+
+:func:`eelbrain.boosting` runs in native threads (``CONFIG['n_workers']``
+of them), which release the GIL, so the loader thread is not blocked by the
+GIL, but it competes with boosting for the CPU cores. Loading is hidden
+behind boosting to the extent that it waits for the disk, or when boosting
+leaves cores idle (e.g., while it evaluates results between fits). With all
+cores busy, prefetching can at best reorder the work, and the benchmark
+reports how much of the loading time was actually hidden.
+
+Run this module as a script for a benchmark with simulated data.
+"""
+from pathlib import Path
+import queue
+import tempfile
+import threading
+import time as _time
+
+import eelbrain
+import mne
+
+
+class Prefetcher:
+    """Iterate over ``(item, function(item))``, computing ``function`` in a background thread
+
+    Parameters
+    ----------
+    function : callable
+        Function that loads the data for one item (e.g., a subject).
+    items : sequence
+        Items, in the order in which they are processed.
+    max_prefetch : int
+        Maximum number of items that are loaded ahead of the item that is
+        currently processed (this limits the memory used for loaded data;
+        at least 1).
+
+    Notes
+    -----
+    Exceptions in ``function`` (including :class:`KeyboardInterrupt` and
+    :class:`SystemExit`) are raised when the corresponding item is
+    retrieved. After the iteration, :meth:`report` summarizes how much of
+    the loading time was hidden behind processing.
+    """
+    def __init__(self, function, items, max_prefetch=1):
+        if max_prefetch < 1:
+            raise ValueError(f"{max_prefetch=}: needs to be at least 1")
+        self.function = function
+        self.items = list(items)
+        self.max_prefetch = max_prefetch
+        self.load_times = []  # time spent loading each item (in the background)
+        self.wait_times = []  # time the iteration waited for each item
+        self._queue = queue.Queue()
+        # Slots for items that are loaded but not yet retrieved
+        self._slots = threading.Semaphore(max_prefetch)
+        self._stop = threading.Event()
+
+    def __repr__(self):
+        return f"<Prefetcher: {len(self.wait_times)} of {len(self.items)} items>"
+
+    def _load(self):
+        for item in self.items:
+            self._slots.acquire()
+            if self._stop.is_set():
+                return
+            t0 = _time.perf_counter()
+            try:
+                result = (item, self.function(item), None)
+            except BaseException as error:
+                # Pass on all exceptions, otherwise the iteration would wait for the item forever
+                result = (item, None, error)
+            self.load_times.append(_time.perf_counter() - t0)
+            self._queue.put(result)
+            if result[2] is not None:
+                return
+
+    def __iter__(self):
+        thread = threading.Thread(target=self._load, daemon=True)
+        thread.start()
+        try:
+            for _ in self.items:
+                t0 = _time.perf_counter()
+                item, data, error = self._queue.get()
+                self.wait_times.append(_time.perf_counter() - t0)
+                if error is not None:
+                    raise error
+                # Allow loading the next item while this one is processed
+                self._slots.release()
+                yield item, data
+                del data
+        finally:
+            # Stop the loader if the iteration ends early
+            self._stop.set()
+            self._slots.release()
+
+    def report(self):
+        "Summary of the loading time that was hidden behind processing"
+        load_time = sum(self.load_times)
+        wait_time = sum(self.wait_times)
+        hidden = max(load_time - wait_time, 0)
+        percent = 100 * hidden / load_time if load_time else 0
+        return f"Loaded {len(self.load_times)} items in {load_time:.1f} s; waited {wait_time:.1f} s for loading, {hidden:.1f} s ({percent:.0f}%) of loading time hidden"
+
+
+def benchmark(n_subjects=4):
+    """Load simulated subjects and estimate TRFs, sequentially and with prefetching"""
+    from eeg_loading import _simulate_raw, filtered_epochs
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = Path(tempdir) / 'simulated-raw.fif'
+        durations = _simulate_raw(path)
+
+        def load(subject):
+            events = eelbrain.load.fiff.events(mne.io.read_raw(path, verbose=False))
+            return filtered_epochs(events, -0.100, durations, 0.5, 20).concatenated()
+
+        def fit(eeg):
+            # TRF of the first 8 sensors to a predictor derived from the EEG
+            x = eelbrain.NDVar(eeg.x[0], (eeg.time,), 'x')
+            eelbrain.boosting(eeg.sub(sensor=eeg.sensor.names[:8]), x, -0.100, 0.400, partitions=4)
+
+        subjects = [f'S{i:02}' for i in range(n_subjects)]
+        t0 = _time.perf_counter()
+        for subject in subjects:
+            fit(load(subject))
+        t1 = _time.perf_counter()
+        prefetcher = Prefetcher(load, subjects)
+        for subject, eeg in prefetcher:
+            fit(eeg)
+        t2 = _time.perf_counter()
+        print(f"{n_subjects} subjects, sequential: {t1 - t0:.1f} s, with prefetching: {t2 - t1:.1f} s")
+        print(f"  {prefetcher.report()}")
+
+
+if __name__ == '__main__':
+    benchmark()
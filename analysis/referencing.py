@@ -0,0 +1,120 @@
+"""Derive EEG data with different references from a single array
+
+Re-referencing is a linear projection that commutes with filtering, bad
+channel interpolation and epoching. Data can thus be loaded and preprocessed
+once, and all reference variants derived from the same (sensor, time) array.
+"""
+import eelbrain
+import numpy
+
+
+def reference_projection(sensor_names, reference):
+    """Projection matrix that re-references data to ``reference``
+
+    Parameters
+    ----------
+    sensor_names : sequence of str
+        Sensor names of the data (in order).
+    reference : 'average' | sequence of str
+        New reference: the average of all sensors, or the average of a set of
+        sensors (e.g., ``['33']`` for Cz, or ``['25', '29']`` for the mastoids).
+
+    Returns
+    -------
+    projection : array (n_sensors, n_sensors)
+        Matrix ``P`` such that ``P @ data`` is the re-referenced data.
+    """
+    sensor_names = list(sensor_names)
+    weights = numpy.zeros(len(sensor_names))
+    if isinstance(reference, str):
+        if reference != 'average':
+            raise ValueError(f"reference={reference!r}; needs to be 'average' or a list of sensor names")
+        weights[:] = 1 / len(sensor_names)
+    else:
+        index = [sensor_names.index(name) for name in reference]
+        weights[index] = 1 / len(index)
+    return numpy.eye(len(sensor_names)) - weights
+
+
+def reference_variants(eeg, references, exclude_reference=False):
+    """Re-reference the same data to several references
+
+    Parameters
+    ----------
+    eeg : NDVar  (sensor, time)
+        EEG data (with any common reference).
+    references : dict {str: 'average' | sequence of str}
+        New references, by name (see :func:`reference_projection`).
+    exclude_reference : bool
+        Drop sensors that are flat after re-referencing (i.e., a single
+        reference sensor), rather than keeping a channel of zeros. Use
+        :func:`restore_sensors` to re-insert them into results.
+
+    Returns
+    -------
+    variants : dict {str: NDVar}
+        The data for each reference, by name.
+    """
+    data = eeg.get_data(('sensor', 'time'))
+    sensor_names = list(eeg.sensor.names)
+    indexes = []
+    projections = []
+    for reference in references.values():
+        projection = reference_projection(sensor_names, reference)
+        index = numpy.arange(len(sensor_names))
+        if exclude_reference and not isinstance(reference, str) and len(reference) == 1:
+            index = numpy.setdiff1d(index, [sensor_names.index(reference[0])])
+        indexes.append(index)
+        projections.append(projection[index])
+    # Stack the projections so that all variants are computed with a single matrix product
+    variants_data = numpy.concatenate(projections) @ data
+    variants = {}
+    start = 0
+    for name, index in zip(references, indexes):
+        stop = start + len(index)
+        dims = (eeg.sensor[index], eeg.time)
+        variants[name] = eelbrain.NDVar(variants_data[start: stop], dims, eeg.name, eeg.info)
+        start = stop
+    return variants
+
+
+def restore_sensors(x, sensor, fill=numpy.nan):
+    """Re-insert sensors that were excluded from ``x``
+
+    Parameters
+    ----------
+    x : NDVar
+        Data with a sensor dimension that is a subset of ``sensor``.
+    sensor : Sensor
+        Complete sensor dimension.
+    fill : scalar
+        Value for the missing sensors (the default ``nan`` keeps them out of
+        averages computed with :func:`numpy.nanmean`; use
+        :func:`drop_missing_sensors` before plotting).
+    """
+    if len(x.sensor) == len(sensor):
+        return x
+    axis = x.get_axis('sensor')
+    shape = list(x.shape)
+    shape[axis] = len(sensor)
+    data = numpy.full(shape, fill, float)
+    names = list(sensor.names)
+    index = (slice(None),) * axis + ([names.index(name) for name in x.sensor.names],)
+    data[index] = x.x
+    dims = (*x.dims[:axis], sensor, *x.dims[axis + 1:])
+    return eelbrain.NDVar(data, dims, x.name, x.info)
+
+
+def drop_missing_sensors(x):
+    """Drop sensors that have no data (``nan``, as re-inserted by :func:`restore_sensors`)
+
+    Parameters
+    ----------
+    x : NDVar
+        Data with a sensor dimension.
+    """
+    axis = x.get_axis('sensor')
+    missing = numpy.isnan(x.x).all(tuple(i for i in range(x.ndim) if i != axis))
+    if not missing.any():
+        return x
+    return x.sub(sensor=[name for name, is_missing in zip(x.sensor.names, missing) if not is_missing])
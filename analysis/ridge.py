@@ -0,0 +1,213 @@
+"""Ridge regression TRFs with cross-validated regularization
+
+The lagged covariance statistics (:mod:`lagged_covariance`) are computed
+once per segment. For each cross-validation fold, the training ``X'X`` is
+eigendecomposed once, after which the solution for each regularization
+parameter only requires rescaling by the eigenvalues. The TRF with the best
+regularization is then estimated from all data and returned in the same layout
+as :func:`eelbrain.boosting` results.
+
+Run this module as a script for a benchmark with simulated data.
+"""
+import time as _time
+
+import eelbrain
+import numpy
+
+from impulses import is_impulse_predictor
+from lagged_covariance import LaggedCovariance, lag_range, lagged_design, segment_folds
+
+
+class RidgeResult:
+    """Result of :func:`ridge`
+
+    Attributes
+    ----------
+    h_scaled : NDVar | list of NDVar
+        TRF for each predictor (in the units of the data, with the same
+        dimensions as :attr:`eelbrain.BoostingResult.h_scaled`).
+    h : NDVar | list of NDVar
+        TRF for each predictor, for standardized data (as
+        :attr:`eelbrain.BoostingResult.h`).
+    alpha : scalar
+        Regularization parameter with the best cross-validated fit.
+    alphas : array
+        All regularization parameters that were tested.
+    scores : array
+        Cross-validated proportion explained (l2, averaged across responses)
+        for each parameter in :attr:`alphas`.
+    proportion_explained : NDVar | float
+        Cross-validated proportion explained for each response, with
+        :attr:`alpha`.
+    """
+    def __init__(self, h_scaled, h, alpha, alphas, scores, proportion_explained, tstart, tstop):
+        self.h_scaled = h_scaled
+        self.h = h
+        self.alpha = alpha
+        self.alphas = alphas
+        self.scores = scores
+        self.proportion_explained = proportion_explained
+        self.tstart = tstart
+        self.tstop = tstop
+
+    def __repr__(self):
+        return f"<RidgeResult: alpha={self.alpha:g}, {self.tstart} - {self.tstop}>"
+
+
+def _split(x, n_segments):
+    "Split continuous data into contiguous segments"
+    bounds = numpy.linspace(0, len(x.time), n_segments + 1).round().astype(int)
+    axis = x.get_axis('time')
+    out = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        time = eelbrain.UTS(x.time.times[start], x.time.tstep, stop - start)
+        dims = (*x.dims[:axis], time, *x.dims[axis + 1:])
+        out.append(eelbrain.NDVar(x.x.take(range(start, stop), axis), dims, x.name))
+    return out
+
+
+def _std(xs):
+    "Standard deviation of each time series in a list of segments"
+    xs = [segment.ndvar() if is_impulse_predictor(segment) else segment for segment in xs]
+    data = [segment.get_data((*[dim.name for dim in segment.dims if dim.name != 'time'], 'time')).reshape((-1, len(segment.time))) for segment in xs]
+    return numpy.concatenate(data, 1).std(1)
+
+
+def ridge(y, x, tstart, tstop, alpha, n_folds=10):
+    """Estimate a TRF with ridge regression
+
+    Parameters
+    ----------
+    y : NDVar | sequence of NDVar
+        Response (time and one optional other dimension, such as sensor), as
+        continuous data or as a list of segments (e.g., trials).
+    x : NDVar | sequence of NDVar
+        Predictor or predictors (time and one optional other dimension, such
+        as frequency). If ``y`` is a list of segments, each predictor is a
+        list of segments as well, and can also be a list of
+        :class:`impulses.ImpulsePredictor`.
+    tstart : scalar
+        TRF start (in seconds).
+    tstop : scalar
+        TRF stop (in seconds, exclusive).
+    alpha : scalar | sequence of scalar
+        Regularization parameter(s). With multiple values, the parameter is
+        selected by cross-validation.
+    n_folds : int
+        Number of cross-validation folds. Continuous data are split into
+        ``n_folds`` contiguous segments; with a list of segments, folds are
+        split at segment boundaries (see
+        :func:`lagged_covariance.segment_folds`).
+
+    Returns
+    -------
+    result : RidgeResult
+        TRFs and cross-validation results.
+    """
+    if isinstance(y, eelbrain.NDVar):
+        y = _split(y, n_folds)
+        single_x = isinstance(x, eelbrain.NDVar)
+        xs = [_split(x_, n_folds) for x_ in ([x] if single_x else x)]
+    else:
+        y = list(y)
+        single_x = isinstance(x[0], eelbrain.NDVar) or is_impulse_predictor(x[0])
+        xs = [list(x)] if single_x else [list(x_) for x_ in x]
+    alphas = numpy.atleast_1d(numpy.asarray(alpha, float))
+    covariance = LaggedCovariance(y, tstart, tstop)
+    names = []
+    for i, x_ in enumerate(xs):
+        names.append(f'{x_[0].name}-{i}')
+        covariance.add_predictor(names[-1], x_)
+    folds = segment_folds(covariance.n_segments, min(n_folds, covariance.n_segments))
+    # Cross-validation: one eigendecomposition per fold for all alphas
+    ss_residual = numpy.zeros((len(alphas), len(covariance.yy())))
+    for fold in covariance.folds(names, folds):
+        eigenvalues, eigenvectors = numpy.linalg.eigh(fold.xx_train)
+        projected = eigenvectors.T @ fold.xy_train
+        for i, alpha_i in enumerate(alphas):
+            h = eigenvectors @ (projected / (eigenvalues + alpha_i)[:, None])
+            ss_residual[i] += fold.ss_residual(h)
+    explained = 1 - ss_residual / covariance.yy()
+    scores = explained.mean(1)
+    best = int(numpy.argmax(scores))
+    # Final estimate from all data
+    xx = covariance.xx(names)
+    xx[numpy.diag_indices_from(xx)] += alphas[best]
+    h = numpy.linalg.solve(xx, covariance.xy(names))
+    # Split into predictors and reshape to the layout of boosting results
+    time = eelbrain.UTS(covariance.k_min * covariance.time.tstep, covariance.time.tstep, covariance.n_lags)
+    y_std = _std(y)
+    h_scaled = []
+    h_standardized = []
+    start = 0
+    for name, x_ in zip(names, xs):
+        x_dims = [dim for dim in x_[0].dims if dim.name != 'time']
+        n_series = covariance.n_features(name)
+        stop = start + n_series * covariance.n_lags
+        h_x = h[start: stop].reshape((n_series, covariance.n_lags, -1)).transpose(2, 0, 1)
+        start = stop
+        x_std = _std(x_)
+        dims = (*covariance.y_dims, *x_dims, time)
+        shape = [len(dim) for dim in dims]
+        h_scaled.append(eelbrain.NDVar(h_x.reshape(shape), dims, x_[0].name))
+        h_standardized.append(eelbrain.NDVar((h_x * x_std[:, None] / y_std[:, None, None]).reshape(shape), dims, x_[0].name))
+    if single_x:
+        h_scaled, h_standardized = h_scaled[0], h_standardized[0]
+    proportion_explained = covariance.response_ndvar(explained[best], 'proportion_explained')
+    return RidgeResult(h_scaled, h_standardized, alphas[best], alphas, scores, proportion_explained, tstart, tstop)
+
+
+def _refit(y, xs, tstart, tstop, alphas, n_folds):
+    # Explicit design matrices and one solve per fold and alpha, as in a general purpose ridge estimator
+    tstep = y[0].time.tstep
+    k_min, n_lags = lag_range(tstart, tstop, tstep)
+    design = [numpy.concatenate([lagged_design(x_.x, k_min, n_lags, numpy.arange(len(x_.time))).reshape((len(x_.time), -1)) for x_ in x_segment], 1) for x_segment in zip(*xs)]
+    response = [segment.x.T for segment in y]
+    design = [x_ - x_.mean(0) for x_ in design]
+    response = [y_ - y_.mean(0) for y_ in response]
+    ss_residual = numpy.zeros((len(alphas), response[0].shape[1]))
+    for test in segment_folds(len(y), n_folds):
+        train = [i for i in range(len(y)) if i not in test]
+        x_train = numpy.concatenate([design[i] for i in train])
+        y_train = numpy.concatenate([response[i] for i in train])
+        x_test = numpy.concatenate([design[i] for i in test])
+        y_test = numpy.concatenate([response[i] for i in test])
+        for i, alpha in enumerate(alphas):
+            h = numpy.linalg.solve(x_train.T @ x_train + alpha * numpy.eye(x_train.shape[1]), x_train.T @ y_train)
+            ss_residual[i] += ((y_test - x_test @ h) ** 2).sum(0)
+    return 1 - ss_residual / sum((y_ ** 2).sum(0) for y_ in response)
+
+
+def _simulate(n_segments=12, n_sensors=4, n_bands=8, seed=0):
+    rng = numpy.random.default_rng(seed)
+    frequency = eelbrain.Scalar('frequency', numpy.arange(n_bands))
+    sensor = eelbrain.Sensor(rng.normal(size=(n_sensors, 3)))
+    trf = rng.normal(size=(n_sensors, n_bands, 20))
+    xs, ys = [], []
+    for n in rng.integers(5500, 7000, n_segments):
+        time = eelbrain.UTS(-0.100, 0.010, n)
+        x = rng.normal(size=(n_bands, n))
+        y = numpy.stack([sum(numpy.convolve(x[j], trf[i, j])[:n] for j in range(n_bands)) for i in range(n_sensors)])
+        y += 5 * rng.normal(size=y.shape)
+        xs.append(eelbrain.NDVar(x, (frequency, time), 'gammatone'))
+        ys.append(eelbrain.NDVar(y, (sensor, time)))
+    return ys, xs
+
+
+def benchmark(n_folds=10):
+    """Compare the cross-validation in :func:`ridge` with refitting explicit design matrices for each alpha"""
+    ys, xs = _simulate()
+    alphas = [1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8]
+    t0 = _time.perf_counter()
+    reference = _refit(ys, [xs], -0.100, 1.000, alphas, n_folds)
+    t1 = _time.perf_counter()
+    result = ridge(ys, xs, -0.100, 1.000, alphas, n_folds)
+    t2 = _time.perf_counter()
+    assert numpy.allclose(result.scores, reference.mean(1), atol=1e-4)
+    print(f"{len(ys)} segments, {n_folds} folds, {len(alphas)} alphas, 8 bands x 110 lags:")
+    print(f"  explicit design matrices, one solve per fold and alpha: {t1 - t0:.2f} s")
+    print(f"  ridge: {t2 - t1:.2f} s (best alpha={result.alpha:g}, proportion explained={result.scores.max():.3f})")
+
+
+if __name__ == '__main__':
+    benchmark()
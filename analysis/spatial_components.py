@@ -0,0 +1,362 @@
+"""Fit TRFs to spatial components of the EEG
+
+EEG signals are highly correlated across sensors, so that most of the
+variance of 64 sensors is captured by a few spatial components. For
+exploratory analyses, TRFs can be estimated for the top ``k`` components
+instead of for each sensor, and then projected back to sensor space:
+
+ - :func:`pca_filter`: principal components (maximal variance).
+ - :func:`dss_filter`: denoising source separation (DSS) components, ordered by
+   the proportion of their variance that is predictable from the stimulus
+   (estimated with ridge regression from :class:`lagged_covariance.LaggedCovariance`).
+ - :func:`component_filter`: either filter, from the ``SPATIAL_COMPONENTS``
+   setting of the TRF estimation scripts (:func:`component_suffix` for the
+   corresponding file names).
+
+Run this module as a script for a benchmark with simulated data.
+"""
+import time as _time
+
+import eelbrain
+import numpy
+import scipy.signal
+
+from lagged_covariance import LaggedCovariance
+
+
+class SpatialFilter:
+    """Projection of sensor data onto spatial components
+
+    Parameters
+    ----------
+    unmixing : array (n_sensors, k)
+        Weights for computing each component from the (centered) sensors.
+    mixing : array (n_sensors, k)
+        Topography of each component (least squares back-projection).
+    mean : array (n_sensors,)
+        Mean of each sensor.
+    sensor : Sensor
+        Sensor dimension of the data.
+    method : str
+        Method by which components were computed.
+    """
+    def __init__(self, unmixing, mixing, mean, sensor, method):
+        self.unmixing = unmixing
+        self.mixing = mixing
+        self.mean = mean
+        self.sensor = sensor
+        self.method = method
+        self.component = eelbrain.Scalar('component', numpy.arange(unmixing.shape[1]))
+
+    def __repr__(self):
+        return f"<SpatialFilter {self.method}: {len(self.sensor)} sensors -> {len(self.component)} components>"
+
+    def transform(self, eeg):
+        """Project sensor data onto the components
+
+        Parameters
+        ----------
+        eeg : NDVar  (sensor, time)
+            Sensor data.
+
+        Returns
+        -------
+        components : NDVar  (component, time)
+            Component time courses.
+        """
+        data = eeg.get_data(('sensor', 'time')) - self.mean[:, None]
+        return eelbrain.NDVar(self.unmixing.T @ data, (self.component, eeg.time), eeg.name, eeg.info)
+
+    def inverse(self, x):
+        """Project component data (e.g., a TRF) back to sensor space
+
+        Parameters
+        ----------
+        x : NDVar | tuple of NDVar
+            Data with ``component`` dimension.
+
+        Returns
+        -------
+        sensor_data : NDVar | tuple of NDVar
+            Data with ``sensor`` dimension in place of ``component`` (without
+            the sensor means).
+        """
+        if isinstance(x, tuple):
+            return tuple(self.inverse(x_) for x_ in x)
+        dims = [dim for dim in x.dims if dim.name != 'component']
+        data = x.get_data(('component', *[dim.name for dim in dims]))
+        data = numpy.tensordot(self.mixing, data, 1)
+        return eelbrain.NDVar(data, (self.sensor, *dims), x.name, x.info)
+
+
+def _spatial_filter(eeg, unmixing, method):
+    "Spatial filter with least squares back-projection"
+    data = eeg.get_data(('sensor', 'time'))
+    mean = data.mean(1)
+    covariance = numpy.cov(data)
+    mixing = covariance @ unmixing @ numpy.linalg.inv(unmixing.T @ covariance @ unmixing)
+    return SpatialFilter(unmixing, mixing, mean, eeg.sensor, method)
+
+
+def pca_filter(eeg, k):
+    """Spatial filter for the ``k`` principal components of the data
+
+    Parameters
+    ----------
+    eeg : NDVar  (sensor, time)
+        Sensor data (e.g., the concatenated EEG of one subject).
+    k : int
+        Number of components.
+    """
+    eigenvalues, eigenvectors = numpy.linalg.eigh(numpy.cov(eeg.get_data(('sensor', 'time'))))
+    return _spatial_filter(eeg, eigenvectors[:, ::-1][:, :k], 'pca')
+
+
+def dss_filter(eeg, x, tstart, tstop, k, alpha=0.1):
+    """Spatial filter for the ``k`` DSS components most predictable from ``x``
+
+    Parameters
+    ----------
+    eeg : NDVar  (sensor, time)
+        Sensor data (continuous).
+    x : NDVar | sequence of NDVar
+        Predictors (continuous, as for :func:`eelbrain.boosting`).
+    tstart : scalar
+        TRF start (in seconds).
+    tstop : scalar
+        TRF stop (in seconds, exclusive).
+    k : int
+        Number of components.
+    alpha : scalar
+        Ridge regularization, relative to the mean of the diagonal of ``X'X``.
+
+    Notes
+    -----
+    The bias covariance of the DSS is the covariance of the sensor data
+    predicted by a ridge regression TRF, ``X'y' (X'X + a)^-1 X'y``, so that
+    components are ordered by the proportion of their variance that is
+    predictable from ``x``.
+    """
+    xs = [x] if isinstance(x, eelbrain.NDVar) else list(x)
+    covariance = LaggedCovariance([eeg], tstart, tstop)
+    names = [f'x{i}' for i in range(len(xs))]
+    for name, x_ in zip(names, xs):
+        covariance.add_predictor(name, [x_])
+    xx = covariance.xx(names)
+    xy = covariance.xy(names)
+    diagonal = numpy.einsum('ii->i', xx)
+    diagonal += alpha * diagonal.mean()
+    bias = xy.T @ numpy.linalg.solve(xx, xy)
+    # Whiten the data, then rotate to maximize the bias covariance
+    eigenvalues, eigenvectors = numpy.linalg.eigh(numpy.cov(eeg.get_data(('sensor', 'time'))))
+    keep = eigenvalues > eigenvalues.max() * 1e-10
+    whitening = eigenvectors[:, keep] / numpy.sqrt(eigenvalues[keep])
+    _, rotation = numpy.linalg.eigh(whitening.T @ bias @ whitening)
+    return _spatial_filter(eeg, whitening @ rotation[:, ::-1][:, :k], 'dss')
+
+
+def component_filter(eeg, method, k, x=None, tstart=None, tstop=None):
+    """Spatial filter for ``k`` components computed with ``method``
+
+    Parameters
+    ----------
+    eeg : NDVar  (sensor, time)
+        Sensor data (continuous).
+    method : 'pca' | 'dss'
+        Principal components (:func:`pca_filter`) or DSS components
+        (:func:`dss_filter`).
+    k : int
+        Number of components.
+    x : NDVar | sequence of NDVar
+        Predictors (only for ``'dss'``).
+    tstart : scalar
+        TRF start (in seconds; only for ``'dss'``).
+    tstop : scalar
+        TRF stop (in seconds, exclusive; only for ``'dss'``).
+    """
+    if method == 'pca':
+        return pca_filter(eeg, k)
+    elif method == 'dss':
+        if x is None or tstart is None or tstop is None:
+            raise ValueError("method='dss' requires x, tstart and tstop")
+        return dss_filter(eeg, x, tstart, tstop, k)
+    raise ValueError(f"{method=}: needs to be 'pca' or 'dss'")
+
+
+def component_suffix(spatial_components):
+    """File name suffix for TRFs fitted to spatial components
+
+    Parameters
+    ----------
+    spatial_components : None | (str, int)
+        ``(method, k)`` for :func:`component_filter`, or ``None`` for TRFs
+        fitted to each sensor (no suffix).
+    """
+    if not spatial_components:
+        return ''
+    method, k = spatial_components
+    return f' {method}-{k}'
+
+
+class ComponentTRF:
+    """TRFs fitted to spatial components, projected back to sensor space
+
+    Attributes
+    ----------
+    components : BoostingResult
+        Boosting result for the component time courses.
+    spatial_filter : SpatialFilter
+        The spatial filter.
+    h : NDVar | tuple of NDVar
+        TRFs in sensor space, for normalized data (as
+        :attr:`eelbrain.BoostingResult.h`).
+    h_scaled : NDVar | tuple of NDVar
+        TRFs in sensor space, in the units of the data.
+    proportion_explained : NDVar
+        Cross-validated proportion explained for each sensor (with the error
+        norm used for fitting).
+    component_proportion_explained : NDVar
+        Cross-validated proportion explained for each component.
+    """
+    def __init__(self, components, spatial_filter, h, h_scaled, proportion_explained):
+        self.components = components
+        self.spatial_filter = spatial_filter
+        self.h = h
+        self.h_scaled = h_scaled
+        self.proportion_explained = proportion_explained
+        self.component_proportion_explained = components.proportion_explained
+
+    def __repr__(self):
+        return f"<ComponentTRF: {self.spatial_filter}, {self.components}>"
+
+
+def component_boosting(eeg, x, tstart, tstop, spatial_filter, **kwargs):
+    """Fit TRFs to spatial components with :func:`eelbrain.boosting`
+
+    Parameters
+    ----------
+    eeg : NDVar  (sensor, time)
+        Sensor data.
+    x : NDVar | sequence of NDVar
+        Predictors.
+    tstart : scalar
+        TRF start (in seconds).
+    tstop : scalar
+        TRF stop (in seconds).
+    spatial_filter : SpatialFilter
+        Spatial filter (see :func:`pca_filter` and :func:`dss_filter`).
+    ...
+        Other parameters for :func:`eelbrain.boosting`; use ``test=1`` for
+        cross-validated fit metrics.
+
+    Returns
+    -------
+    trf : ComponentTRF
+        Component TRFs and their projection to sensor space.
+    """
+    components = spatial_filter.transform(eeg)
+    test = kwargs.get('test')
+    keep_partition_results = kwargs.pop('partition_results', False)
+    res = eelbrain.boosting(components, x, tstart, tstop, partition_results=keep_partition_results or bool(test), **kwargs)
+    # Cross-validated predictions of the (centered) components
+    y_pred = _predict(res, x, spatial_filter.component, test)
+    if not keep_partition_results:
+        res.partition_results = None
+    # Sensor space
+    data = eeg.get_data(('sensor', 'time'))
+    data = data - data.mean(1, keepdims=True)
+    residual = data - spatial_filter.mixing @ y_pred
+    if res.error == 'l1':
+        y_scale = numpy.abs(data).mean(1)
+        explained = 1 - numpy.abs(residual).sum(1) / numpy.abs(data).sum(1)
+    else:
+        y_scale = (data ** 2).mean(1) ** 0.5
+        explained = 1 - (residual ** 2).sum(1) / (data ** 2).sum(1)
+    h_scaled = spatial_filter.inverse(res.h_scaled)
+    x_scales = res.x_scale if isinstance(res.h_scaled, tuple) else [res.x_scale]
+    y_scale = eelbrain.NDVar(y_scale, (spatial_filter.sensor,))
+    h = [h_ * (x_scale / y_scale) for h_, x_scale in zip(h_scaled if isinstance(h_scaled, tuple) else [h_scaled], x_scales)]
+    h = tuple(h) if isinstance(h_scaled, tuple) else h[0]
+    proportion_explained = eelbrain.NDVar(explained, (spatial_filter.sensor,), 'proportion_explained')
+    return ComponentTRF(res, spatial_filter, h, h_scaled, proportion_explained)
+
+
+def _predict(res, x, component, test):
+    """Predictions of the centered components (in the units of the data), as evaluated by :func:`eelbrain.boosting`
+
+    With ``test``, each test segment is predicted from the TRF of the
+    corresponding test partition. As in :func:`eelbrain.boosting`, the
+    predictors are smoothed with the basis, and they are zero outside the
+    predicted segment.
+    """
+    xs = [x] if isinstance(x, eelbrain.NDVar) else list(x)
+    x_means = res.x_mean if isinstance(res.x_mean, tuple) else [res.x_mean]
+    x_scales = res.x_scale if isinstance(res.x_scale, tuple) else [res.x_scale]
+    time = xs[0].time
+    i_start = int(round(res.tstart / time.tstep))
+    y_scale = res.y_scale.get_data('component')
+    data = []
+    for x_, x_mean, x_scale in zip(xs, x_means, x_scales):
+        dimnames = [dim.name for dim in x_.dims if dim.name != 'time']
+        x_data = x_.get_data((*dimnames, 'time')).reshape((-1, len(time)))
+        if res.basis:
+            window = scipy.signal.get_window(res.basis_window, int(round(res.basis / time.tstep)), False)
+            x_data = numpy.stack([scipy.signal.convolve(row, window / window.sum(), 'same') for row in x_data])
+        mean = x_mean.get_data(dimnames).ravel() if isinstance(x_mean, eelbrain.NDVar) else numpy.full(1, x_mean)
+        scale = x_scale.get_data(dimnames).ravel() if isinstance(x_scale, eelbrain.NDVar) else numpy.full(1, x_scale)
+        data.append((dimnames, x_data, mean, scale))
+    if test:
+        models = [(partition, next(split.test for split in res.splits.splits if split.i_test == partition.i_test)) for partition in res.partition_results]
+    else:
+        models = [(res, res.splits.segments)]
+    y_pred = numpy.zeros((len(component), len(time)))
+    for model, segments in models:
+        hs = model.h_source if isinstance(model.h_source, tuple) else [model.h_source]
+        for (dimnames, x_data, mean, scale), h in zip(data, hs):
+            # TRF before the basis, in the units of the data
+            h_data = h.get_data(('component', *dimnames, 'time')).reshape((len(component), len(x_data), -1))
+            h_data = h_data * y_scale[:, None, None] / scale[:, None]
+            for start, stop in segments:
+                for j in range(h_data.shape[2]):
+                    lag = i_start + j
+                    x_lagged = numpy.repeat(-mean[:, None], stop - start, 1)
+                    i0, i1 = max(start, start - lag), min(stop, stop - lag)
+                    if i1 > i0:
+                        x_lagged[:, i0 + lag - start: i1 + lag - start] += x_data[:, i0: i1]
+                    y_pred[:, start: stop] += h_data[:, :, j] @ x_lagged
+    return y_pred
+
+
+def _simulate(n_times=6000, n_sensors=32, n_sources=4, seed=0):
+    rng = numpy.random.default_rng(seed)
+    time = eelbrain.UTS(0, 0.010, n_times)
+    sensor = eelbrain.Sensor(rng.normal(size=(n_sensors, 3)))
+    envelope = numpy.abs(numpy.convolve(rng.normal(size=n_times), numpy.hanning(10), 'same'))
+    trf = rng.normal(size=(n_sources, 30)) * numpy.hanning(30)
+    sources = numpy.stack([numpy.convolve(envelope, h)[:n_times] for h in trf])
+    # Stimulus-driven sources and spatially correlated background activity
+    y = rng.normal(size=(n_sensors, n_sources)) @ sources
+    y += rng.normal(size=(n_sensors, 8)) @ rng.normal(size=(8, n_times)) + 0.5 * rng.normal(size=(n_sensors, n_times))
+    return eelbrain.NDVar(y, (sensor, time), 'eeg'), eelbrain.NDVar(envelope, (time,), 'envelope')
+
+
+def benchmark(k=4):
+    """Compare fitting TRFs to all sensors with fitting TRFs to ``k`` components"""
+    eeg, envelope = _simulate()
+    kwargs = dict(error='l2', partitions=4, test=1)
+    print(f"{len(eeg.sensor)} sensors, {len(eeg.time)} samples:")
+    t0 = _time.perf_counter()
+    res = eelbrain.boosting(eeg, envelope, -0.100, 0.400, **kwargs)
+    t1 = _time.perf_counter()
+    print(f"  sensors: {t1 - t0:.1f} s, proportion explained {res.proportion_explained.mean():.3f}")
+    for desc in ('pca', 'dss'):
+        t0 = _time.perf_counter()
+        spatial_filter = component_filter(eeg, desc, k, envelope, -0.100, 0.400)
+        trf = component_boosting(eeg, envelope, -0.100, 0.400, spatial_filter, **kwargs)
+        t1 = _time.perf_counter()
+        r = numpy.corrcoef(trf.h_scaled.x.ravel(), res.h_scaled.x.ravel())[0, 1]
+        print(f"  {desc}-{k}: {t1 - t0:.1f} s, proportion explained {trf.proportion_explained.mean():.3f} (components: {trf.component_proportion_explained.mean():.3f}), TRF correlation with sensor TRFs r={r:.3f}")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,43 @@
+"""Stimulus durations and time axes from the stimulus index
+
+The index is created by ``predictors/make_stimulus_index.py``.
+"""
+import json
+from pathlib import Path
+
+import eelbrain
+
+
+DATA_ROOT = Path("~").expanduser() / 'Data' / 'Alice'
+
+
+def load_stimulus_index(data_root=DATA_ROOT):
+    "``{stimulus: info}`` dictionary"
+    with (Path(data_root) / 'stimuli' / 'index.json').open() as file:
+        return json.load(file)
+
+
+def predictor_time(info, tstep=0.01, tstart=-0.100, pad=1):
+    """Time axis of a predictor after binning and padding
+
+    Parameters
+    ----------
+    info : dict
+        Index entry for one stimulus.
+    tstep : scalar
+        Time step after binning (with ``label='start'``).
+    tstart : scalar
+        Start of the padded predictor.
+    pad : scalar
+        Padding added after the end of the binned predictor (in seconds).
+
+    Notes
+    -----
+    Corresponds to the time axis of::
+
+        x = x.bin(tstep, dim='time', label='start')
+        x = eelbrain.pad(x, tstart=tstart, tstop=x.time.tstop + pad)
+    """
+    n_samples = info['n_samples'][str(int(round(1 / tstep)))]
+    tstop = info['tmin'] + n_samples * tstep + pad
+    return eelbrain.UTS(tstart, tstep, int(round((tstop - tstart) / tstep)))
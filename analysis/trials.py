@@ -0,0 +1,219 @@
+"""Variable-length trials stored in one contiguous buffer
+
+TRFs are estimated from the concatenated trials of each subject. With
+:func:`eelbrain.concatenate`, every trial is copied into a new array, for the
+EEG of each subject and for each predictor of each model. Here, trials are
+written into a buffer that is allocated once (:class:`Trials`), and the
+trials as well as the concatenated data are views of that buffer:
+
+ - The EEG loaders in ``eeg_loading.py`` write the filtered trials of each
+   subject directly into a :class:`Trials` buffer.
+ - :class:`PredictorCache` concatenates the stimulus predictors for a
+   sequence of trials once, and shares the result between all models that use
+   the same predictor, and all subjects with the same trials.
+
+Run this module as a script for a benchmark with simulated data.
+"""
+from collections import OrderedDict
+from collections.abc import Sequence
+import time as _time
+import tracemalloc
+
+import eelbrain
+import numpy
+
+
+def _values_equal(a, b):
+    "Test equality of info values, which can be arrays"
+    if a is b:
+        return True
+    elif isinstance(a, numpy.ndarray) or isinstance(b, numpy.ndarray):
+        return numpy.array_equal(a, b)
+    try:
+        return bool(a == b)
+    except ValueError:  # e.g., sequences of arrays
+        return False
+
+
+def _merge_info(ndvars):
+    "Info entries shared by all ``ndvars``: keys that are present in all of them with equal values"
+    info = dict(ndvars[0].info)
+    for x in ndvars[1:]:
+        info = {key: value for key, value in info.items() if key in x.info and _values_equal(x.info[key], value)}
+    return info
+
+
+class Trials(Sequence):
+    """Variable-length trials in one contiguous buffer
+
+    Parameters
+    ----------
+    dims : sequence of Dimension
+        Dimensions of each trial, except time (time is the last axis of the
+        buffer).
+    tmin : scalar
+        Time of the first sample of each trial.
+    tstep : scalar
+        Time step.
+    n_times : sequence of int
+        Number of samples in each trial.
+    name : str
+        Name of the NDVars.
+    info : dict
+        Info for the NDVars.
+
+    Notes
+    -----
+    ``trials[i]`` is an NDVar view of trial ``i``, and
+    :meth:`concatenated` is an NDVar view of the whole buffer, equivalent to
+    ``eelbrain.concatenate(trials)``. Use :meth:`trial_data` to write the
+    data of each trial into the buffer.
+    """
+    def __init__(self, dims, tmin, tstep, n_times, name=None, info=None):
+        self.dims = tuple(dims)
+        self.tmin = tmin
+        self.tstep = tstep
+        self.n_times = list(n_times)
+        self.name = name
+        self.info = {} if info is None else info
+        self.stops = numpy.cumsum(self.n_times)
+        self.starts = self.stops - self.n_times
+        self.data = numpy.empty((*map(len, self.dims), self.stops[-1] if self.n_times else 0))
+
+    @classmethod
+    def from_ndvars(cls, ndvars, name=None):
+        """Copy NDVars into a new buffer (equivalent to :func:`eelbrain.concatenate`)
+
+        Parameters
+        ----------
+        ndvars : sequence of NDVar
+            Trials, with identical dimensions except time.
+        name : str
+            Name of the NDVars (default is the name of the first trial).
+        """
+        first = ndvars[0]
+        dimnames = [dim for dim in first.dimnames if dim != 'time']
+        trials = cls(first.get_dims(dimnames), first.time.tmin, first.time.tstep, [len(x.time) for x in ndvars], name or first.name, _merge_info(ndvars))
+        for i, x in enumerate(ndvars):
+            trials.trial_data(i)[...] = x.get_data((*dimnames, 'time'))
+        return trials
+
+    def __len__(self):
+        return len(self.n_times)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        time = eelbrain.UTS(self.tmin, self.tstep, self.n_times[index])
+        return eelbrain.NDVar(self.trial_data(index), (*self.dims, time), self.name, self.info)
+
+    def __repr__(self):
+        return f"<Trials {self.name}: {len(self)} trials, {self.data.shape[-1]} samples>"
+
+    def trial_data(self, index):
+        "View of the buffer for trial ``index``"
+        return self.data[..., self.starts[index]: self.stops[index]]
+
+    def concatenated(self, tmin=0):
+        """All trials concatenated (a view of the buffer)
+
+        Parameters
+        ----------
+        tmin : scalar
+            Time of the first sample (as for :func:`eelbrain.concatenate`).
+        """
+        time = eelbrain.UTS(tmin, self.tstep, self.data.shape[-1])
+        return eelbrain.NDVar(self.data, (*self.dims, time), self.name, self.info)
+
+
+class PredictorCache:
+    """Predictors concatenated for a sequence of trials, computed once for each pattern
+
+    Parameters
+    ----------
+    max_patterns : int
+        Number of trial patterns for which concatenated predictors are kept
+        (the least recently used pattern is discarded first).
+
+    Notes
+    -----
+    Predictors are identified by the list object that contains the predictor
+    for each stimulus, so the same lists should be used for all models.
+    The concatenated predictors are shared, and should not be modified.
+    """
+    def __init__(self, max_patterns=2):
+        self.max_patterns = max_patterns
+        self._patterns = OrderedDict()  # trial_indexes -> {id(predictor): (predictor, Trials)}
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"<PredictorCache: {len(self._patterns)} patterns, {self.hits} hits, {self.misses} misses>"
+
+    def concatenate(self, predictor, trial_indexes):
+        """Concatenate a predictor for a sequence of trials
+
+        Parameters
+        ----------
+        predictor : list of NDVar
+            The predictor for each stimulus.
+        trial_indexes : sequence of int
+            Stimulus index of each trial.
+
+        Returns
+        -------
+        concatenated : NDVar
+            Predictor for the concatenated trials (equivalent to
+            ``eelbrain.concatenate([predictor[i] for i in trial_indexes])``).
+        """
+        pattern = tuple(trial_indexes)
+        if pattern in self._patterns:
+            self._patterns.move_to_end(pattern)
+        else:
+            self._patterns[pattern] = {}
+            while len(self._patterns) > self.max_patterns:
+                self._patterns.popitem(last=False)
+        predictors = self._patterns[pattern]
+        if id(predictor) in predictors:
+            self.hits += 1
+        else:
+            self.misses += 1
+            # Keep a reference to the predictor list so that its id is not reused
+            predictors[id(predictor)] = (predictor, Trials.from_ndvars([predictor[i] for i in pattern]))
+        return predictors[id(predictor)][1].concatenated()
+
+
+def benchmark(n_stimuli=12, n_subjects=4, n_bands=8):
+    """Compare :class:`PredictorCache` with :func:`eelbrain.concatenate` for the models of ``estimate_trfs.py``"""
+    rng = numpy.random.default_rng(0)
+    durations = rng.integers(5000, 6000, n_stimuli)
+    frequency = eelbrain.Scalar('frequency', numpy.arange(n_bands))
+    gammatone = [eelbrain.NDVar(rng.normal(size=(n_bands, n)), (frequency, eelbrain.UTS(-0.100, 0.010, n)), 'gammatone', {'unit': 'x'}) for n in durations]
+    onsets = [eelbrain.NDVar(rng.normal(size=(n_bands, n)), (frequency, eelbrain.UTS(-0.100, 0.010, n)), 'gammatone_on') for n in durations]
+    envelope = [eelbrain.NDVar(rng.normal(size=n), (eelbrain.UTS(-0.100, 0.010, n),), 'envelope') for n in durations]
+    models = [[envelope], [gammatone], [gammatone, onsets], [envelope, onsets], [gammatone, onsets, envelope], [gammatone, envelope]]
+    trial_indexes = list(range(n_stimuli))
+
+    def assemble(concatenate):
+        return [[[concatenate(x, trial_indexes) for x in model] for model in models] for subject in range(n_subjects)]
+
+    results = {}
+    for label, make_function in [('eelbrain.concatenate', lambda: lambda x, indexes: eelbrain.concatenate([x[i] for i in indexes])), ('PredictorCache', lambda: PredictorCache().concatenate)]:
+        t0 = _time.perf_counter()
+        results[label] = assemble(make_function())
+        seconds = _time.perf_counter() - t0
+        # Memory in a separate run, since tracing slows down the Python code
+        tracemalloc.start()
+        assemble(make_function())
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+        print(f"{label:20}: {seconds:5.2f} s, peak memory {peak:6.1f} MB")
+    for subject_a, subject_b in zip(results['eelbrain.concatenate'], results['PredictorCache']):
+        for model_a, model_b in zip(subject_a, subject_b):
+            for x_a, x_b in zip(model_a, model_b):
+                assert x_a.dims == x_b.dims and x_a.name == x_b.name and x_a.info == x_b.info
+                numpy.testing.assert_array_equal(x_a.x, x_b.x)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -23,7 +23,11 @@ import matplotlib.pyplot as pyplot
 import eelbrain
 
 from scipy.signal import windows
-from pyeeg.models import TRFEstimator
+
+# Shared helpers from the analysis directory
+import analysis_path
+from convolution import batch_convolve
+from ridge import ridge
 
 
 STIMULI = [str(i) for i in range(1, 13)]
@@ -73,9 +77,6 @@ gammatone = [eelbrain.load.unpickle(PREDICTOR_DIR / f'{stimulus}~gammatone-8.pic
 gammatone = [x.bin(0.01, dim='time', label='start') for x in gammatone]
 # Pad onset with 100 ms and offset with 1 second; make sure to give the predictor a unique name as that will make it easier to identify the TRF later
 gammatone = [eelbrain.pad(x, tstart=-0.100, tstop=x.time.tstop + 1, name='gammatone') for x in gammatone]
-
-# Extract the duration of the stimuli, so we can later match the EEG to the stimuli
-durations = [gt.time.tmax for stimulus, gt in zip(STIMULI, gammatone)]
 # -
 
 # # Simulate the EEG
@@ -95,7 +96,8 @@ strf.x[4, 20:220] += - 0.25 * windows.gaussian(200, 17)
 strf.x[4, 170:470] += + 0.15 * windows.gaussian(300, 50)
 strf.x *= 1e-8
 strf = eelbrain.resample(strf, 1/tstep)
-gammatone_response = [eelbrain.convolve(strf, x) for x in gammatone]
+# Convolve all stimuli with the STRF in a single batch
+gammatone_response = batch_convolve(strf, gammatone)
 
 # Add pink noise to the auditory responses to simulate raw EEG data
 eeg = []
@@ -126,20 +128,15 @@ increments = np.diff(explained_variances_in_test, prepend=0)
 best_stopping = np.where(increments < 0)[0][0] - 1
 boosting_trf = boosting_trfs[best_stopping]
 
-# # Learn TRFs via Ridge regression using pyEEG
-cache_path = SIMULATION_DIR / 'ridge.pickle'
+# # Learn TRFs via Ridge regression
+# The regularization parameter is selected by cross-validation, with folds split at trial boundaries
+# The ridge.pickle files of earlier versions contain pyEEG TRFEstimator objects, so the native estimate is cached under a different name
+cache_path = SIMULATION_DIR / 'ridge-native.pickle'
 if cache_path.exists():
     ridge_trf = eelbrain.load.unpickle(cache_path)
 else:
-    x = predictors_concatenated.get_data(('time', 'frequency'))
-    y = eeg_concatenated.get_data('time')[:, None]
     reg_param = [1e5, 2e5, 5e5, 1e6, 2e6, 5e6, 1e7]  # Ridge parameters
-    ridge_trf = TRFEstimator(tmin=-0.1, tmax=1., srate=1/eeg[0].time.tstep, alpha=reg_param)
-    scores, alpha = ridge_trf.xfit(x, y, n_splits=10)
-    params = ridge_trf.get_params()
-    tt = eelbrain.UTS.from_range(params['tmin'], params['tmax'], 1 / params['srate'])
-    ridge_trf.best_alpha = alpha
-    ridge_trf.h_scaled = eelbrain.NDVar(ridge_trf.coef_[:, :, 0].T, (frequency, tt), name='gammatone')
+    ridge_trf = ridge(eeg, gammatone, -0.1, 1., alpha=reg_param, n_folds=10)
     eelbrain.save.pickle(ridge_trf, cache_path)
 
 # # Figure
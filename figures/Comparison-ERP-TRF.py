@@ -20,6 +20,10 @@ from pathlib import Path
 import eelbrain
 from matplotlib import pyplot
 
+# Shared helpers from the analysis directory
+import analysis_path
+from comparison import comparison_dataset, window_ttests
+
 # Data locations
 DATA_ROOT = Path("~").expanduser() / 'Data' / 'Alice'
 PREDICTOR_DIR = DATA_ROOT / 'predictors'
@@ -58,39 +62,31 @@ subjects = [subject for subject in os.listdir(TRF_DIR) if subject.startswith('S'
 assert os.path.exists(ERP_DIR), "ERP directory is not found. Please, run script analysis/make_erps.py to create the different ERPs per subject."
 
 # Get the ERP response to a word onset
-cases = []
+erps = {}
 for subject in subjects:
-    erp = eelbrain.load.unpickle(ERP_DIR / subject / f'{subject}_erp_word.pickle')
-    cases.append([subject, erp])
-# Use the same column names for ERPs and TRFs so that ERP and TRF datasets can be merged
-data_erp = eelbrain.Dataset.from_caselist(['subject', 'pattern'], cases)
-data_erp[:, 'type'] = 'ERP'
+    subject_erps = eelbrain.load.unpickle(ERP_DIR / subject / f'{subject}_erps.pickle')
+    erps[subject] = subject_erps[subject_erps['condition'].index('word')[0], 'erp']
 
 # Get the TRF to word onsets when controlled for acoustic representations
-cases = []
+trfs = {}
 for subject in subjects:
     mtrf = eelbrain.load.unpickle(TRF_DIR/ subject / f'{subject} acoustic+words.pickle')
-    trf = mtrf.h[-1]
-    cases.append([subject, trf])
-data_trfs_controlled = eelbrain.Dataset.from_caselist(['subject', 'pattern'], cases)
-data_trfs_controlled[:, 'type'] = 'TRF'
-
-# Merge ERP and TRF data
-data = eelbrain.combine([data_erp, data_trfs_controlled], dim_intersection=True)
-
+    trfs[subject] = mtrf.h[-1]
 
 # +
-# Normalize responses
-pattern_normalized = data['pattern'] - data['pattern'].mean('time')
-normalize_by = pattern_normalized.std('time')
-normalize_by[normalize_by == 0] = 1  # Avoid division by 0
-pattern_normalized /= normalize_by
-data['norm_pattern'] = pattern_normalized
+# Merge ERP and TRF data on a common time axis, and normalize responses (each sensor to mean 0 and standard deviation 1 over time)
+data = comparison_dataset({'ERP': erps, 'TRF': trfs})
 data['norm_pattern_Fz'] = data['norm_pattern'].sub(sensor='1')
 
 # Tests to compare ERP and TRF
 res_fz = eelbrain.testnd.TTestRelated('norm_pattern_Fz', 'type', match='subject', data=data, pmin=0.05)
 res_topo = eelbrain.testnd.TTestRelated('norm_pattern', 'type', match='subject', data=data, pmin=0.05)
+# Tests on the average in 100 ms time windows, for all sensors
+windows = [(tstart / 10, (tstart + 1) / 10) for tstart in range(10)]
+res_windows = window_ttests(data, 'norm_pattern', 'type', windows)
+# Save the table next to the figure, and show the windows and sensors in which ERP and TRF differ (uncorrected p < .05)
+res_windows.save_txt(DST / 'Comparison-ERP-TRF windows.txt')
+res_windows.sub("p < 0.05")
 
 
 # +
@@ -22,6 +22,10 @@ import eelbrain
 from matplotlib import pyplot
 from matplotlib.patches import ConnectionPatch
 
+# Shared helpers from the analysis directory
+import analysis_path
+from convolution import batch_convolve
+
 
 # Data locations
 DATA_ROOT = Path("~").expanduser() / 'Data' / 'Alice'
@@ -74,6 +78,10 @@ wav_envelope = wav.sub(time=(0, 5)).envelope()
 stimulus_envelope = eelbrain.resample(eelbrain.filter_data(wav_envelope, 0, 10), 100)
 stimulus_envelope *= 4e-5
 
+# Responses of TRF 1 to both stimuli, and of TRF 2 to the impulses
+response_impulse, response_continuous = batch_convolve(trf, [stimulus, stimulus_envelope], name='response')
+trf_2_response, = batch_convolve(trf_2, [stimulus])
+
 # +
 # initialize figure
 figure = pyplot.figure(figsize=(7.5, 6.5), facecolor='w')
@@ -115,7 +123,6 @@ eelbrain.plot.UTS(trf, axes=ax, **uts_args)
 ax.set_title('TRF 1')
 decorate(ax)
 # TRF response
-response_impulse = eelbrain.convolve(trf, stimulus)
 ax_b2 = ax = pyplot.subplot2grid(shape, (3, 0), colspan=7, **ax_args)
 eelbrain.plot.UTS(response_impulse, axes=ax, **uts_args)
 decorate(ax)
@@ -132,7 +139,6 @@ eelbrain.plot.UTS(trf, axes=ax, **uts_args)
 ax.set_title('TRF 2')
 decorate(ax)
 # TRF response
-response_continuous = eelbrain.convolve(trf, stimulus_envelope, name='response')
 ax_c2 = ax = pyplot.subplot2grid(shape, (6, 0), colspan=7, **ax_args)
 plot = eelbrain.plot.UTS(response_continuous, axes=ax, **uts_args)
 decorate(ax)
@@ -141,7 +147,6 @@ response_handle = plot.plots[0].legend_handles['response']
 # D) mTRF: continuous stimulus
 style = eelbrain.plot.Style('C1', linestyle='--')
 # Impulse predictor
-trf_2_response = eelbrain.convolve(trf_2, stimulus)
 ax = pyplot.subplot2grid(shape, (8, 0), colspan=7, **ax_args)
 ax.set_title('D) mTRF: simultaneous additive responses to multiple predictors', loc='left', size=10)
 eelbrain.plot.UTS(stimulus, axes=ax, colors='b', stem=True, **uts_args)
@@ -154,7 +159,7 @@ eelbrain.plot.UTS(trf_2, axes=ax, **uts_args)
 decorate(ax)
 # Continuous predictor
 ax = pyplot.subplot2grid(shape, (9, 0), colspan=7, **ax_args)
-trf_1_response = eelbrain.convolve(trf, stimulus_envelope, name='response')
+trf_1_response = response_continuous
 eelbrain.plot.UTS(stimulus_envelope, axes=ax, colors='b', **uts_args)
 plot = eelbrain.plot.UTS(trf_1_response * .1, axes=ax, colors=style, **uts_args)
 decorate(ax)
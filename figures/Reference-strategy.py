@@ -27,6 +27,10 @@ from pathlib import Path
 import eelbrain
 from matplotlib import pyplot
 
+# Shared helpers from the analysis directory
+import analysis_path
+from referencing import drop_missing_sensors, restore_sensors
+
 
 # Data locations
 DATA_ROOT = Path("~").expanduser() / 'Data' / 'Alice'
@@ -71,8 +75,15 @@ cases = []
 for subject in subjects:
     for reference, name in zip(['mastoids', 'cz', 'average'], ['', '_cz','_average']):
         trf = eelbrain.load.unpickle(TRF_DIR / subject / f"{subject} envelope{name}.pickle")
+        h = trf.h[0]
         prediction_accuracy = trf.proportion_explained * 100  # to %
-        cases.append([subject, trf.h[0], prediction_accuracy, reference])
+        if reference == 'mastoids':
+            sensor = h.sensor
+        else:
+            # The reference channel (Cz) is excluded from the TRF estimation; re-insert it without data (NaN), so that all cases share the same sensors
+            h = restore_sensors(h, sensor)
+            prediction_accuracy = restore_sensors(prediction_accuracy, sensor)
+        cases.append([subject, h, prediction_accuracy, reference])
 
 column_names = ['subject', 'trf', 'prediction_accuracy','reference']
 data_trfs = eelbrain.Dataset.from_caselist(column_names, cases, random='subject')
@@ -93,10 +104,11 @@ reference_labels = {
     'average': 'average',
 }
 
-# A) Prediction accuracies 
+# A) Prediction accuracies (sensors without data, i.e. Cz for the Cz reference, are left out of the plots)
 for reference_idx, reference in enumerate(reference_labels):
     axes = figure.add_subplot(gridspec[reference_idx*3: reference_idx*3+3, 0:3])
-    p = eelbrain.plot.Topomap('prediction_accuracy', data=data_trfs[data_trfs['reference']==reference], axes=axes, **det_args)
+    prediction_accuracy = drop_missing_sensors(data_trfs[data_trfs['reference']==reference, 'prediction_accuracy'])
+    p = eelbrain.plot.Topomap(prediction_accuracy, axes=axes, **det_args)
     label = reference_labels[reference]
     axes.set_title(f"Referenced to {label}", loc='left', size=10)
 p.plot_colorbar(below=axes, label="% variability explained", clipmin=0, ticks=5, h=2)
@@ -107,7 +119,7 @@ time_labels = ['%d ms' % (time*1000) for time in times]
 for reference_idx, reference in enumerate(reference_labels):
     axes = figure.add_subplot(gridspec[reference_idx*3: reference_idx*3+3, 3:9])
     reference_index = data_trfs['reference'] == reference
-    trf = data_trfs[reference_index, 'trf']
+    trf = drop_missing_sensors(data_trfs[reference_index, 'trf'])
     
     # Plot butterfly TRF
     kwargs = dict(vmin=-0.004, vmax=0.007, linewidth=0.5, color='#808080', ylabel='TRF weights [a.u.]', frame='t', yticklabels='none', xlim=(-0.050, 1.000), clip=True)
@@ -23,6 +23,13 @@ from matplotlib import pyplot
 from matplotlib.patches import ConnectionPatch
 import mne
 
+# Shared helpers from the analysis directory
+import analysis_path
+from convolution import batch_convolve
+from eeg_loading import filtered_epochs
+from envelope import envelope_predictor
+from evaluation import evaluate
+
 
 # Data locations
 DATA_ROOT = Path("~").expanduser() / 'Data' / 'Alice'
@@ -58,13 +65,10 @@ pyplot.rcParams.update(RC)
 
 # ## Load data and estimate deconvolution 
 
-# Load and pre-process the EEG data
-raw = mne.io.read_raw_fif(DATA_ROOT / 'eeg' / SUBJECT / f'{SUBJECT}_alice-raw.fif', preload=True)
-raw = raw.filter(1, 8, n_jobs=1)
+# Create a raw object for the EEG data - the data are filtered when the epochs are loaded below
+raw = mne.io.read_raw_fif(DATA_ROOT / 'eeg' / SUBJECT / f'{SUBJECT}_alice-raw.fif')
 # Extract the events from the EEG data, and select the trial corresponding to the stimulus
 events = eelbrain.load.fiff.events(raw)
-# Define one second of silence to pad stimuli
-silence = eelbrain.NDVar.zeros(eelbrain.UTS(0, 1/100, 100))
 # Load the stimuli coresponding to the events
 stimuli = []
 envelopes = []
@@ -73,12 +77,8 @@ for stimulus in events['event']:
     # Stimulus for plotting
     stimulus_wave = eelbrain.resample(wave, 2000)
     stimuli.append(stimulus_wave)
-    # Envelope predictors
-    envelope = wave.envelope()
-    envelope = eelbrain.resample(envelope, 100).clip(0)
-    envelope = eelbrain.concatenate([envelope, silence])
-    # Log transform to approximate auditory system response characteristics
-    envelope = (envelope + 1).log()
+    # Envelope predictors, computed block by block from the wav file at 100 Hz and padded with one second of silence; log transform to approximate auditory system response characteristics
+    envelope = envelope_predictor(STIMULUS_DIR / f'{stimulus}.wav', 100, pad=1)
     # Apply the same filter as for the EEG data
     envelope = eelbrain.filter_data(envelope, 1, 8)
     envelopes.append(envelope)
@@ -86,8 +86,8 @@ events['stimulus'] = stimuli
 events['envelope'] = envelopes
 # Find the stimulus duration based on the envelopes
 durations = [envelope.time.tstop for envelope in envelopes]
-# Load the EEG data corresponding to this event/stimulus
-events['eeg'] = eelbrain.load.fiff.variable_length_epochs(events, tmin=0, tstop=durations, decim=5)
+# Load the EEG data corresponding to this event/stimulus, band-pass filtered between 1 and 8 Hz and decimated to 100 Hz (the last sample of each epoch is one sample before the end of the envelope)
+events['eeg'] = list(filtered_epochs(events, 0, [duration - 0.010 for duration in durations], 1, 8, interpolate_bads=False))
 
 events.summary()
 
@@ -103,12 +103,10 @@ p = eelbrain.plot.TopoArray(trf.h, t=[0.040, 0.150, 0.380], clip='circle')
 # Predict response to the 12th stimulus
 envelope_12 = events[11, 'envelope']
 eeg_12 = events[11, 'eeg']
-eeg_12_predicted = eelbrain.convolve(trf.h_scaled, envelope_12)
+eeg_12_predicted, = batch_convolve(trf.h_scaled, [envelope_12])
 
 # Evaluate cross-validated predictions
-ss_total = eeg_12.abs().sum('time')
-ss_residual = (eeg_12 - eeg_12_predicted).abs().sum('time')
-proportion_explained_12 = 1 - (ss_residual / ss_total)
+proportion_explained_12 = evaluate(eeg_12, eeg_12_predicted).proportion_explained('l1')
 # Plot correlation on estimation and testing data
 titles = [f'Training data\nMax explained = {trf.proportion_explained.max():.2%}$', f'Testing data\nMax explained = {proportion_explained_12.max():.2%}']
 p = eelbrain.plot.Topomap([trf.proportion_explained, proportion_explained_12], sensorlabels='name', clip='circle', nrow=1, axtitle=titles)
@@ -20,6 +20,10 @@ import eelbrain
 from matplotlib import pyplot
 import mne
 
+# Shared helpers from the analysis directory
+import analysis_path
+from eeg_loading import filtered_epochs
+
 
 # Data locations
 DATA_ROOT = Path("~").expanduser() / 'Data' / 'Alice'
@@ -56,11 +60,9 @@ events.head()
 
 # For this illustration, pick only the first stimulus
 events = events.sub(f"event == {STIMULUS!r}")
-# Load the EEG data corresponding to this event; load only the first 5 seconds of data here
-eeg = eelbrain.load.fiff.epochs(events, tmin=0, tstop=TSTOP)
-# Filter the data and resample it to 100 Hz
-eeg = eelbrain.filter_data(eeg, 1, 20)
-eeg = eelbrain.resample(eeg, 100)
+# Load the EEG data corresponding to this event; load only the first 5 seconds of data here (the last sample is at 5 s), band-pass filtered between 1 and 20 Hz and decimated to 100 Hz
+# The filter is applied to the continuous recording, so that the 5 second segment has no filter edge artifacts
+eeg = filtered_epochs(events, 0, [TSTOP - 0.001], 1, 20, interpolate_bads=False)[0]
 
 # +
 # Load the stimulus wave file
@@ -21,6 +21,9 @@ import matplotlib
 from matplotlib import pyplot
 import re
 
+# Shared helpers from the analysis directory (the word acoustics TRFs are batch boosting results)
+import analysis_path
+
 
 # Data locations
 DATA_ROOT = Path("~").expanduser() / 'Data' / 'Alice'
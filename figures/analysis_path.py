@@ -0,0 +1,11 @@
+"""Make the helper modules in the ``analysis`` directory importable
+
+The figure notebooks import this module before importing helpers such as
+``comparison`` or ``convolution`` from ``../analysis``.
+"""
+from pathlib import Path
+import sys
+
+ANALYSIS_DIR = Path(__file__).resolve().parent.parent / 'analysis'
+if str(ANALYSIS_DIR) not in sys.path:
+    sys.path.append(str(ANALYSIS_DIR))
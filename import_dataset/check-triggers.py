@@ -15,43 +15,111 @@
 
 # # Check alignments
 # Check alignemnts of stimuli with the EEG data. The EEG recording contains a record of the acoustic stimulus, which can be compare with the stimulus itself. This loads the events through the pipeline in `alice.py`, i.e. the trigger correction is already applied and all subjects should have the correct alignment.
+#
+# For each subject and segment, the envelope of the recorded audio channel is cross-correlated with the stimulus envelope (the `gammatone-1` predictor) over the whole segment. Both envelopes are low-pass filtered with the same filter, so that they have the same temporal resolution. The lag with the peak correlation should be close to 0 for all segments; segments that deviate are listed as outliers and plotted for visual inspection. As reference for the correlations, `r_chance` is the peak correlation of each recording with the envelope of a different segment.
 
 # +
 # %matplotlib inline
+import mne
+import numpy
+from scipy.fft import irfft, next_fast_len, rfft
+from scipy.signal import oaconvolve
 from eelbrain import *
 
 from alice import alice
 
 
-# load the acoustic envelope predictor for each stimulus
-gt = {f'{i}': alice.load_predictor(f'{i}~gammatone-1', 0.002, 1000, name='WAV') for i in range(1, 13)}
-for y in gt.values():
-    y /= y.std()
+TSTEP = 0.002  # Sampling interval of the raw EEG
+# Lags (in samples) searched for the peak cross-correlation
+MAX_LAG = 250
+# Low-pass filter applied to the recorded and the stimulus envelopes (in Hz)
+ENVELOPE_LOW_PASS = 30
+# Segments are flagged as outliers if the lag differs from the median lag by more than LAG_TOLERANCE (in seconds), or if the peak correlation is less than MIN_RELATIVE_R times the median peak correlation
+LAG_TOLERANCE = 0.010
+MIN_RELATIVE_R = 0.5
+
+
+def low_pass(x, kernel):
+    "Zero-phase FIR filter (the kernel has odd length and is symmetric)"
+    return oaconvolve(x, kernel, 'same')
+
+
+def recorded_envelope(x, kernel):
+    "Envelope of the audio recorded in the EEG (rectified and low-pass filtered, like the stimulus envelope)"
+    return low_pass(numpy.abs(x - x.mean()), kernel)
+
+
+def cross_correlate(recorded, envelopes, max_lag):
+    "Correlation of each recorded segment (with max_lag samples before and after the stimulus) with its stimulus envelope, for lags -max_lag to max_lag"
+    n_fft = next_fast_len(max(map(len, recorded)) + max(map(len, envelopes)))
+    x_batch = numpy.zeros((len(recorded), n_fft))
+    y_batch = numpy.zeros((len(envelopes), n_fft))
+    for i, (x, y) in enumerate(zip(recorded, envelopes)):
+        # Normalize the recording based on the stimulus window, so that the correlation at lag 0 is Pearson's r
+        window = x[max_lag: len(y) + max_lag]
+        x_batch[i, :len(x)] = (x - window.mean()) / (window.std() * len(y) ** 0.5)
+        y_batch[i, :len(y)] = (y - y.mean()) / (y.std() * len(y) ** 0.5)
+    # All pairs in one batch: xcorr[i, m] = sum_t x[i, t + m] * y[i, t], with m = lag + max_lag
+    xcorr = irfft(rfft(x_batch, workers=-1) * rfft(y_batch, workers=-1).conj(), n_fft, workers=-1)
+    return xcorr[:, :2 * max_lag + 1]
+
+
+# load the acoustic envelope predictor for each stimulus (whole segment)
+gt = {f'{i}': alice.load_predictor(f'{i}~gammatone-1', TSTEP, name='WAV') for i in range(1, 13)}
+low_pass_kernel = mne.filter.create_filter(None, 1 / TSTEP, None, ENVELOPE_LOW_PASS, verbose=False)
+gt_envelope = {segment: low_pass(y.x, low_pass_kernel) for segment, y in gt.items()}
 # -
 
+# Extract the audio channel for each segment; only this channel is read from the raw files
+rows = []
+recorded = []
 for subject in alice:
-    events = alice.load_events(raw='raw', data_raw=True)
-    raw = events.info['raw']
-    raw.load_data()
     # S16, S22 have broken AUX channels
     if subject in ['S05', 'S38']:
         continue  # no AUD channel
+    events = alice.load_events(raw='raw', data_raw=True)
+    raw = events.info['raw']
     for name in ['AUD', 'Aux5']:
         if name in raw.ch_names:
-            ch = raw.ch_names.index(name)
             break
     else:
         print(subject, raw.ch_names)
         raise
-    xs = []
-    # extract audio from EEG
-    for segment, i0 in events.zip('event', 'i_start'):
-        x = NDVar(raw._data[ch, i0:i0+1000], UTS(0, 0.002, 1000), name='EEG')
-        x -= x.min()
-        x /= x.std()
-        xs.append([x, gt[segment]])
-    p = plot.UTS(xs, axh=2, w=10, ncol=1, title=subject, axtitle=events['trigger'])
+    audio = raw.get_data(picks=[name])[0]
+    audio = numpy.pad(audio, MAX_LAG)  # segments starting less than MAX_LAG after the recording onset
+    for segment, trigger, i0 in events.zip('event', 'trigger', 'i_start'):
+        n = len(gt[segment])
+        recorded.append(recorded_envelope(audio[i0: i0 + n + 2 * MAX_LAG], low_pass_kernel))
+        rows.append([subject, segment, trigger])
+
+# Cross-correlate all subject x segment pairs
+xcorr = cross_correlate(recorded, [gt_envelope[segment] for _, segment, _ in rows], MAX_LAG)
+# Chance level: correlation with the envelope of the next segment (recordings are longer than the shorter envelopes, so only lengths need to be compatible)
+other = {segment: str(int(segment) % 12 + 1) for segment in gt}
+xcorr_chance = cross_correlate(recorded, [gt_envelope[other[segment]][:len(x) - 2 * MAX_LAG] for x, (_, segment, _) in zip(recorded, rows)], MAX_LAG)
+peak = xcorr.argmax(1)
+data = Dataset.from_caselist(['subject', 'segment', 'trigger'], rows)
+data['lag'] = Var((peak - MAX_LAG) * TSTEP)
+data['r'] = Var(xcorr[numpy.arange(len(peak)), peak])
+data['r_0'] = Var(xcorr[:, MAX_LAG])  # correlation at lag 0
+data['r_chance'] = Var(xcorr_chance.max(1))
+outlier = (abs(data['lag'].x - numpy.median(data['lag'].x)) > LAG_TOLERANCE) | (data['r'].x < MIN_RELATIVE_R * numpy.median(data['r'].x))
+data['outlier'] = Var(outlier)
+print(f"Median lag: {numpy.median(data['lag'].x) * 1000:.0f} ms; median r: {numpy.median(data['r'].x):.2f} (chance: {numpy.median(data['r_chance'].x):.2f})")
+data
+
+# Segments with unexpected alignment
+outliers = data.sub('outlier')
+outliers
+
+# Plot the first 2 s of each outlier segment, with the recording shifted by the estimated lag
+for i in numpy.flatnonzero(outlier):
+    subject, segment, lag = data[i, 'subject'], data[i, 'segment'], data[i, 'lag']
+    x = recorded[i][MAX_LAG: MAX_LAG + 1000]
+    x_shifted = recorded[i][peak[i]: peak[i] + 1000]
+    xs = [NDVar(x_, UTS(0, TSTEP, 1000), name=name) for x_, name in [(x, 'EEG'), (x_shifted, f'EEG (lag {lag * 1000:.0f} ms)'), (gt_envelope[segment][:1000], 'WAV')]]
+    xs = [(x_ - x_.min()) / x_.std() for x_ in xs]
+    p = plot.UTS([xs], axh=2, w=10, title=f'{subject}, segment {segment}')
     # display and close to avoid having too many open figures
     display(p)
     p.close()
-
@@ -1,7 +1,14 @@
 # This file contains a pipeline specification. The pipeline is defined as a subclass of TRFExperiment, and adds information about the specific paradigm and data. TRFExperiment is a subclass of eelbrain.MneExperiment, which is documented extensively on the Eelbrain website.
+import json
+from pathlib import Path
+import warnings
+
 from eelbrain.pipeline import *
 from trftools.pipeline import *
 
+from profiling import PipelineProfiler
+from raw_pipes import RawFilterDecimate
+
 
 # This is the root directory where the pipeline expects the experiment's data. The directory used here corresponds to the default download location when using the download_alic.py script in this repository. Generally, the file locations used in the example analysis scripts is consistent with the location and naming convention for this pipeline.
 DATA_ROOT = "~/Data/Alice"
@@ -20,6 +27,12 @@ SEGMENT_DURATION = {
     '11': 56.17,
     '12': 46.983,
 }
+# If the stimulus index (created by predictors/make_stimulus_index.py) is available, check that it is consistent with these durations
+STIMULUS_INDEX_PATH = Path(DATA_ROOT).expanduser() / 'stimuli' / 'index.json'
+if STIMULUS_INDEX_PATH.exists():
+    for stimulus, info in json.loads(STIMULUS_INDEX_PATH.read_text()).items():
+        if abs(info['duration'] - SEGMENT_DURATION.get(stimulus, 0)) > 0.001:
+            warnings.warn(f"Stimulus {stimulus}: duration in {STIMULUS_INDEX_PATH} ({info['duration']:.3f} s) differs from SEGMENT_DURATION in alice.py")
 
 # One may also want to define parameters used for estimating TRFs here, as they are often re-used along with the pipeline in multiple location (see notebooks in this directory and jobs.py for examples)
 PARAMETERS = {
@@ -51,6 +64,8 @@ class Alice(TRFExperiment):
     raw = {
         'raw': RawSource(connectivity='auto'),
         '0.5-20': RawFilter('raw', 0.5, 20, cache=False),
+        # The same filter, but the filtered data are resampled to 100 Hz and cached, so that each subject's data are filtered only once. This is opt-in: use raw='0.5-20-100Hz' instead of the default in PARAMETERS to use it. Since the raw state is part of the cache keys, TRFs that were estimated with '0.5-20' are not reused, but re-estimated (with slightly different results due to the resampling)
+        '0.5-20-100Hz': RawFilterDecimate('raw', 0.5, 20, samplingrate=100),
     }
 
     # This adds the segment duration (plus 1 second) to the events marking stimulus onset in the eeg files. For details see https://eelbrain.readthedocs.io/en/stable/experiment.html
@@ -77,6 +92,26 @@ class Alice(TRFExperiment):
         'auditory-gammatone': 'gammatone-8 + gammatone-on-8',
     }
 
+    def profile(self, trace_dir=None, trace_memory=True):
+        """Record wall time, memory and cache use of pipeline stages (see profiling.py)
+
+        Parameters
+        ----------
+        trace_dir : path-like
+            Write a JSONL trace for each subject and model to this directory.
+        trace_memory : bool
+            Record the memory high-water mark of each stage.
+
+        Examples
+        --------
+        Use as context manager::
+
+            with alice.profile('~/Data/Alice/traces') as profiler:
+                alice.load_trf_test('gammatone-1', **PARAMETERS, make=True)
+            print(profiler.summary())
+        """
+        return PipelineProfiler(self, trace_dir, trace_memory)
+
 
 # This creates an instance of the pipeline. Doing this here will allow other scripts to import the instance directly.
 alice = Alice(DATA_ROOT)
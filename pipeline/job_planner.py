@@ -0,0 +1,232 @@
+# This file implements a planner for batch-estimating TRFs. The jobs listed in jobs.py overlap: the same model can occur in several jobs, and a model comparison requires TRFs for two models. The planner expands a list of model and comparison expressions into the unique set of subject x model fits, and runs them on a local process pool, with all fits for a subject in the same worker, sharing the subject's EEG data and predictors. Run it through jobs.py::
+#
+#   $ python jobs.py
+#
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+import functools
+import importlib
+import os
+import re
+import sys
+import time
+
+import eelbrain
+
+
+# Operators for model comparisons (see https://trf-tools.readthedocs.io/doc/pipeline.html#models)
+COMPARISON = re.compile(r'\s+(\+@|@|>|<|=)\s+')
+# Methods of the experiment that load the inputs of a fit, shared between the fits for the same subject
+INPUT_METHODS = ('load_events', 'load_selected_events', 'load_epochs', 'load_predictor')
+# Pipeline state that determines what these methods load, besides their arguments
+STATE_FIELDS = ('subject', 'recording', 'raw', 'epoch', 'rej', 'samplingrate')
+
+
+@dataclass(frozen=True)
+class Fit:
+    "TRF estimate for one subject and one model"
+    subject: str
+    model: str  # the model as written in the expression (TRFs are cached under this name)
+    terms: tuple
+
+    @property
+    def n_features(self):
+        "Number of predictor time series (e.g., ``gammatone-8`` has 8 bands)"
+        return sum(int(match.group(1)) if (match := re.search(r'-(\d+)(\$\w+)?$', term)) else 1 for term in self.terms)
+
+
+class JobPlan:
+    """Unique subject x model fits needed for a list of models and model comparisons
+
+    Parameters
+    ----------
+    experiment : TRFExperiment
+        The pipeline instance.
+    expressions : sequence of str
+        Models (``'gammatone-1'``) and model comparisons
+        (``'gammatone-1 +@ gammatone-on-1'``).
+    shuffle : str
+        Shuffling method used for the null models of ``@`` and ``+@``
+        comparisons (the null model term is ``{term}${shuffle}``).
+    seconds_per_feature : scalar
+        Rough time estimate for fitting one predictor time series for one
+        subject (used for scheduling and for the time estimate).
+    load_seconds : scalar
+        Rough time estimate for loading and preprocessing one subject's data.
+    memory_per_worker : scalar
+        Memory required by a worker process (in GB).
+    **parameters
+        TRF parameters (see ``PARAMETERS`` in ``alice.py``).
+    """
+    def __init__(self, experiment, expressions, shuffle='shift', seconds_per_feature=30, load_seconds=20, memory_per_worker=4, **parameters):
+        self.experiment = experiment
+        self.shuffle = shuffle
+        self.seconds_per_feature = seconds_per_feature
+        self.load_seconds = load_seconds
+        self.memory_per_worker = memory_per_worker
+        self.parameters = parameters
+        self.named_models = getattr(type(experiment), 'models', {})
+        self.subjects = list(experiment.get_field_values('subject'))
+        # Models by their set of terms: a model that is written differently in several expressions is fit only once, under the name it first occurs with
+        models = {}
+        for expression in expressions:
+            for model in self._expand(expression):
+                terms = self._terms(model)
+                if terms:
+                    models.setdefault(frozenset(terms), (model, tuple(terms)))
+        self.models = [model for model, _ in models.values()]
+        # All fits, grouped by subject: fits for the same subject share the subject's EEG data
+        self.fits = {subject: [Fit(subject, model, terms) for model, terms in models.values()] for subject in self.subjects}
+
+    def _terms(self, model):
+        "Terms of a model, with named models expanded (in order of occurrence)"
+        terms = {}
+        for term in model.split(' + '):
+            term = term.strip()
+            if term in self.named_models:
+                terms.update(dict.fromkeys(self._terms(self.named_models[term])))
+            elif term != '0':
+                terms[term] = None
+        return list(terms)
+
+    def _expand(self, expression):
+        "Models (as strings) required by an expression"
+        parts = COMPARISON.split(expression.strip())
+        if len(parts) == 1:
+            return [parts[0]]
+        elif len(parts) != 3:
+            raise ValueError(f"{expression!r}: can only parse a single comparison")
+        left, operator, right = parts
+        if operator in ('>', '<', '='):
+            return [left, right]
+        term = right
+        x1 = f'{left} + {term}' if operator == '+@' else left
+        x1_terms = self._terms(x1)
+        if term not in x1_terms:
+            raise ValueError(f"{expression!r}: {term} is not in the model")
+        x0 = ' + '.join(f'{term}${self.shuffle}' if x == term else x for x in x1_terms)
+        return [x1, x0]
+
+    def fit_seconds(self, fit):
+        return self.seconds_per_feature * fit.n_features
+
+    def subject_seconds(self, subject):
+        return self.load_seconds + sum(self.fit_seconds(fit) for fit in self.fits[subject])
+
+    def n_workers(self):
+        "Number of worker processes, limited by CPU cores and memory"
+        n_cores = os.cpu_count() or 1
+        try:
+            memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1e9
+        except (ValueError, OSError, AttributeError):
+            n_memory = n_cores
+        else:
+            n_memory = max(1, int(memory // self.memory_per_worker))
+        return max(1, min(n_cores, n_memory, len(self.subjects)))
+
+    def estimate(self, n_workers=None):
+        """Time estimates (in seconds)
+
+        Returns
+        -------
+        critical_path : float
+            Duration of the longest chain of dependent tasks (one subject's
+            data, followed by all its fits), i.e. the minimum total time.
+        makespan : float
+            Expected total time with ``n_workers`` workers (longest subject
+            first scheduling).
+        """
+        if n_workers is None:
+            n_workers = self.n_workers()
+        durations = sorted((self.subject_seconds(subject) for subject in self.subjects), reverse=True)
+        workers = [0] * n_workers
+        for duration in durations:
+            workers[workers.index(min(workers))] += duration
+        return max(durations, default=0), max(workers)
+
+    def report(self, n_workers=None):
+        if n_workers is None:
+            n_workers = self.n_workers()
+        critical_path, makespan = self.estimate(n_workers)
+        n_fits = sum(len(fits) for fits in self.fits.values())
+        lines = [f"{len(self.models)} unique models x {len(self.subjects)} subjects = {n_fits} fits:"]
+        lines.extend(f"  {model}" for model in self.models)
+        lines.append(f"Workers: {n_workers}")
+        lines.append(f"Critical path: {critical_path / 60:.0f} min; expected total: {makespan / 60:.0f} min")
+        return '\n'.join(lines)
+
+    def run(self, n_workers=None):
+        "Estimate all TRFs (TRFs that are already cached are skipped by the pipeline)"
+        if n_workers is None:
+            n_workers = self.n_workers()
+        # Workers import the experiment from its module instead of receiving a pickled copy
+        module = type(self.experiment).__module__
+        name = next(key for key, value in vars(sys.modules[module]).items() if value is self.experiment)
+        subjects = sorted(self.subjects, key=self.subject_seconds, reverse=True)
+        with ProcessPoolExecutor(n_workers) as executor:
+            futures = {executor.submit(_run_fits, module, name, self.fits[subject], self.parameters): subject for subject in subjects}
+            for future in as_completed(futures):
+                print(f"{futures[future]} done ({future.result():.0f} s)")
+
+
+class SharedInputs:
+    """Context manager that shares the experiment's inputs (EEG data and predictors) between fits
+
+    While active, the results of the experiment's public loading methods
+    (``INPUT_METHODS``) are kept, so that fits for the same subject load and
+    preprocess the data only once. Datasets are returned as shallow copies,
+    so that adding variables to them does not affect other fits.
+    """
+    def __init__(self, experiment):
+        self.experiment = experiment
+        self.hits = 0
+        self.misses = 0
+        self._names = []
+
+    def __enter__(self):
+        for name in INPUT_METHODS:
+            if hasattr(self.experiment, name):
+                setattr(self.experiment, name, self._memoize(getattr(self.experiment, name)))
+                self._names.append(name)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # Remove the instance attributes to restore the methods
+        for name in self._names:
+            delattr(self.experiment, name)
+        self._names = []
+
+    def _state(self):
+        state = []
+        for field in STATE_FIELDS:
+            try:
+                state.append(self.experiment.get(field))
+            except KeyError:
+                state.append(None)
+        return tuple(state)
+
+    def _memoize(self, function):
+        results = {}
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            # The experiment's state (e.g., the current subject) determines what is loaded
+            key = (repr(args), repr(sorted(kwargs.items())), self._state())
+            if key in results:
+                self.hits += 1
+            else:
+                self.misses += 1
+                results[key] = function(*args, **kwargs)
+            result = results[key]
+            return result.copy() if isinstance(result, eelbrain.Dataset) else result
+        return wrapper
+
+
+def _run_fits(module, name, fits, parameters):
+    "Worker: estimate all fits for one subject in the same process, sharing their inputs"
+    t0 = time.time()
+    experiment = getattr(importlib.import_module(module), name)
+    with SharedInputs(experiment):
+        for fit in fits:
+            experiment.load_trfs(fit.subject, fit.model, make=True, **parameters)
+    return time.time() - t0
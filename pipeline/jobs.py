@@ -2,14 +2,27 @@
 #
 #   $ trf-tools-make-jobs jobs.py
 #
+# Alternatively, run this file as a script to estimate the TRFs with the job planner in job_planner.py, which computes each subject x model fit only once, and prints a time estimate before starting::
+#
+#   $ python jobs.py
+#
 from alice import PARAMETERS, alice
 
 
-JOBS = [
+MODELS = [
     # Batch-compute TRFs for all subjects:
-    alice.trf_job('gammatone-1', **PARAMETERS),
-    alice.trf_job('gammatone-1 + gammatone-on-1', **PARAMETERS),
-    alice.trf_job('gammatone-8 + gammatone-on-8', **PARAMETERS),
+    'gammatone-1',
+    'gammatone-1 + gammatone-on-1',
+    'gammatone-8 + gammatone-on-8',
     # Batch compute TRFs for both models in a model comparison:
-    alice.trf_job('auditory-gammatone @ gammatone-on-8', **PARAMETERS),
+    'auditory-gammatone @ gammatone-on-8',
 ]
+JOBS = [alice.trf_job(model, **PARAMETERS) for model in MODELS]
+
+
+if __name__ == '__main__':
+    from job_planner import JobPlan
+
+    plan = JobPlan(alice, MODELS, **PARAMETERS)
+    print(plan.report())
+    plan.run()
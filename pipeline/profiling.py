@@ -0,0 +1,207 @@
+# This file implements opt-in instrumentation for the TRFExperiment pipeline. While active, the profiler records, for each pipeline stage (reading raw data, filtering, loading events/epochs, loading predictors, boosting), the wall time, the memory high-water mark and whether a cached file was used. Only public methods are wrapped; filtering is recorded as the cache update of the filtered raw state (``cache <raw>`` stages). Use it through Alice.profile() in alice.py:
+#
+#   with alice.profile('~/Data/Alice/traces') as profiler:
+#       alice.show_model_test('gammatone-1 +@ gammatone-on-1', **PARAMETERS, make=True)
+#   print(profiler.summary())
+#
+from collections import defaultdict
+import json
+from pathlib import Path
+import resource
+import sys
+import time
+import tracemalloc
+
+import eelbrain
+from eelbrain import fmtxt
+
+
+# Methods of the experiment that are instrumented, with the position of the model argument
+TOP_LEVEL_METHODS = {
+    'load_trf': 0,
+    'load_trfs': 1,
+    'load_trf_test': 0,
+    'load_model_test': 0,
+    'show_model_test': 0,
+}
+STAGE_METHODS = {
+    'load_raw': 'raw',
+    'load_events': 'events',
+    'load_selected_events': 'events',
+    'load_epochs': 'epochs',
+    'load_predictor': 'predictors',
+}
+
+
+class PipelineProfiler:
+    """Record the duration of pipeline stages (see module comment for usage)
+
+    Parameters
+    ----------
+    experiment : TRFExperiment
+        The pipeline instance.
+    trace_dir : path-like
+        Directory for JSONL traces (one file per subject and model). If
+        ``None``, records are only kept in memory (``profiler.records``).
+    trace_memory : bool
+        Record the memory high-water mark of each stage (with
+        :mod:`tracemalloc`, which slows down Python code).
+    """
+    def __init__(self, experiment, trace_dir=None, trace_memory=True):
+        self.experiment = experiment
+        self.trace_dir = None if trace_dir is None else Path(trace_dir).expanduser()
+        self.trace_memory = trace_memory
+        self.records = []
+        self._stack = []
+        self._restore = []
+
+    def __enter__(self):
+        raw_pipes = self._raw_pipes()
+        if self.trace_dir is not None:
+            self.trace_dir.mkdir(parents=True, exist_ok=True)
+        if self.trace_memory:
+            tracemalloc.start()
+        experiment = self.experiment
+        for name, model_arg in TOP_LEVEL_METHODS.items():
+            if hasattr(experiment, name):
+                self._wrap(experiment, name, 'total', model_arg)
+        for name, stage in STAGE_METHODS.items():
+            if hasattr(experiment, name):
+                self._wrap(experiment, name, stage)
+        # Raw pipes: reading the data, and updating cached (filtered) data
+        for pipe in raw_pipes:
+            self._wrap(pipe, 'load', f'raw {pipe.name}')
+            if hasattr(pipe, 'cache'):
+                self._wrap_cache(pipe)
+        # Boosting: replace the function in modules that imported it
+        for module in list(sys.modules.values()):
+            if getattr(module, '__name__', '').startswith('trftools') and getattr(module, 'boosting', None) is eelbrain.boosting:
+                self._wrap(module, 'boosting', 'boosting')
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for obj, name, original in reversed(self._restore):
+            if original is None:
+                delattr(obj, name)
+            else:
+                setattr(obj, name, original)
+        self._restore = []
+        if self.trace_memory:
+            tracemalloc.stop()
+
+    def _raw_pipes(self):
+        # The only private attribute used: the experiment's raw pipes (name -> RawPipe)
+        pipes = getattr(self.experiment, '_raw', None)
+        if not isinstance(pipes, dict) or not all(hasattr(pipe, 'load') for pipe in pipes.values()):
+            raise RuntimeError(f"{type(self.experiment).__name__}._raw: raw pipes not found; the installed eelbrain version is not supported by profiling.py")
+        return pipes.values()
+
+    def _patch(self, obj, name, wrapper):
+        # Instance attributes shadow the class method; for modules, restore the original function
+        original = getattr(obj, name) if name in vars(obj) else None
+        self._restore.append((obj, name, original))
+        setattr(obj, name, wrapper)
+
+    def _wrap(self, obj, name, stage, model_arg=None):
+        function = getattr(obj, name)
+
+        def wrapper(*args, **kwargs):
+            if stage == 'total' and any(frame['stage'] == 'total' for frame in self._stack):
+                # Nested top-level call (e.g., show_model_test() calls load_model_test())
+                return function(*args, **kwargs)
+            model = None
+            if model_arg is not None:
+                model = args[model_arg] if len(args) > model_arg else kwargs.get('x')
+                if isinstance(model, dict):
+                    model = ', '.join(map(str, model.values()))
+            self._enter(stage, model)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._exit()
+        self._patch(obj, name, wrapper)
+
+    def _wrap_cache(self, pipe):
+        function = pipe.cache
+
+        def wrapper(subject, recording):
+            self._enter(f'cache {pipe.name}')
+            try:
+                raw = function(subject, recording)
+                # CachedRawPipe.cache() returns None if the cached file was up to date
+                self._stack[-1]['cache'] = 'miss' if raw is not None else 'hit'
+                return raw
+            finally:
+                self._exit()
+        self._patch(pipe, 'cache', wrapper)
+
+    def _enter(self, stage, model=None):
+        if self.trace_memory:
+            if self._stack:
+                parent = self._stack[-1]
+                parent['peak'] = max(parent['peak'], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        if model is None:
+            model = self._stack[-1]['model'] if self._stack else ''
+        frame = {'stage': stage, 'model': model, 'start': time.time(), 'children': 0., 'peak': 0, 'cache': None, 'boosting': False}
+        self._stack.append(frame)
+
+    def _exit(self):
+        frame = self._stack.pop()
+        seconds = time.time() - frame['start']
+        if self.trace_memory:
+            frame['peak'] = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        if frame['stage'] == 'boosting':
+            frame['boosting'] = True
+        elif frame['stage'] == 'total' and frame['cache'] is None:
+            # TRFs were loaded from the cache if no boosting happened
+            frame['cache'] = 'miss' if frame['boosting'] else 'hit'
+        if self._stack:
+            parent = self._stack[-1]
+            parent['children'] += seconds
+            parent['peak'] = max(parent['peak'], frame['peak'])
+            parent['boosting'] |= frame['boosting']
+        # Peak resident memory of this process and its (finished) children, in MB (ru_maxrss is in kB on Linux and in bytes on macOS)
+        unit = 2 ** 20 if sys.platform == 'darwin' else 2 ** 10
+        maxrss = sum(resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)) / unit
+        record = {
+            'subject': self.experiment.get('subject'),
+            'model': frame['model'],
+            'stage': frame['stage'],
+            'start': frame['start'],
+            'seconds': seconds,
+            # Time spent in this stage itself, excluding nested stages
+            'self_seconds': seconds - frame['children'],
+            'peak_mb': frame['peak'] / 2 ** 20 if self.trace_memory else None,
+            'maxrss_mb': maxrss,
+            'cache': frame['cache'],
+        }
+        self.records.append(record)
+        if self.trace_dir is not None:
+            name = f"{record['subject']} {record['model']}".strip().replace('/', '_')
+            with (self.trace_dir / f'{name}.jsonl').open('a') as file:
+                file.write(json.dumps(record) + '\n')
+
+    def summary(self):
+        """Table with the total time per stage
+
+        Times for the ``total`` stage include all other stages; for the
+        remaining stages, times exclude nested stages (e.g., reading raw data
+        for filtering).
+        """
+        stages = defaultdict(list)
+        for record in self.records:
+            stages[record['stage']].append(record)
+        table = fmtxt.Table('lrrrrl')
+        table.cells('Stage', 'n', 'Time (s)', 'Mean (s)', 'Peak (MB)', 'Cache hit/miss')
+        table.midrule()
+        for stage, records in stages.items():
+            key = 'seconds' if stage == 'total' else 'self_seconds'
+            seconds = sum(record[key] for record in records)
+            peaks = [record['peak_mb'] for record in records if record['peak_mb'] is not None]
+            peak = f'{max(peaks):.0f}' if peaks else ''
+            cache = [record['cache'] for record in records if record['cache']]
+            cache = f"{cache.count('hit')}/{cache.count('miss')}" if cache else ''
+            table.cells(stage, len(records), f'{seconds:.1f}', f'{seconds / len(records):.2f}', peak, cache)
+        return table
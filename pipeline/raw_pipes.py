@@ -0,0 +1,43 @@
+# This file defines additional raw preprocessing steps for the pipeline in alice.py
+from eelbrain.pipeline import RawFilter
+
+
+class RawFilterDecimate(RawFilter):
+    """Band-pass filter raw data and reduce the sampling rate before caching
+
+    Like :class:`eelbrain.pipeline.RawFilter`, but the filtered data are
+    resampled to ``samplingrate`` and cached. The cache is a single precision
+    (float32) FIFF file that is read lazily, i.e., epochs are read directly
+    from the file, without loading the whole recording. Since the data are
+    filtered only once per subject, repeated model comparisons do not need to
+    re-filter the data.
+
+    Parameters
+    ----------
+    source
+        Name of the raw pipe to use for input data.
+    l_freq
+        Low cut-off frequency in Hz.
+    h_freq
+        High cut-off frequency in Hz (needs to be below the Nyquist frequency
+        of ``samplingrate``).
+    samplingrate
+        Sampling rate of the cached data (in Hz). Should be a multiple of the
+        ``samplingrate`` of the epochs using this raw state.
+    ...
+        :meth:`mne.io.Raw.filter` parameters.
+    """
+    def __init__(self, source, l_freq=None, h_freq=None, samplingrate=100, n_jobs=1, **kwargs):
+        if h_freq is None or h_freq >= samplingrate / 2:
+            raise ValueError(f"{h_freq=}: needs to be below the Nyquist frequency of {samplingrate=}")
+        RawFilter.__init__(self, source, l_freq, h_freq, True, n_jobs, **kwargs)
+        self.samplingrate = samplingrate
+
+    def _as_dict(self, args=()):
+        return RawFilter._as_dict(self, [*args, 'samplingrate'])
+
+    def _make(self, subject, recording, preload):
+        raw = RawFilter._make(self, subject, recording, preload)
+        self.log.info("Raw %s: resampling to %s Hz for %s/%s...", self.name, self.samplingrate, subject, recording)
+        # The data are already low-pass filtered, so the resampling filter does not affect the passband
+        return raw.resample(self.samplingrate, n_jobs=self.n_jobs)
@@ -0,0 +1,59 @@
+"""
+Index with the duration and number of samples of each stimulus
+
+Scripts and the pipeline read the index (``stimuli/index.json``) instead of
+loading whole spectrograms only to find out how long each stimulus is. The
+index also contains a hash of each stimulus and predictor file, so that
+changed files can be detected.
+
+Run this script after the other predictor scripts (the time axis is taken
+from the ``gammatone-1`` predictor, and all predictor files are hashed).
+"""
+import hashlib
+import json
+from pathlib import Path
+import wave
+
+import eelbrain
+
+
+# Define paths to data
+DATA_ROOT = Path("~").expanduser() / 'Data' / 'Alice'
+STIMULUS_DIR = DATA_ROOT / 'stimuli'
+PREDICTOR_DIR = DATA_ROOT / 'predictors'
+# Sampling rates (in Hz) at which predictors are used
+SAMPLINGRATES = [1000, 100, 50]
+
+
+def file_hash(path):
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+index = {}
+for i in range(1, 13):
+    stimulus = str(i)
+    wav_path = STIMULUS_DIR / f'{stimulus}.wav'
+    # Only the header of the wav file is needed for its duration
+    with wave.open(str(wav_path)) as file:
+        wav_samplingrate = file.getframerate()
+        duration = file.getnframes() / wav_samplingrate
+    # The time axis of all predictors derives from the 1 kHz gammatone spectrogram
+    time = eelbrain.load.unpickle(PREDICTOR_DIR / f'{stimulus}~gammatone-1.pickle').time
+    # Binning with label='start' includes the last, partial bin
+    n_samples = {}
+    for samplingrate in SAMPLINGRATES:
+        factor = int(round(1 / (time.tstep * samplingrate)))
+        n_samples[str(samplingrate)] = -(-time.nsamples // factor)
+    hashes = {'wav': file_hash(wav_path)}
+    for path in sorted(PREDICTOR_DIR.glob(f'{stimulus}~*.pickle')):
+        hashes[path.stem.split('~', 1)[1]] = file_hash(path)
+    index[stimulus] = {
+        'duration': duration,
+        'wav_samplingrate': wav_samplingrate,
+        'tmin': time.tmin,
+        'n_samples': n_samples,
+        'sha256': hashes,
+    }
+
+with (STIMULUS_DIR / 'index.json').open('w') as file:
+    json.dump(index, file, indent=2)